@@ -0,0 +1,4 @@
+# Protein secondary structure prediction with HMM topologies sampled by
+# MCMC. The tools are run through the mchmm command (cli.py), or each with
+# python -m mc_hmmer.<module>. Nothing is imported here, so that each
+# command only pays for the modules it uses.
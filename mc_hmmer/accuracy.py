@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+# Percent of residues predicted wrongly for each protein of a test set,
+# written to stderr as "id<TAB>chain<TAB>percent" lines.
+
+import argparse
+import csv
+import sys
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score the predictions of "
+                                     "a sample of models on a test set")
+    parser.add_argument("-m", "--models", default="models.pkl",
+                        help="sampled models from mcmc.py, or an archive of "
+                        "them made by archive.py")
+    parser.add_argument("--paper", metavar="DIR",
+                        help="score the BMC paper model in DIR instead")
+    parser.add_argument("--test", default="test.fasta",
+                        help="FASTA of sequence/secstr pairs, or a store "
+                        "built by store.py")
+    parser.add_argument("--combine", choices=["vote", "posterior"],
+                        default="vote", help="how to combine the models")
+    args = parser.parse_args(argv)
+
+    from .predict import Predictor
+    from .data import load_records
+    predictor = Predictor(args.models, args.paper, args.combine)
+    ids, seqs, states = load_records(args.test)
+
+    writer = csv.writer(sys.stderr, delimiter="\t")
+    for protein, seq, true_states in zip(ids, seqs, states):
+        estimated_states = predictor.predict(seq)
+
+        errors = 0
+        total = 0
+
+        for i in range(len(estimated_states)):
+            if true_states[i] != estimated_states[i]:
+                errors += 1
+            total += 1
+
+        writer.writerow(protein.split(":")[:2] + [errors*100.0/total])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
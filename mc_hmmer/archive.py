@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+# A compact binary archive of sampled models, for loading without mcmc.py
+# (and so without Biopython and the rest) and for reading single models
+# straight out of a memory map.
+#
+# usage: python -m mc_hmmer.archive convert models.pkl models.mca [--float32]
+#        python -m mc_hmmer.archive info models.mca
+#        python -m mc_hmmer.archive bench models.pkl models.mca
+#        python -m mc_hmmer.archive test [models.pkl]
+#
+# Layout, all little-endian:
+#   HEADER        magic, version, bytes per float (8 or 4), number of
+#                 distinct models, number of samples, and the label alphabet
+#                 (one byte per label, NUL-padded)
+#   index         one INDEX entry per distinct model: the offset of its
+#                 data and its number of states
+#   samples       a uint32 per sample: which distinct model it is
+#   data          per distinct model, 8-byte aligned: a ((states+1) x
+#                 states floats), e (20 x states floats) and one uint8
+#                 label code per state
+# Identical models (same a, e and labels, bit for bit) are stored once, so
+# a sample in which the chain stayed put costs four bytes per repeat.
+
+import mmap
+import struct
+import sys
+import numpy as np
+
+ARCHIVE_MAGIC = b"MCHMMARC"
+VERSION = 1
+HEADER = struct.Struct("<8sHHII16s")
+INDEX = struct.Struct("<QI4x")
+
+def align(n):
+    return (n + 7) & ~7
+
+class ArchivedModel:
+    """The a, e and labels of one model of an archive; enough for
+    ensemble.Ensemble, and for mcmc.Model(m.a, m.e, m.labels)"""
+    __slots__ = ["a", "e", "labels"]
+
+    def __init__(self, a, e, labels):
+        self.a = a
+        self.e = e
+        self.labels = labels
+
+def is_archive(path):
+    with open(path, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+def write_archive(path, models, dtype=np.float64):
+    """Write a list of models (anything with a, e and labels) to path"""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    alphabet = sorted(set(x for m in models for x in m.labels))
+    if len(alphabet) > 16 or any(len(x) != 1 for x in alphabet):
+        raise ValueError("labels must be at most 16 single characters")
+
+    distinct = []
+    index = {}
+    samples = []
+    for m in models:
+        a = np.asarray(m.a, dtype=float)
+        e = np.asarray(m.e, dtype=float)
+        codes = bytes(alphabet.index(x) for x in m.labels)
+        key = (a.shape, a.tobytes(), e.tobytes(), codes)
+        if key not in index:
+            index[key] = len(distinct)
+            distinct.append((a, e, codes))
+        samples.append(index[key])
+
+    offset = align(HEADER.size + INDEX.size * len(distinct) +
+                   4 * len(samples))
+    entries = []
+    for a, e, codes in distinct:
+        entries.append(INDEX.pack(offset, len(codes)))
+        offset = align(offset + (a.size + e.size) * dtype.itemsize +
+                       len(codes))
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(ARCHIVE_MAGIC, VERSION, dtype.itemsize,
+                            len(distinct), len(samples),
+                            "".join(alphabet).encode("ascii")))
+        f.write(b"".join(entries))
+        f.write(np.array(samples, dtype="<u4").tobytes())
+        for a, e, codes in distinct:
+            f.write(b"\0" * (align(f.tell()) - f.tell()))
+            f.write(a.astype(dtype).tobytes())
+            f.write(e.astype(dtype).tobytes())
+            f.write(codes)
+        f.write(b"\0" * (align(f.tell()) - f.tell()))
+    return len(distinct)
+
+class ModelArchive:
+    """Read access to an archive through a memory map
+
+    archive[k] is the k-th sample and model(i) the i-th distinct model;
+    nothing is read until a model is asked for, and then only its own
+    bytes. The arrays of a float64 archive are read-only views of the map,
+    those of a float32 one are converted to float64 copies.
+    """
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.itemsize, self.count, samples,
+         alphabet) = HEADER.unpack_from(self.map, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("{} is not a model archive".format(path))
+        if version != VERSION:
+            raise ValueError("{} has archive version {}, expected {}".format(
+                             path, version, VERSION))
+        self.dtype = np.dtype("<f{}".format(self.itemsize))
+        self.alphabet = alphabet.rstrip(b"\0").decode("ascii")
+        self.index = [INDEX.unpack_from(self.map, HEADER.size + i * INDEX.size)
+                      for i in range(self.count)]
+        self.samples = np.frombuffer(self.map, dtype="<u4", count=samples,
+                                     offset=HEADER.size +
+                                     INDEX.size * self.count)
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.samples)
+
+    def model(self, i):
+        """The i-th distinct model"""
+        if i not in self.cache:
+            offset, states = self.index[i]
+            n = (states + 1) * states
+            a = np.frombuffer(self.map, self.dtype, n, offset)
+            offset += n * self.itemsize
+            e = np.frombuffer(self.map, self.dtype, 20 * states, offset)
+            offset += 20 * states * self.itemsize
+            codes = self.map[offset:offset+states]
+            if self.itemsize != 8:
+                a = a.astype(float)
+                e = e.astype(float)
+                a.flags.writeable = False
+                e.flags.writeable = False
+            self.cache[i] = ArchivedModel(a.reshape(states + 1, states),
+                e.reshape(20, states), tuple(self.alphabet[c] for c in codes))
+        return self.cache[i]
+
+    def __getitem__(self, k):
+        return self.model(int(self.samples[k]))
+
+    def models(self):
+        """Every sample in order; repeats are the same object"""
+        return [self.model(int(i)) for i in self.samples]
+
+    def counts(self):
+        """How many times each distinct model was sampled"""
+        return np.bincount(self.samples, minlength=self.count)
+
+    def close(self):
+        """Unmap the archive; raises BufferError while arrays of its models
+        are still around"""
+        self.cache = {}
+        self.samples = None
+        self.map.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_models(path):
+    """Every sample of the archive at path, as ArchivedModel objects"""
+    archive = ModelArchive(path)
+    return archive.models()
+
+def convert(source, path, dtype=np.float64):
+    """Write the models of a pickle or sample file from mcmc.py to an
+    archive"""
+    from . import mcmc
+    models = mcmc.load_models(source)
+    distinct = write_archive(path, models, dtype)
+    return (len(models), distinct)
+
+def bench(pickled, path, repeat=5):
+    """Size and load time of a pickle and the archive made from it, both in
+    a fresh interpreter (imports included) and warm"""
+    import os
+    import subprocess
+    import timeit
+    from . import mcmc
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pickled = os.path.abspath(pickled)
+    path = os.path.abspath(path)
+
+    def cold(statement):
+        # run from the directory holding the package, so it can be imported
+        # even if it isn't installed
+        best = None
+        for i in range(repeat):
+            out = subprocess.run([sys.executable, "-c",
+                "import time; start = time.perf_counter(); " + statement +
+                "; print(time.perf_counter() - start)"], cwd=root,
+                capture_output=True, text=True, check=True).stdout
+            best = min(best or float("inf"), float(out))
+        return best
+
+    rows = [("pickle", pickled, cold("from {} import mcmc; "
+                                     "mcmc.load_models({!r})".format(
+                                     __package__, pickled)),
+             min(timeit.repeat(lambda: mcmc.load_models(pickled),
+                               number=1, repeat=repeat))),
+            ("archive", path, cold("from {} import archive; "
+                                   "archive.load_models({!r})".format(
+                                   __package__, path)),
+             min(timeit.repeat(lambda: load_models(path),
+                               number=1, repeat=repeat)))]
+    for name, p, cold_time, warm_time in rows:
+        print("{}\t{:.1f} KB\tcold {:.1f} ms\twarm {:.2f} ms".format(name,
+              os.path.getsize(p) / 1024.0, 1000 * cold_time,
+              1000 * warm_time))
+
+def test_archive(source="models.pkl"):
+    """Convert a pickle or sample file to float64 and float32 archives in a
+    temporary directory and check every sample read back through the map
+    against the original, along with the deduplication counts"""
+    import os
+    import tempfile
+    from . import mcmc
+    # with every third model repeated, so there is something to deduplicate
+    models = mcmc.load_models(source)
+    models = models + models[::3]
+    keys = [(np.asarray(m.a).tobytes(), np.asarray(m.e).tobytes(),
+             tuple(m.labels)) for m in models]
+    first = list(dict.fromkeys(keys))
+    expected = [keys.count(key) for key in first]
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in [np.float64, np.float32]:
+            path = os.path.join(tmp, "models.mca")
+            assert write_archive(path, models, dtype) == len(first)
+            with ModelArchive(path) as archive:
+                assert len(archive) == len(models)
+                assert archive.counts().tolist() == expected
+                for m, stored in zip(models, archive.models()):
+                    a = np.asarray(m.a, dtype=float)
+                    e = np.asarray(m.e, dtype=float)
+                    assert stored.labels == tuple(m.labels)
+                    assert np.array_equal(stored.a, a.astype(dtype))
+                    assert np.array_equal(stored.e, e.astype(dtype))
+                stored = None
+            print("float{}: {} samples, {} distinct models, read back "
+                  "intact".format(8 * np.dtype(dtype).itemsize, len(models),
+                                  len(first)))
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Compact model archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("convert", help="convert models.pkl or a sample "
+                            "file to an archive")
+    p.add_argument("source")
+    p.add_argument("archive")
+    p.add_argument("--float32", action="store_true",
+                   help="store single precision floats, half the size")
+    p = commands.add_parser("info", help="summarize an archive")
+    p.add_argument("archive")
+    p = commands.add_parser("bench", help="compare size and load time with "
+                            "the pickle")
+    p.add_argument("source")
+    p.add_argument("archive")
+    p = commands.add_parser("test", help="check that archives give back the "
+                            "models they were made from")
+    p.add_argument("source", nargs="?", default="models.pkl")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        samples, distinct = convert(args.source, args.archive,
+                                    np.float32 if args.float32 else np.float64)
+        print("Wrote {} samples, {} distinct models, to {}".format(
+              samples, distinct, args.archive))
+    elif args.command == "info":
+        with ModelArchive(args.archive) as archive:
+            print("{} samples, {} distinct models, float{}, labels {}".format(
+                  len(archive), archive.count, 8 * archive.itemsize,
+                  archive.alphabet))
+            for i, n in enumerate(archive.counts()):
+                print("{}\t{} states\t{} samples".format(i,
+                      archive.index[i][1], n))
+    elif args.command == "bench":
+        bench(args.source, args.archive)
+    else:
+        test_archive(args.source)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# Baum-Welch re-estimation of the transition and emission probabilities of
+# a model with a fixed topology. The E-step runs forwardAlgorithm and
+# backwardAlgorithm on each sequence and sums the expected counts, either
+# serially or on the workers of a parallel.ParallelLikelihood; the M-step
+# renormalizes them. In labeled mode each position may only be in a state
+# with the label of its secstr annotation, which is done by giving the
+# kernels a 60-letter alphabet of (residue, label) pairs whose emission
+# probability is zero in the states with other labels.
+
+import time
+import numpy as np
+from .viterbi import encode, forwardAlgorithm, backwardAlgorithm, Topology
+
+LABELS = "ABO"
+
+class Counts:
+    """Expected begin, transition and emission counts over some sequences"""
+    def __init__(self, states):
+        self.begin = np.zeros(states)
+        self.transitions = np.zeros((states, states))
+        self.emissions = np.zeros((20, states))
+        self.loglik = 0.0
+        self.sequences = 0
+        self.residues = 0
+        self.skipped = 0
+
+    def __iadd__(self, other):
+        self.begin += other.begin
+        self.transitions += other.transitions
+        self.emissions += other.emissions
+        self.loglik += other.loglik
+        self.sequences += other.sequences
+        self.residues += other.residues
+        self.skipped += other.skipped
+        return self
+
+def labeled_emissions(e, labels):
+    """Emission matrix over (residue, label) pairs: row 3*c + l is e[c] in
+    the states labelled LABELS[l] and 0 elsewhere"""
+    E = np.asarray(e, dtype=float)
+    codes = np.array([LABELS.index(x) for x in labels])
+    allowed = np.arange(len(LABELS))[:, None] == codes[None, :]
+    return (E[:, None, :] * allowed[None, :, :]).reshape(-1, E.shape[1])
+
+def labeled_codes(seq, structure):
+    """Residue codes of seq combined with the label codes in structure
+    (0, 1, 2 for A, B, O) into codes for labeled_emissions"""
+    return (encode(seq).astype(np.uint8) * 3 +
+            np.asarray(structure, dtype=np.uint8)).astype(np.uint8)
+
+def expected_counts(e, a, labels, seqs, structures=None):
+    """E-step over seqs; structures holds the label codes of each sequence
+    (or None for a sequence without them) for the labeled mode
+
+    A sequence that has probability 0 under the model (or its labels) can't
+    contribute and is counted as skipped.
+    """
+    E = np.asarray(e, dtype=float)
+    T = np.asarray(a, dtype=float)
+    T1 = T[1:]
+    topology = Topology(T)
+    counts = Counts(T.shape[1])
+    Elabeled = None
+    for k, seq in enumerate(seqs):
+        c = encode(seq)
+        n = len(c)
+        if n == 0:
+            continue
+        structure = None if structures is None else structures[k]
+        if structure is None:
+            emissions, codes = E, c
+        else:
+            if Elabeled is None:
+                Elabeled = labeled_emissions(E, labels)
+            emissions, codes = Elabeled, labeled_codes(c, structure)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            F, scale, logprob = forwardAlgorithm(emissions, T, codes, topology)
+        if not np.isfinite(logprob):
+            counts.skipped += 1
+            continue
+        B = backwardAlgorithm(emissions, T, codes, scale, topology)
+        Fs = F[1:, 1:]
+        Bs = B[1:, 1:]
+
+        # posterior state probabilities, one row per position
+        gamma = Fs * Bs
+        gamma /= gamma.sum(axis=1)[:, None]
+        counts.begin += gamma[0]
+        np.add.at(counts.emissions, c, gamma)
+
+        # expected transitions: xi[i][k][l] is proportional to
+        # F[i][k] a[k][l] e[c[i+1]][l] B[i+1][l], normalized per position
+        if n > 1:
+            W = emissions[codes[1:]] * Bs[1:]
+            norm = (np.dot(Fs[:-1], T1) * W).sum(axis=1)
+            counts.transitions += T1 * np.dot((Fs[:-1] / norm[:, None]).T, W)
+
+        counts.loglik += logprob
+        counts.sequences += 1
+        counts.residues += n
+    return counts
+
+def maximize(m, counts, pseudocount=1e-3):
+    """The M-step: m with its probabilities re-estimated from counts
+
+    Every edge of m gets pseudocount added (and absent edges none), so that
+    no edge is lost and the topology stays the same; every emission gets
+    pseudocount too. Rows with no counts at all keep their old values.
+    """
+    a = np.array(m.a, dtype=float)
+    expected = np.vstack((counts.begin, counts.transitions))
+    rows = expected.sum(axis=1) > 0
+    expected = (expected[rows] + pseudocount) * (a[rows] != 0)
+    a[rows] = expected / expected.sum(axis=1)[:, None]
+
+    e = np.array(m.e, dtype=float)
+    expected = counts.emissions + pseudocount
+    totals = counts.emissions.sum(axis=0)
+    columns = totals > 0
+    e[:, columns] = expected[:, columns] / expected[:, columns].sum(axis=0)
+    return m.replace(a=a, e=e, same_edges=True)
+
+def structure_codes(states):
+    """Label codes of a list of annotations (None for none), as taken by
+    expected_counts"""
+    return [None if s is None else np.array([LABELS.index(x) for x in s],
+                                            dtype=np.uint8) for s in states]
+
+def baum_welch(m, seqs, structures=None, iterations=5, tolerance=1e-2,
+               pool=None, pseudocount=1e-3, report=None):
+    """Run up to iterations EM steps from m, stopping early once the log
+    likelihood improves by less than tolerance
+
+    The E-step runs on pool (a ParallelLikelihood built with the same
+    sequences and structures) if one is given. report, if given, is called
+    with each step's statistics. Returns the final model and the list of
+    statistics, one dict per step; the log likelihood in each is that of the
+    model going into the step.
+    """
+    history = []
+    previous = None
+    for step in range(iterations):
+        start = time.time()
+        if pool is not None:
+            counts = pool.expected_counts(m, structures is not None)
+        else:
+            counts = expected_counts(m.e, m.a, m.labels, seqs, structures)
+        m = maximize(m, counts, pseudocount)
+        elapsed = time.time() - start
+        stats = {"step": step, "loglik": counts.loglik,
+                 "improvement": (None if previous is None
+                                 else counts.loglik - previous),
+                 "seconds": elapsed, "residues": counts.residues,
+                 "residues_per_second": counts.residues / elapsed,
+                 "skipped": counts.skipped}
+        history.append(stats)
+        if report is not None:
+            report(stats)
+        if previous is not None and counts.loglik - previous < tolerance:
+            break
+        previous = counts.loglik
+    return (m, history)
+
+def print_stats(stats):
+    print("EM step {step}: loglik {loglik:.3f}, {residues} residues in "
+          "{seconds:.3f}s ({residues_per_second:.0f}/s), {skipped} "
+          "skipped".format(**stats) +
+          ("" if stats["improvement"] is None
+           else ", improvement {:.3f}".format(stats["improvement"])))
+
+def test_baum_welch(processes=2, iterations=5):
+    """Fit the starting model and a sampled one on train.fasta, labeled and
+    not, and check that the parallel E-step gives the serial counts"""
+    from .mcmc import load_train_data, initial_model, load_models
+    from .parallel import ParallelLikelihood
+    seqs, states = load_train_data()
+    structures = structure_codes(states)
+    models = [("initial", initial_model(seqs, states)),
+              ("sampled", load_models()[0])]
+
+    with ParallelLikelihood(seqs, processes, structures) as pool:
+        for name, m in models:
+            for labeled in [False, True]:
+                s = structures if labeled else None
+                serial = expected_counts(m.e, m.a, m.labels, seqs, s)
+                parallel = pool.expected_counts(m, labeled)
+                assert np.allclose(serial.transitions, parallel.transitions)
+                assert np.allclose(serial.emissions, parallel.emissions)
+                assert abs(serial.loglik - parallel.loglik) <= \
+                    1e-9 * abs(serial.loglik)
+
+                print("{} model, {} states, {}:".format(name, len(m.labels),
+                      "labeled" if labeled else "unlabeled"))
+                fitted, history = baum_welch(m, seqs, s, iterations,
+                                             pool=pool, report=print_stats)
+                losses = [h["loglik"] for h in history]
+                assert all(y >= x - 1e-6 * abs(x)
+                           for x, y in zip(losses, losses[1:]))
+
+if __name__ == "__main__":
+    test_baum_welch()
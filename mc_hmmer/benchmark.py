@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the DP kernels in viterbi.py, the moves in moves.py and
+# whole MCMC and prediction runs.
+#
+# usage: python -m mc_hmmer.benchmark run [-o results.json] [--quick]
+#        python -m mc_hmmer.benchmark compare base.json new.json
+#            [--threshold 0.1]
+#        python -m mc_hmmer.benchmark density
+#        python -m mc_hmmer.benchmark startup
+#
+# run stores the best time of each benchmark (lower is better) along with
+# the environment it ran in; compare lists the ratio of every benchmark
+# present in both files and exits with status 1 if any got slower by more
+# than the threshold.
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from . import viterbi
+
+def random_model(states, density, rng):
+    """Random (e, t) with about density of the state-to-state transitions
+    present; every state keeps its self-transition so no row is empty"""
+    t = rng.random((states+1, states))
+    keep = rng.random((states, states)) < density
+    keep[np.arange(states), np.arange(states)] = True
+    t[1:] *= keep
+    t /= t.sum(axis=1)[:, None]
+    e = rng.random((20, states))
+    e /= e.sum(axis=0)[None, :]
+    return (e, t)
+
+def random_sequence(length, rng):
+    return "".join(rng.choice(sorted(viterbi.chars), length))
+
+def best_time(f, repeat=3, min_time=0.0):
+    """Shortest of repeat timings of f(), each one averaged over as many
+    calls as it takes to run for min_time"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed / number
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for k in range(number):
+            f()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_memory(f):
+    """Peak bytes allocated (by Python and numpy) during f()"""
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def time_kernels(e, t, s, topology):
+    """Seconds for a forward pass, a backward pass and a Viterbi pass"""
+    F, scale, logprob = viterbi.forwardAlgorithm(e, t, s, topology)
+    return (best_time(lambda: viterbi.forwardAlgorithm(e, t, s, topology)),
+            best_time(lambda: viterbi.backwardAlgorithm(e, t, s, scale,
+                                                        topology)),
+            best_time(lambda: viterbi.viterbiDecoding(e, t, s,
+                                                      topology=topology)))
+
+def sweep_density(state_counts=(10, 36, 128), densities=(0.02, 0.05, 0.1, 0.2,
+                                                         0.4, 1.0),
+                  length=500, seed=0):
+    """Dense against sparse kernels as the edge density goes down"""
+    rng = np.random.default_rng(seed)
+    s = random_sequence(length, rng)
+    rows = []
+    print("states\tdensity\tedges\tkernel\tdense.ms\tsparse.ms\tauto")
+    for states in state_counts:
+        for density in densities:
+            e, t = random_model(states, density, rng)
+            topology = viterbi.Topology(t)
+            auto = ["sparse" if x else "dense" for x in
+                    [topology.sparse, topology.sparse, topology.sparseViterbi]]
+            dense = time_kernels(e, t, s, viterbi.Topology(t, sparse=False))
+            sparse = time_kernels(e, t, s, viterbi.Topology(t, sparse=True))
+            for k, kernel in enumerate(["forward", "backward", "viterbi"]):
+                rows.append({"states": states, "density": density,
+                             "edges": topology.density, "kernel": kernel,
+                             "dense": dense[k], "sparse": sparse[k],
+                             "auto": auto[k]})
+                print("{}\t{}\t{:.3f}\t{}\t{:.2f}\t{:.2f}\t{}".format(states,
+                      density, topology.density, kernel, dense[k]*1000,
+                      sparse[k]*1000, auto[k]))
+    return rows
+
+def kernel_models(rng):
+    """(e, t) of the models the kernels are timed on, by state count: the
+    3-state test model, a random 10-state model and the BMC paper model"""
+    from . import data
+    e3, t3, s = viterbi.setupTest()
+    e36, t36, labels = data.load_paper_model()
+    return {3: (e3, t3), 10: random_model(10, 0.3, rng), 36: (e36, t36)}
+
+def kernel_benchmarks(lengths, repeat, min_time, rng):
+    """Forward, backward, Viterbi and posterior decoding (run_viterbi, and
+    the checkpointed version whatever the length) on random sequences, with
+    the peak memory of each"""
+    results = {}
+    for states, (e, t) in sorted(kernel_models(rng).items()):
+        topology = viterbi.Topology(t)
+        for length in lengths:
+            s = random_sequence(length, rng)
+            F, scale, logprob = viterbi.forwardAlgorithm(e, t, s, topology)
+            kernels = {
+                "forward": lambda: viterbi.forwardAlgorithm(e, t, s, topology),
+                "backward": lambda: viterbi.backwardAlgorithm(e, t, s, scale,
+                                                              topology),
+                "viterbi": lambda: viterbi.viterbiDecoding(e, t, s,
+                                                           topology=topology),
+                "run_viterbi": lambda: viterbi.run_viterbi(e, t, s, True,
+                                                           topology=topology),
+                "checkpointed": lambda: viterbi.posteriorPathCheckpointed(e,
+                                                           t, s, topology)}
+            for kernel, f in sorted(kernels.items()):
+                name = "kernel/{}/states={}/length={}".format(kernel, states,
+                                                               length)
+                results[name] = {"seconds": best_time(f, repeat, min_time),
+                                 "peak_bytes": peak_memory(f)}
+    return results
+
+def move_benchmarks(models, calls, repeat, seed):
+    """Each move in moves.py applied to fresh copies of sampled models, so
+    nothing the models cache is reused"""
+    from . import moves
+    from .mcmc import Model
+    results = {}
+    for move in [moves.split, moves.join, moves.add_edge, moves.delete_edge,
+                 moves.edit_transition]:
+        def f():
+            random.seed(seed)
+            for k in range(calls):
+                m = models[k % len(models)]
+                move(Model(m.a, m.e, m.labels))
+        seconds = best_time(f, repeat) / calls
+        results["move/{}".format(move.__name__)] = {"seconds": seconds}
+    return results
+
+def mcmc_benchmark(models, iterations, repeat, seed):
+    """Seconds per Metropolis step on train.fasta, starting from a sampled
+    model so that the chain is past its initial growth"""
+    from .mcmc import (load_train_data, PackedSequences, LikelihoodCache,
+                      log_likelihood, metropolis_step)
+    seqs, states = load_train_data()
+    train = PackedSequences(seqs)
+    m = models[0]
+    log_likelihood_m = log_likelihood(m, train)
+    def f():
+        random.seed(seed)
+        cache = LikelihoodCache(10000)
+        current, loglik = m, log_likelihood_m
+        for i in range(iterations):
+            move, current, loglik, accept = metropolis_step(current, loglik,
+                train, cache, 10)
+    seconds = best_time(f, repeat) / iterations
+    return {"mcmc/step": {"seconds": seconds, "per_second": 1 / seconds,
+                          "iterations": iterations}}
+
+def prediction_benchmark(models, repeat):
+    """Seconds to predict every protein in test.fasta with the ensemble"""
+    from .ensemble import Ensemble
+    from .mcmc import load_test_data
+    seqs, states = load_test_data()
+    def f():
+        ensemble = Ensemble(models)
+        for s in seqs:
+            ensemble.predict(s)
+    seconds = best_time(f, repeat)
+    return {"predict/test": {"seconds": seconds,
+                             "per_second": len(seqs) / seconds,
+                             "proteins": len(seqs)}}
+
+def startup_benchmarks(models, repeat):
+    """Wall time of a fresh interpreter running each mchmm command with
+    --help, and predicting one protein with the sample as a pickle and as
+    an archive"""
+    import shutil
+    import tempfile
+    from . import archive
+    from . import cli
+    from .data import read_fasta
+    # the data sits next to the package, and commands run from there so
+    # that the package can be imported even if it isn't installed
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "models.mca")
+        archive.write_archive(path, models)
+        protein, seq, secstr = next(read_fasta(os.path.join(root,
+                                                            "test.fasta")))
+        fasta = os.path.join(tmp, "one.fasta")
+        with open(fasta, "w") as f:
+            f.write(">{}\n{}\n".format(protein, seq))
+
+        runs = [("help", ["--help"])]
+        runs += [(name, [name, "--help"]) for name in sorted(cli.COMMANDS)]
+        runs += [("predict/pickle", ["predict", fasta, "-p", "1", "-m",
+                                     os.path.join(root, "models.pkl")]),
+                 ("predict/archive", ["predict", fasta, "-p", "1", "-m",
+                                      path])]
+        results = {}
+        for name, argv in runs:
+            command = [sys.executable, "-m", __package__ + ".cli"] + argv
+            def f():
+                subprocess.run(command, cwd=root, check=True,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+            results["startup/{}".format(name)] = {"seconds":
+                                                  best_time(f, repeat)}
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+def environment():
+    """Where and on what a benchmark ran"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count()}
+
+def run(quick=False, seed=0):
+    """Run every benchmark; quick does less work for a smoke test"""
+    from .mcmc import load_models
+    rng = np.random.default_rng(seed)
+    repeat = 3 if quick else 5
+    lengths = (50, 500) if quick else (50, 500, 5000)
+    models = load_models()
+
+    results = {}
+    for name, f in [
+            ("kernels", lambda: kernel_benchmarks(lengths, repeat,
+                0.01 if quick else 0.05, rng)),
+            ("moves", lambda: move_benchmarks(models, 100 if quick else 1000,
+                                              repeat, seed)),
+            ("mcmc", lambda: mcmc_benchmark(models, 10 if quick else 100,
+                                            repeat, seed)),
+            ("prediction", lambda: prediction_benchmark(models, repeat)),
+            ("startup", lambda: startup_benchmarks(models, repeat))]:
+        sys.stderr.write("Running {} benchmarks\n".format(name))
+        results.update(f())
+    return {"environment": environment(), "quick": quick, "seed": seed,
+            "results": results}
+
+def compare(base, new, threshold=0.1):
+    """Print new against base; returns the benchmarks that slowed down by
+    more than threshold (as a fraction)"""
+    regressions = []
+    print("benchmark\tbase.ms\tnew.ms\tratio\tflag\tnew.peak.kb")
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        before = base["results"][name]["seconds"]
+        after = new["results"][name]["seconds"]
+        ratio = after / before
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "faster"
+        peak = new["results"][name].get("peak_bytes")
+        print("{}\t{:.3f}\t{:.3f}\t{:.2f}\t{}\t{}".format(name, before*1000,
+              after*1000, ratio, flag, "" if peak is None else peak // 1024))
+    for name in sorted(set(base["results"]) ^ set(new["results"])):
+        print("{}\tonly in {}".format(name,
+              "base" if name in base["results"] else "new"))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for mc-hmmer")
+    commands = parser.add_subparsers(dest="command")
+    command = commands.add_parser("run", help="run the benchmarks")
+    command.add_argument("-o", "--output", default="-",
+                         help="JSON file for the results (default stdout)")
+    command.add_argument("--quick", action="store_true",
+                         help="shorter runs, for a smoke test")
+    command.add_argument("--seed", type=int, default=0)
+    command = commands.add_parser("compare",
+                                  help="compare two sets of results")
+    command.add_argument("base")
+    command.add_argument("new")
+    command.add_argument("--threshold", type=float, default=0.1,
+                         help="slowdown that counts as a regression "
+                         "(default 0.1, ie. 10%%)")
+    commands.add_parser("density", help="dense against sparse kernels")
+    commands.add_parser("startup", help="cold start time of each command")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.quick, args.seed)
+        if args.output == "-":
+            json.dump(results, sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write("\n")
+        else:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+    elif args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if base.get("environment", {}).get("machine") != \
+           new.get("environment", {}).get("machine"):
+            sys.stderr.write("Warning: the results are from different "
+                             "machines\n")
+        regressions = compare(base, new, args.threshold)
+        if regressions:
+            sys.stderr.write("{} regressions\n".format(len(regressions)))
+            return 1
+    elif args.command == "density":
+        sweep_density()
+    elif args.command == "startup":
+        from .mcmc import load_models
+        for name, result in sorted(startup_benchmarks(load_models(),
+                                                      5).items()):
+            print("{}\t{:.1f} ms".format(name, 1000 * result["seconds"]))
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
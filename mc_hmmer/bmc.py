@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# run the model from the paper
+
+import argparse
+import csv
+import sys
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score the model from the "
+                                     "BMC paper on a test set")
+    parser.add_argument("--paper", metavar="DIR", default="bmc_paper",
+                        help="directory with the paper's e.tsv and a.tsv")
+    parser.add_argument("--test", default="test.fasta",
+                        help="FASTA of sequence/secstr pairs, or a store "
+                        "built by store.py")
+    args = parser.parse_args(argv)
+
+    from . import viterbi
+    from . import data
+
+    # load the e and a matrices
+    e, a, labels = data.load_paper_model(args.paper)
+
+    # the states are begin, 15 alpha helix, 12 other, and 9 beta sheet
+    states = [0] + labels
+
+    # run the algorithm
+    ids, seqs, true_states = data.load_records(args.test)
+    errors = 0
+    total = 0
+
+    writer = csv.writer(sys.stderr, delimiter="\t")
+    for protein, seq, seq_states in zip(ids, seqs, true_states):
+        estimated_states = viterbi.run_viterbi(e, a, seq, True)
+        estimated_states = [states[x] for x in estimated_states]
+
+        cur_errors = 0
+        cur_total = 0
+
+        for i in range(len(estimated_states)):
+            if seq_states[i] != estimated_states[i]:
+                cur_errors += 1
+            cur_total += 1
+
+        writer.writerow(protein.split(":")[:2] + [cur_errors*100.0/cur_total])
+
+        errors += cur_errors
+        total += cur_total
+
+    print("{} errors out of {} positions, accuracy {}%".format(errors, total,
+        100-(errors*100/total)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
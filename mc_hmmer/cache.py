@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import collections
+import hashlib
+import numpy as np
+
+def canonical_order(m):
+    """Order the states of m so that relabelling them within a label does not
+    change the result
+
+    States are sorted by label and then by features that don't depend on the
+    numbering of the other states: emission column, begin probability,
+    self-transition, and the sorted outgoing and incoming probabilities.
+    """
+    a = np.asarray(m.a, dtype=float)
+    e = np.asarray(m.e, dtype=float)
+    nnodes = len(m.labels)
+    keys = []
+    for j in range(nnodes):
+        out_row = np.delete(a[j+1], j)
+        in_col = np.delete(a[1:, j], j)
+        keys.append((m.labels[j], tuple(e[:, j]), a[0][j], a[j+1][j],
+                     tuple(np.sort(out_row)), tuple(np.sort(in_col)), j))
+    return [key[-1] for key in sorted(keys)]
+
+def fingerprint(m):
+    """Hash of the canonical form of m; equivalent models hash the same"""
+    order = canonical_order(m)
+    a = np.asarray(m.a, dtype=float)
+    e = np.asarray(m.e, dtype=float)
+    h = hashlib.sha1()
+    h.update(",".join(m.labels[j] for j in order).encode())
+    h.update(np.ascontiguousarray(a[0][order]).tobytes())
+    h.update(np.ascontiguousarray(a[1:][order][:, order]).tobytes())
+    h.update(np.ascontiguousarray(e[:, order]).tobytes())
+    return h.digest()
+
+class LikelihoodCache:
+    """Bounded LRU map from model fingerprints to log likelihoods
+
+    hits and misses count lookups, identical counts proposals that were the
+    current model itself and so were never looked up at all.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.identical = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """The cached log likelihood for key, or None"""
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a log likelihood, evicting the least recently used entry"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def summary(self):
+        return "{} hits, {} misses, {} identical proposals".format(
+            self.hits, self.misses, self.identical)
+
+def test_cache(count=20):
+    """Check that permuting the states of models grown from the starting
+    model by splits and random moves keeps their fingerprints, and so hits
+    the cache"""
+    import random
+    from . import data
+    from .mcmc import initial_model
+    from .moves import mcmc_move, split
+    seqs, states = data.load_train_data()
+    m = initial_model(seqs, states)
+    cache = LikelihoodCache()
+    for i in range(count):
+        m = split(m) if i % 3 == 0 else mcmc_move(m)[1]
+        key = fingerprint(m)
+        cache.put(key, float(i))
+        order = list(range(len(m.labels)))
+        random.shuffle(order)
+        a = np.asarray(m.a)
+        permuted = m.replace(a=np.vstack([a[0][order],
+                                          a[1:][order][:, order]]),
+                             e=np.asarray(m.e)[:, order],
+                             labels=[m.labels[j] for j in order])
+        assert fingerprint(permuted) == key
+        assert cache.get(fingerprint(permuted)) == float(i)
+    print("{} models, {} states at the end: every permutation hit the cache"
+          .format(count, len(m.labels)))
+
+if __name__ == "__main__":
+    test_cache()
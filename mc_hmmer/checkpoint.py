@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Checkpoints and sample files for long MCMC runs.
+#
+# A checkpoint is a single pickle, written to a temporary file and renamed
+# over the old one so that a crash never leaves a half-written checkpoint.
+# A sample file is append-only: SAMPLES_MAGIC followed by one frame per
+# sampled model, each an 8-byte little-endian length and then the pickled
+# (iteration, model) pair. A reader can consume it while the chain is still
+# running; a frame that is only partly written yet is picked up next time.
+
+import io
+import os
+import pickle
+import struct
+import sys
+
+SAMPLES_MAGIC = b"MCHMMSMP"
+FRAME = struct.Struct("<Q")
+
+def unpickle(f):
+    # when mcmc.py is run as a script its classes live in __main__, and the
+    # chain has to get those back rather than a second copy from "mcmc"
+    unpickler = getattr(sys.modules["__main__"], "ModelUnpickler", None)
+    if unpickler is None:
+        from .mcmc import ModelUnpickler as unpickler
+    return unpickler(f).load()
+
+def save_checkpoint(path, state):
+    """Atomically replace the checkpoint at path with state"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        return unpickle(f)
+
+def is_sample_file(path):
+    """Whether path is a sample file rather than a pickled list of models"""
+    with open(path, "rb") as f:
+        return f.read(len(SAMPLES_MAGIC)) == SAMPLES_MAGIC
+
+class SampleWriter:
+    """Appends sampled models to a sample file
+
+    size is the length of a file being resumed: anything past it was written
+    after the checkpoint and is dropped, since the chain will sample it again.
+    """
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is None:
+            self.f = open(path, "wb")
+            self.f.write(SAMPLES_MAGIC)
+        else:
+            self.f = open(path, "r+b")
+            self.f.truncate(size)
+            self.f.seek(size)
+        self.f.flush()
+
+    def append(self, iteration, m):
+        frame = pickle.dumps((iteration, m), protocol=pickle.HIGHEST_PROTOCOL)
+        self.f.write(FRAME.pack(len(frame)) + frame)
+        self.f.flush()
+
+    def sync(self):
+        """Force the samples so far to disk; returns the file's length"""
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+class SampleReader:
+    """Reads the (iteration, model) pairs of a sample file as they appear"""
+    def __init__(self, path):
+        self.path = path
+        self.offset = len(SAMPLES_MAGIC)
+        if not is_sample_file(path):
+            raise ValueError("{} is not a sample file".format(path))
+
+    def read(self):
+        """The samples appended since the last call"""
+        samples = []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while True:
+                header = f.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                length = FRAME.unpack(header)[0]
+                frame = f.read(length)
+                if len(frame) < length:
+                    break
+                samples.append(unpickle(io.BytesIO(frame)))
+                self.offset = f.tell()
+        return samples
+
+def read_samples(path):
+    """Every (iteration, model) pair in a sample file"""
+    return SampleReader(path).read()
+
+def test_resume(iterations=40, seed=3):
+    """Check that a seeded run stopped halfway and resumed writes the same
+    samples, models and log as one that ran straight through, in every
+    acceptance mode"""
+    import contextlib
+    import tempfile
+    from . import mcmc
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(name, n, *extra):
+            path = os.path.join(tmp, name)
+            log = io.StringIO()
+            with contextlib.redirect_stdout(io.StringIO()), \
+                 contextlib.redirect_stderr(log):
+                mcmc.main(["--seed", str(seed), "-n", str(n), "--burnin", "5",
+                           "--sample-every", "3", "--checkpoint-every", "10",
+                           "--samples", path + ".bin", "-o", path + ".pkl",
+                           "--checkpoint", path + ".ckpt"] + list(extra))
+            return log.getvalue()
+
+        def read(path):
+            with open(os.path.join(tmp, path), "rb") as f:
+                return f.read()
+
+        for acceptance in ["standard", "early_abort", "delayed"]:
+            mode = ["--acceptance", acceptance]
+            log = run("straight", iterations, *mode)
+            log_resumed = run("resumed", iterations // 2, *mode)
+            log_resumed += run("resumed", iterations, "--resume", *mode)
+            assert log_resumed == log
+            for extension in [".bin", ".pkl"]:
+                assert (read("resumed" + extension) ==
+                        read("straight" + extension))
+            print("{}: resumed at {} of {} iterations, samples, models and "
+                  "log identical".format(acceptance, iterations // 2,
+                                         iterations))
+
+if __name__ == "__main__":
+    # summarize a sample file, e.g. while the chain is writing it, or with
+    # no file check that resuming a run changes nothing
+    if len(sys.argv) == 1:
+        test_resume()
+        sys.exit()
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m mc_hmmer.checkpoint [samples.bin]")
+    samples = read_samples(sys.argv[1])
+    for iteration, m in samples:
+        print("{}\t{}".format(iteration, len(m.labels)))
+    print("{} samples".format(len(samples)), file=sys.stderr)
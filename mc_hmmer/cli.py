@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# The mchmm command: one entry point for the tools of this package.
+#
+# usage: mchmm <command> [arguments]
+#
+# Each command is the main() of one module, which is only imported once the
+# command is known, so "mchmm --help" imports nothing and each command pays
+# only for what it uses. "mchmm <command> --help" lists its arguments.
+
+import importlib
+import sys
+import time
+
+# command: (module, whatever goes before the arguments, description)
+COMMANDS = {
+    "train": ("mcmc", [], "sample HMM topologies by MCMC"),
+    "temper": ("tempering", [], "sample with parallel tempering"),
+    "predict": ("predict", [], "predict the proteins in a FASTA file"),
+    "evaluate": ("evaluate", [], "score a sample of models on a test set"),
+    "convert": ("archive", ["convert"], "convert models.pkl to an archive"),
+    "serve": ("server", [], "serve predictions over HTTP"),
+    "worker": ("cluster", ["worker"], "serve likelihoods to mchmm train "
+               "--workers"),
+    "bench": ("benchmark", [], "run or compare the benchmarks"),
+}
+
+def usage():
+    lines = ["usage: mchmm <command> [arguments]", "", "commands:"]
+    for name, (module, prefix, description) in COMMANDS.items():
+        lines.append("  {:<10}{}".format(name, description))
+    lines += ["", "options:",
+              "  --time    report how long the command took to start and run",
+              "", "\"mchmm <command> --help\" describes its arguments."]
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    start = time.perf_counter()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    timed = "--time" in argv[:1]
+    if timed:
+        argv = argv[1:]
+    if not argv or argv[0] in ["-h", "--help"]:
+        sys.stdout.write(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        sys.stderr.write(usage())
+        sys.stderr.write("\nmchmm: unknown command {}\n".format(argv[0]))
+        return 2
+
+    module, prefix, description = COMMANDS[argv[0]]
+    # argparse names the program after sys.argv[0]; a command that is a
+    # subcommand of its module gets "mchmm" and adds its own name
+    sys.argv[0] = "mchmm" if prefix else "mchmm " + argv[0]
+    try:
+        status = importlib.import_module("." + module, __package__).main(
+            prefix + argv[1:])
+    except SystemExit as exit:
+        status = exit.code
+    finally:
+        if timed:
+            sys.stderr.write("mchmm {}: {:.1f} ms\n".format(argv[0],
+                             1000 * (time.perf_counter() - start)))
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
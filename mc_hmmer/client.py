@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Client and load test for server.py.
+#
+# usage: python -m mc_hmmer.client [--port 8642 | --unix PATH]
+#            predict proteins.fasta
+#        python -m mc_hmmer.client [--port 8642 | --unix PATH]
+#            loadtest proteins.fasta [--concurrency 16] [--requests 1000]
+#            [--posteriors]
+#        python -m mc_hmmer.client [--port 8642 | --unix PATH] stats
+#
+# predict writes "id<TAB>prediction" lines in input order like predict.py;
+# loadtest keeps --concurrency requests in flight over as many connections,
+# cycling through the proteins, and reports latency and throughput as seen
+# by the client next to the server's own statistics.
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import numpy as np
+
+class Client:
+    """One keep-alive HTTP connection to the server"""
+    def __init__(self, host="127.0.0.1", port=8642, unix=None):
+        self.host = host
+        self.port = port
+        self.unix = unix
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        if self.unix:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                self.unix)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+
+    async def request(self, method, path, content=None):
+        """(status, decoded JSON response)"""
+        if self.writer is None:
+            await self.connect()
+        body = b"" if content is None else json.dumps(content).encode("utf-8")
+        self.writer.write("{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: "
+                          "application/json\r\nContent-Length: {}\r\n\r\n"
+                          .format(method, path, self.host, len(body))
+                          .encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return (status, json.loads(await self.reader.readexactly(length)))
+
+    async def predict(self, seq, protein=None, posteriors=False):
+        request = {"sequence": seq, "posteriors": posteriors}
+        if protein is not None:
+            request["id"] = protein
+        return (await self.request("POST", "/predict", request))[1]
+
+    async def stats(self):
+        return (await self.request("GET", "/stats"))[1]
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+def read_records(path):
+    from . import data
+    return [(protein, seq) for protein, seq, secstr in data.read_fasta(path)]
+
+async def predict(args, records):
+    # a few connections, with the results written in input order
+    clients = [Client(args.host, args.port, args.unix)
+               for i in range(args.concurrency)]
+    queue = asyncio.Queue()
+    for k, record in enumerate(records):
+        queue.put_nowait(k)
+    results = [None] * len(records)
+
+    async def work(client):
+        while not queue.empty():
+            k = queue.get_nowait()
+            results[k] = await client.predict(records[k][1])
+
+    await asyncio.gather(*(work(c) for c in clients))
+    for c in clients:
+        await c.close()
+    for (protein, seq), result in zip(records, results):
+        if "error" in result:
+            sys.stderr.write("Skipping {}: {}\n".format(protein,
+                                                        result["error"]))
+        print("{}\t{}".format(protein, result.get("labels", "")))
+
+def milliseconds(value, unit=""):
+    """A latency for the report; the server gives None when it has none"""
+    return "n/a" if value is None else "{:.1f}{}".format(value, unit)
+
+async def loadtest(args, records):
+    clients = [Client(args.host, args.port, args.unix)
+               for i in range(args.concurrency)]
+    latencies = []
+    errors = 0
+    residues = 0
+    issued = iter(range(args.requests))
+
+    async def work(client):
+        nonlocal errors, residues
+        for k in issued:
+            protein, seq = records[k % len(records)]
+            start = time.perf_counter()
+            result = await client.predict(seq, protein, args.posteriors)
+            latencies.append(1000 * (time.perf_counter() - start))
+            errors += "error" in result
+            residues += len(seq)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(work(c) for c in clients))
+    elapsed = time.perf_counter() - start
+    server = await clients[0].stats()
+    for c in clients:
+        await c.close()
+
+    print("{} requests ({} errors) from {} connections in {:.2f}s: "
+          "{:.1f} requests/s, {:.0f} residues/s".format(len(latencies),
+          errors, args.concurrency, elapsed, len(latencies) / elapsed,
+          residues / elapsed))
+    percentiles = (np.percentile(latencies, [50, 95, 99, 100]) if latencies
+                   else [None] * 4)
+    print("latency ms: p50 {}, p95 {}, p99 {}, max {}".format(
+          *[milliseconds(x) for x in percentiles]))
+    print("server: mean batch size {:.2f}, queue wait p50 {}".format(
+          server["mean_batch_size"] or 0,
+          milliseconds(server["queue_wait_ms"]["p50"], "ms")))
+
+async def stats(args):
+    client = Client(args.host, args.port, args.unix)
+    print(json.dumps(await client.stats(), indent=2))
+    await client.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Client for server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8642)
+    parser.add_argument("--unix", metavar="PATH",
+                        help="connect to a Unix socket instead of a port")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("predict", help="predict every protein in a "
+                            "FASTA file")
+    p.add_argument("fasta")
+    p.add_argument("-c", "--concurrency", type=int, default=4)
+    p = commands.add_parser("loadtest", help="measure latency and throughput")
+    p.add_argument("fasta")
+    p.add_argument("-c", "--concurrency", type=int, default=16)
+    p.add_argument("-n", "--requests", type=int, default=1000)
+    p.add_argument("--posteriors", action="store_true",
+                   help="ask for the posteriors too")
+    commands.add_parser("stats", help="print the server's statistics")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        asyncio.run(stats(args))
+    elif args.command == "predict":
+        asyncio.run(predict(args, read_records(args.fasta)))
+    else:
+        asyncio.run(loadtest(args, read_records(args.fasta)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+# Likelihoods over TCP, for training sets that outgrow one machine: a
+# worker process on any host holds shards of the encoded training
+# sequences, and the coordinator (mcmc.py --workers) sends it each model to
+# score on them and gathers the partial sums.
+#
+# usage: python -m mc_hmmer.cluster worker [--host HOST] [--port PORT]
+#            [--public]
+#        python -m mc_hmmer.cluster test [--workers N]
+#
+# Every message is a FRAME followed by its payload, all little-endian:
+#   FRAME    magic "MW", kind, flags, request id and payload length
+#   LOAD     shard id and sequence count (SHARD), the length of each
+#            sequence (uint32) and then their residue codes (uint8)
+#   SCORE    model and shard counts (SCORE_HEAD), the shard ids (uint32),
+#            then per model its number of states (uint32), a and e (float64);
+#            with PER_SEQUENCE set in the flags the log likelihood of every
+#            sequence comes back instead of one sum per shard
+#   RESULT   float64s, model by model: one per shard, or one per sequence
+#            of the shards in the order they were asked for
+#   ERROR    a UTF-8 message
+#   PING     answered by PONG, to check that a worker is up
+# A worker keeps the shards it was sent for as long as the connection
+# lasts; the coordinator sends them once, and again to another worker if
+# their owner fails.
+
+import collections
+import math
+import socket
+import struct
+import sys
+import time
+import numpy as np
+from .viterbi import encode, PackedSequences, batchForward
+from .parallel import shard_by_length
+
+FRAME_MAGIC = b"MW"
+FRAME = struct.Struct("<2sBBII")
+SHARD = struct.Struct("<II")
+SCORE_HEAD = struct.Struct("<HH")
+STATES = struct.Struct("<I")
+
+LOAD, SCORE, RESULT, ERROR, PING, PONG = range(1, 7)
+PER_SEQUENCE = 1
+
+def send_frame(sock, kind, payload=b"", request=0, flags=0):
+    sock.sendall(FRAME.pack(FRAME_MAGIC, kind, flags, request, len(payload)) +
+                 payload)
+
+def recv_exactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def recv_frame(sock):
+    """(kind, flags, request id, payload) of the next message on sock"""
+    magic, kind, flags, request, length = FRAME.unpack(
+        recv_exactly(sock, FRAME.size))
+    if magic != FRAME_MAGIC:
+        raise ConnectionError("not a worker protocol message")
+    return (kind, flags, request, recv_exactly(sock, length))
+
+def pack_shard(shard, codes):
+    lengths = np.array([len(c) for c in codes], dtype="<u4")
+    return (SHARD.pack(shard, len(codes)) + lengths.tobytes() +
+            b"".join(np.asarray(c, dtype=np.uint8).tobytes() for c in codes))
+
+def unpack_shard(payload):
+    shard, count = SHARD.unpack_from(payload)
+    lengths = np.frombuffer(payload, "<u4", count, SHARD.size)
+    offset = SHARD.size + 4 * count
+    codes = []
+    for n in lengths:
+        codes.append(np.frombuffer(payload, np.uint8, n, offset))
+        offset += int(n)
+    return (shard, codes)
+
+def pack_score(models, shards):
+    parts = [SCORE_HEAD.pack(len(models), len(shards)),
+             np.array(shards, dtype="<u4").tobytes()]
+    for a, e in models:
+        parts += [STATES.pack(a.shape[1]), a.astype("<f8").tobytes(),
+                  e.astype("<f8").tobytes()]
+    return b"".join(parts)
+
+def unpack_score(payload):
+    count, n_shards = SCORE_HEAD.unpack_from(payload)
+    offset = SCORE_HEAD.size
+    shards = np.frombuffer(payload, "<u4", n_shards, offset).tolist()
+    offset += 4 * n_shards
+    models = []
+    for k in range(count):
+        states, = STATES.unpack_from(payload, offset)
+        offset += STATES.size
+        a = np.frombuffer(payload, "<f8", (states + 1) * states, offset)
+        offset += 8 * a.size
+        e = np.frombuffer(payload, "<f8", 20 * states, offset)
+        offset += 8 * e.size
+        models.append((a.reshape(states + 1, states), e.reshape(20, states)))
+    return (models, shards)
+
+def handle_coordinator(conn, delay=0.0):
+    """Serve one coordinator until it disconnects"""
+    shards = {}
+    while True:
+        try:
+            kind, flags, request, payload = recv_frame(conn)
+        except ConnectionError:
+            return
+        if kind == PING:
+            send_frame(conn, PONG, request=request)
+        elif kind == LOAD:
+            # a LOAD has no reply unless it fails, and then the coordinator
+            # drops this worker on seeing an ERROR it didn't ask for
+            try:
+                shard, codes = unpack_shard(payload)
+                shards[shard] = PackedSequences(codes)
+            except Exception as error:
+                send_frame(conn, ERROR, "{}: {}".format(
+                           type(error).__name__, error).encode("utf-8"),
+                           request)
+        elif kind == SCORE:
+            try:
+                models, ids = unpack_score(payload)
+                results = []
+                for a, e in models:
+                    for shard in ids:
+                        logprob = batchForward(e, a, shards[shard])[0]
+                        if flags & PER_SEQUENCE:
+                            results.append(logprob)
+                        else:
+                            results.append([logprob.sum()])
+                reply = np.concatenate(results).astype("<f8").tobytes()
+            except Exception as error:
+                send_frame(conn, ERROR, "{}: {}".format(
+                           type(error).__name__, error).encode("utf-8"),
+                           request)
+                continue
+            if delay:
+                time.sleep(delay)
+            send_frame(conn, RESULT, reply, request)
+        else:
+            send_frame(conn, ERROR, "unknown message kind {}".format(
+                       kind).encode("utf-8"), request)
+
+def serve_worker(host="127.0.0.1", port=8700, delay=0.0):
+    """Accept coordinators on host:port, one at a time, forever"""
+    listener = socket.create_server((host, port))
+    host, port = listener.getsockname()[:2]
+    # the address line is how cluster.py test finds a worker on port 0
+    print("Worker listening on {}:{}".format(host, port), flush=True)
+    while True:
+        conn, address = listener.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sys.stderr.write("Coordinator connected from {}:{}\n".format(
+                         *address[:2]))
+        try:
+            handle_coordinator(conn, delay)
+        finally:
+            conn.close()
+        sys.stderr.write("Coordinator disconnected\n")
+
+def parse_address(address, default_port=8700):
+    host, _, port = address.rpartition(":")
+    if not host:
+        return (port, default_port)
+    return (host, int(port))
+
+class Worker:
+    """The coordinator's connection to one worker, and its latencies"""
+    def __init__(self, address, timeout):
+        self.address = address
+        self.shards = []
+        self.alive = True
+        self.requests = 0
+        self.failures = 0
+        self.error = None
+        self.latencies = collections.deque(maxlen=10000)
+        self.sock = socket.create_connection(parse_address(address), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def fail(self, error):
+        self.alive = False
+        self.failures += 1
+        self.error = "{}: {}".format(type(error).__name__, error)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def summary(self):
+        latencies = np.array(self.latencies) * 1000
+        return "{}\t{}\t{} shards\t{} requests\t{}".format(self.address,
+            "up" if self.alive else "down ({})".format(self.error),
+            len(self.shards), self.requests,
+            "p50 {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms".format(
+            np.percentile(latencies, 50), np.percentile(latencies, 95),
+            latencies.max()) if len(latencies) else "no replies")
+
+class RemoteLikelihood:
+    """Log likelihoods over a fixed set of sequences on TCP workers
+
+    Drop-in for ParallelLikelihood. The sequences are split into
+    shards_per_worker length-balanced shards per worker, and each worker
+    is sent its shards once. Every evaluation then costs one SCORE round
+    trip per worker, with the replies gathered as they come, each within
+    timeout seconds. A worker that times out, disconnects or sends
+    garbage is dropped, and its shards go to the least loaded survivors
+    and are scored there, so an evaluation only fails once no workers are
+    left. Totals are summed over the shards in a fixed order, so they
+    don't depend on which worker scored what.
+    """
+    def __init__(self, seqs, addresses, timeout=30.0, shards_per_worker=4):
+        self.timeout = timeout
+        self.codes = [encode(s) for s in seqs]
+        self.count = len(self.codes)
+        lengths = [len(c) for c in self.codes]
+        self.shards = [s for s in shard_by_length(lengths,
+                       len(addresses) * shards_per_worker) if s]
+        self.workers = [Worker(address, timeout) for address in addresses]
+        self.request = 0
+        for worker in self.workers:
+            self.call(worker, PING)
+        for k in range(len(self.shards)):
+            self.assign(k, self.workers[k % len(self.workers)])
+
+    def __len__(self):
+        return self.count
+
+    def live(self):
+        return [w for w in self.workers if w.alive]
+
+    def assign(self, k, worker):
+        """Send shard k to worker and make it the shard's owner"""
+        # reply() leaves the socket with whatever was left of its deadline
+        worker.sock.settimeout(self.timeout)
+        send_frame(worker.sock, LOAD, pack_shard(k, [self.codes[i]
+                   for i in self.shards[k]]))
+        worker.shards.append(k)
+
+    def call(self, worker, kind, payload=b"", flags=0):
+        """Send one request to worker and wait for its reply"""
+        self.request += 1
+        worker.sock.settimeout(self.timeout)
+        send_frame(worker.sock, kind, payload, self.request, flags)
+        return self.reply(worker, self.request, time.monotonic() +
+                          self.timeout)
+
+    def reply(self, worker, request, deadline):
+        worker.sock.settimeout(max(deadline - time.monotonic(), 1e-3))
+        kind, flags, answered, payload = recv_frame(worker.sock)
+        if answered != request:
+            raise ConnectionError("reply to request {} instead of {}".format(
+                                  answered, request))
+        if kind == ERROR:
+            raise ConnectionError(payload.decode("utf-8", "replace"))
+        return payload
+
+    def reassign(self, worker, error):
+        """Drop a failed worker and hand its shards to the others"""
+        worker.fail(error)
+        sys.stderr.write("Worker {} failed ({}), reassigning {} shards\n"
+                         .format(worker.address, worker.error,
+                                 len(worker.shards)))
+        shards, worker.shards = worker.shards, []
+        for k in shards:
+            while True:
+                live = self.live()
+                if not live:
+                    raise RuntimeError("every likelihood worker has failed")
+                target = min(live, key=lambda w: (sum(len(self.shards[j])
+                             for j in w.shards), self.workers.index(w)))
+                try:
+                    self.assign(k, target)
+                    break
+                except OSError as error:
+                    target.fail(error)
+                    shards += target.shards
+                    target.shards = []
+
+    def score(self, models, per_sequence=False):
+        """Per-shard results for a list of (a, e) pairs: a dict from shard
+        to a (models x sums or sequences) array"""
+        results = {}
+        pending = set(range(len(self.shards)))
+        while pending:
+            live = self.live()
+            if not live:
+                raise RuntimeError("every likelihood worker has failed")
+            sent = []
+            for worker in live:
+                shards = [k for k in worker.shards if k in pending]
+                if not shards:
+                    continue
+                self.request += 1
+                try:
+                    worker.sock.settimeout(self.timeout)
+                    send_frame(worker.sock, SCORE, pack_score(models, shards),
+                               self.request, PER_SEQUENCE if per_sequence
+                               else 0)
+                    sent.append((worker, shards, self.request,
+                                 time.monotonic()))
+                except OSError as error:
+                    self.reassign(worker, error)
+            deadline = time.monotonic() + self.timeout
+            for worker, shards, request, start in sent:
+                if not worker.alive:
+                    continue
+                try:
+                    payload = self.reply(worker, request, deadline)
+                    values = np.frombuffer(payload, "<f8").reshape(
+                        len(models), -1)
+                    sizes = [len(self.shards[k]) if per_sequence else 1
+                             for k in shards]
+                    if values.shape[1] != sum(sizes):
+                        raise ConnectionError("wrong result size")
+                except (OSError, ValueError, struct.error) as error:
+                    self.reassign(worker, error)
+                    continue
+                worker.requests += 1
+                worker.latencies.append(time.monotonic() - start)
+                bounds = np.cumsum([0] + sizes)
+                for j, k in enumerate(shards):
+                    results[k] = values[:, bounds[j]:bounds[j+1]]
+                    pending.discard(k)
+        return results
+
+    def sequence_log_likelihoods(self, m):
+        """Per-sequence log likelihoods of m, in input order"""
+        results = self.score([(np.asarray(m.a, dtype=float),
+                               np.asarray(m.e, dtype=float))], True)
+        logprob = np.zeros(self.count)
+        for k, shard in enumerate(self.shards):
+            logprob[shard] = results[k][0]
+        return logprob
+
+    def log_likelihoods(self, models):
+        """Total log likelihoods of several models, in one round trip"""
+        results = self.score([(np.asarray(m.a, dtype=float),
+                               np.asarray(m.e, dtype=float)) for m in models])
+        return [math.fsum(results[k][i, 0] for k in range(len(self.shards)))
+                for i in range(len(models))]
+
+    def log_likelihood(self, m):
+        """Total log likelihood of m"""
+        return self.log_likelihoods([m])[0]
+
+    def summary(self):
+        """One line of state and latency statistics per worker"""
+        return "\n".join(w.summary() for w in self.workers)
+
+    def close(self):
+        for worker in self.workers:
+            if worker.alive:
+                worker.alive = False
+                worker.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def start_local_worker(delay=0.0):
+    """A worker subprocess on a free localhost port, and its address"""
+    import os
+    import subprocess
+    # run from the directory holding the package, so it can be imported
+    # even if it isn't installed
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "-m", __package__ + ".cluster",
+                                "worker", "--host", "127.0.0.1", "--port",
+                                "0", "--delay", str(delay)], cwd=root,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    return (process, process.stdout.readline().split()[-1])
+
+def test_cluster(workers=3, timeout=1.0):
+    """Score train.fasta on local workers against the serial path, while
+    one worker is too slow and another is killed partway"""
+    from . import data
+    from .mcmc import Model, initial_model
+    seqs, states = data.load_train_data()
+    m = initial_model(seqs, states)
+    m2 = Model([[0.5, 0.5], [0.6, 0.4], [0.3, 0.7]], m.e[:, :2], ["A", "O"])
+    packed = PackedSequences(seqs)
+    serial = [batchForward(x.e, x.a, packed) for x in [m, m2]]
+
+    processes = [start_local_worker() for i in range(workers - 1)]
+    processes.append(start_local_worker(delay=3 * timeout))
+    try:
+        with RemoteLikelihood(seqs, [address for p, address in processes],
+                              timeout) as remote:
+            # the slow worker times out on the first request
+            totals = remote.log_likelihoods([m, m2])
+            assert not remote.workers[-1].alive
+            for total, (logprob, expected) in zip(totals, serial):
+                assert abs(total - expected) <= 1e-9 * abs(expected)
+            # and a killed one is noticed on the next
+            processes[0][0].kill()
+            processes[0][0].wait()
+            logprob = remote.sequence_log_likelihoods(m)
+            assert not remote.workers[0].alive
+            assert np.allclose(logprob, serial[0][0], rtol=1e-12, atol=0)
+            start = time.time()
+            for i in range(10):
+                assert remote.log_likelihood(m) == totals[0]
+            elapsed = (time.time() - start) / 10
+            print(remote.summary())
+        print("{} sequences on {} workers, {} left: {:.4f}s per likelihood"
+              .format(len(seqs), workers, workers - 2, elapsed))
+    finally:
+        for process, address in processes:
+            process.kill()
+            process.wait()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Likelihood workers for "
+                                     "mcmc.py --workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("worker", help="serve likelihoods to a "
+                            "coordinator")
+    p.add_argument("--host", default="127.0.0.1",
+                   help="address to listen on; anything but localhost "
+                   "needs --public")
+    p.add_argument("--public", action="store_true",
+                   help="allow listening beyond localhost; the protocol has "
+                   "no authentication, so only do this on a trusted network")
+    p.add_argument("--port", type=int, default=8700,
+                   help="port to listen on (0 for any free port)")
+    p.add_argument("--delay", type=float, default=0.0,
+                   help="seconds to wait before each reply, to test timeouts")
+    p = commands.add_parser("test", help="check the protocol with workers on "
+                            "localhost")
+    p.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args(argv)
+    if (args.command == "worker" and not args.public and
+            args.host not in ("127.0.0.1", "::1", "localhost")):
+        parser.error("listening on {} needs --public".format(args.host))
+
+    if args.command == "worker":
+        try:
+            serve_worker(args.host, args.port, args.delay)
+        except KeyboardInterrupt:
+            pass
+    else:
+        test_cluster(args.workers)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
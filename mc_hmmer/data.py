@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import csv
+import numpy as np
+import re
+
+def aa2int(seq):
+    """Convert an AA sequence to a sequence of integers"""
+    if isinstance(seq, np.ndarray): # already encoded, see store.py
+        return seq
+    aa = "ACDEFGHIKLMNPQRSTVWYX"
+    return [aa.index(x) for x in seq]
+
+def struct2int(seq):
+    """Convert a structural sequence to a sequence of integers"""
+    d = {"A": 0, "B": 1, "O": 2}
+    return [d[x] for x in seq]
+
+def simplify_struct(seq):
+    d = {"G": "A", "H": "A", "E": "B", "B": "B", "N": "O", "S": "O", "T": "O"}
+    return [d[x] for x in seq]
+
+def read_fasta(path):
+    """Yield (protein id, sequence, secstr) for each protein in a FASTA file
+
+    A record whose ID ends in ":sequence" is paired with the record after it
+    if that is the ":secstr" record of the same protein; otherwise (and for
+    plain sequence FASTA files) secstr is None.
+    """
+    from Bio import SeqIO
+    pending = None
+    for record in SeqIO.parse(path, "fasta"):
+        parts = record.id.rsplit(":", 1)
+        seq = str(record.seq).upper()
+        if len(parts) == 2 and parts[1] == "secstr":
+            if pending is not None and pending[0] == parts[0]:
+                yield (pending[0], pending[1], seq)
+                pending = None
+            continue
+        if pending is not None:
+            yield (pending[0], pending[1], None)
+        protein = parts[0] if len(parts) == 2 and parts[1] == "sequence" \
+            else record.id
+        pending = (protein, seq)
+    if pending is not None:
+        yield (pending[0], pending[1], None)
+
+def open_store(path):
+    """The SequenceStore for path: path itself if it is one, else the store
+    built from it by store.py if that is newer than it, else None"""
+    import os
+    from . import store
+    if store.is_store(path):
+        return store.SequenceStore(path)
+    built = store.store_path(path)
+    if (store.is_store(built) and
+        os.path.getmtime(built) >= os.path.getmtime(path)):
+        return store.SequenceStore(built)
+    return None
+
+def load_records(path):
+    """Load (ids, seqs, states) from a FASTA of sequence/secstr pairs
+
+    If there is a store for the file (see open_store) it is memory-mapped
+    instead of parsing the FASTA; the sequences are then zero-copy arrays of
+    residue codes, which the kernels in viterbi.py take directly.
+    """
+    store = open_store(path)
+    if store is not None:
+        return store.records()
+    ids = []
+    seqs = []
+    states = []
+    for protein, seq, secstr in read_fasta(path):
+        ids.append(protein)
+        seqs.append(seq)
+        states.append(None if secstr is None else simplify_struct(secstr))
+    return (ids, seqs, states)
+
+def load_test_data(path="test.fasta"):
+    """Load data for testing the HMM"""
+    return load_records(path)[1:]
+
+def load_train_data(path="train.fasta"):
+    """Load training data for fitting the HMM"""
+    return load_records(path)[1:]
+
+def harvest_e(seqs, states):
+    """Harvest emission probabilities from training data"""
+    e = [[0 for j in range(3)] for i in range(20)]
+    for i in range(len(seqs)):
+        seq = aa2int(seqs[i])
+        st = struct2int(states[i])
+        for j in range(len(seq)):
+            try:
+                e[seq[j]][st[j]] += 1
+            except IndexError:
+                pass
+
+    for j in range(3):
+        colsum = sum([e[i][j] for i in range(20)])
+        for i in range(20):
+            e[i][j] /= float(colsum)
+    return e
+
+def load_paper_model(path="bmc_paper"):
+    """Load the 36-state model from the BMC paper as (e, a, labels)"""
+    with open(path + "/e.tsv") as f:
+        e = [[float(x) for x in row] for row in csv.reader(f, delimiter="\t")]
+    with open(path + "/a.tsv") as f:
+        a = [[float(x) for x in row] for row in csv.reader(f, delimiter="\t")]
+    a.insert(0, [1.0/len(a[0]) for i in range(len(a[0]))])
+
+    # the states are 15 alpha helix, 12 other, and 9 beta sheet
+    labels = ["A"]*15 + ["O"]*12 + ["B"]*9
+    return (e, a, labels)
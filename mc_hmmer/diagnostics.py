@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+
+def autocorrelation(x):
+    """Autocorrelation of a trace at every lag, computed with an FFT"""
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    x = x - x.mean()
+    size = 1
+    while size < 2*n:
+        size *= 2
+    f = np.fft.rfft(x, size)
+    acov = np.fft.irfft(f * np.conjugate(f), size)[:n]
+    if acov[0] == 0:
+        return np.zeros(n)
+    return acov / acov[0]
+
+def effective_sample_size(x):
+    """Effective sample size of a trace, using Geyer's initial monotone
+    sequence estimator of the integrated autocorrelation time"""
+    n = len(x)
+    if n < 4:
+        return float(n)
+    rho = autocorrelation(x)
+    if not rho.any():
+        return float(n)
+
+    # sums of adjacent pairs of autocorrelations, truncated at the first
+    # negative pair and forced to be non-increasing
+    tau = -1.0
+    last = float("inf")
+    for k in range(0, n-1, 2):
+        pair = rho[k] + rho[k+1]
+        if pair < 0:
+            break
+        last = min(last, pair)
+        tau += 2*last
+    return n / max(tau, 1.0/n)
+
+def rhat(means, variances, n):
+    """R-hat from the means and variances of chains of length n each"""
+    W = np.mean(variances)
+    B = n * np.var(means, ddof=1)
+    if W == 0:
+        return 1.0 if B == 0 else float("inf")
+    return float(np.sqrt(((n - 1.0) / n * W + B / n) / W))
+
+class OnlineDiagnostics:
+    """Convergence diagnostics of traces that grow as the chain runs
+
+    add() costs O(1): it only accumulates sums over blocks of block
+    iterations. check() works on the block sums alone, so it costs
+    O(iterations / block) and can be called every so often without slowing
+    the chain down. It finds the burn-in cut as the earliest of 0%, 10%, ...
+    50% of the trace after which the first 10% and the last 50% of every
+    trace agree by Geweke's test (|z| < 2), and then measures the effective
+    sample size (by batch means) and the split R-hat over four segments of
+    every trace after the cut.
+    """
+    def __init__(self, names, block=10):
+        self.names = list(names)
+        self.block = block
+        self.sums = []
+        self.squares = []
+        self.partial = np.zeros(len(self.names))
+        self.partial_squares = np.zeros(len(self.names))
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, *values):
+        """Add one iteration's value of every trace"""
+        for k, x in enumerate(values):
+            self.partial[k] += x
+            self.partial_squares[k] += x * x
+        self.count += 1
+        if self.count % self.block == 0:
+            self.sums.append(self.partial)
+            self.squares.append(self.partial_squares)
+            self.partial = np.zeros(len(self.names))
+            self.partial_squares = np.zeros(len(self.names))
+
+    def window(self, sums, squares, lo, hi, batches):
+        """Mean, variance, and variance of the mean (by batch means) of
+        blocks lo to hi of one trace"""
+        n = (hi - lo) * self.block
+        mean = sums[lo:hi].sum() / n
+        variance = max(squares[lo:hi].sum() - n * mean * mean, 0.0) / (n - 1)
+        blocks = (hi - lo) // batches * batches
+        means = sums[hi-blocks:hi].reshape(batches, -1).mean(axis=1) / \
+            self.block
+        return (mean, variance, np.var(means, ddof=1) / batches)
+
+    def spectral_variance(self, windows):
+        """Spectral density at frequency zero of the block means, pooled
+        over windows (arrays of block sums) that are each centred on their
+        own mean, with a Bartlett lag window"""
+        means = [w / self.block - w.mean() / self.block for w in windows]
+        m = sum(len(x) for x in means)
+        lags = max(int(np.sqrt(m)), 1)
+        acov = [sum(np.dot(x[:len(x)-k], x[k:]) for x in means
+                    if len(x) > k) / m for k in range(lags + 1)]
+        return max(acov[0] + 2 * sum((1 - k / (lags + 1.0)) * acov[k]
+                                     for k in range(1, lags + 1)), 0.0)
+
+    def geweke(self, sums, squares, lo, hi):
+        """Geweke's z for blocks lo to hi of one trace
+
+        The first window is too short to estimate the variance of its mean
+        on its own, so both windows share one spectral estimate, which is
+        valid when the trace is stationary as the test assumes.
+        """
+        first = lo + max((hi - lo) // 10, 2)
+        last = hi - (hi - lo) // 2
+        a = sums[lo:first].mean() / self.block
+        b = sums[last:hi].mean() / self.block
+        spectrum = self.spectral_variance([sums[lo:first], sums[last:hi]])
+        error = spectrum * (1.0 / (first - lo) + 1.0 / (hi - last))
+        if error == 0:
+            return 0.0 if a == b else float("inf")
+        return (a - b) / np.sqrt(error)
+
+    def check(self, min_blocks=40):
+        """The diagnostics of the traces so far, as a dict; None until
+        there are min_blocks blocks"""
+        start = time.perf_counter()
+        blocks = len(self.sums)
+        if blocks < min_blocks:
+            return None
+        sums = np.array(self.sums).T
+        squares = np.array(self.squares).T
+
+        converged = False
+        for fraction in [0.0, 0.1, 0.2, 0.3, 0.4, 0.5]:
+            lo = int(fraction * blocks)
+            z = [self.geweke(s, q, lo, blocks) for s, q in zip(sums, squares)]
+            if all(abs(x) < 2 for x in z):
+                converged = True
+                break
+
+        n = (blocks - lo) * self.block
+        segment = (blocks - lo) // 4
+        report = {"iterations": self.count, "burnin": lo * self.block,
+                  "geweke_converged": converged, "ess": {}, "rhat": {},
+                  "geweke": dict(zip(self.names, z))}
+        batches = min(int(np.sqrt(blocks - lo)), blocks - lo)
+        for name, s, q in zip(self.names, sums, squares):
+            mean, variance, error = self.window(s, q, lo, blocks, batches)
+            report["ess"][name] = float(n if error == 0 else
+                                        min(n, variance / error))
+            pieces = [self.window(s, q, blocks - (k+1) * segment,
+                                  blocks - k * segment, 2)
+                      for k in range(4)]
+            report["rhat"][name] = rhat([p[0] for p in pieces],
+                                        [p[1] for p in pieces],
+                                        segment * self.block)
+        self.seconds += time.perf_counter() - start
+        return report
+
+    def converged(self, report, target_ess, target_rhat):
+        """Whether report meets the targets for every trace"""
+        return (report is not None and report["geweke_converged"] and
+                all(report["ess"][name] >= target_ess and
+                    report["rhat"][name] <= target_rhat
+                    for name in self.names))
+
+def format_report(report):
+    if report is None:
+        return "not enough iterations yet"
+    return "burn-in {}{}, ".format(report["burnin"],
+        "" if report["geweke_converged"] else " (Geweke not passed)") + \
+        ", ".join("{}: ESS {:.1f}, R-hat {:.3f}, z {:.2f}".format(name,
+                  report["ess"][name], report["rhat"][name],
+                  report["geweke"][name]) for name in sorted(report["ess"]))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Prediction with a sample of models. The sample is collapsed into its
+# distinct models and their multiplicities, every group of distinct models
+# with the same number of states is decoded in one batched forward/backward
+# pass (viterbi.ensemblePosteriors), and the per-model results are combined
+# with the multiplicities as weights. Long sequences are decoded a segment
+# at a time (viterbi.ensemblePosteriorSegments) to bound memory.
+
+import numpy as np
+from .cache import fingerprint
+from .viterbi import ensemblePosteriorSegments, CHECKPOINT_MIN_LENGTH
+
+def vote(votes, weights, labels):
+    """The label code with the most votes at each position, from a (models x
+    positions) array of label codes and the whole-number weight of each
+    model; ties go to the label voted for by the earliest model"""
+    K, n = votes.shape
+    counts = np.zeros((labels, n))
+    first = np.full((labels, n), K)
+    positions = np.arange(n)
+    for k in range(K - 1, -1, -1):
+        counts[votes[k], positions] += weights[k]
+        first[votes[k], positions] = k
+    # the weights are whole numbers, so this orders by count and then by
+    # which label was voted for first
+    return np.argmax(counts * (K + 1) - first, axis=0)
+
+class Ensemble:
+    """The distinct models of a sample, with how often each occurs
+
+    predict() with method="vote" reproduces mcmc.consensus over get_path:
+    each copy of a model votes for the label of its most probable state, and
+    ties go to the label voted for by the earliest model in the sample.
+    method="posterior" instead averages the posterior probabilities of the
+    labels over the sample and takes the most probable label.
+    """
+    def __init__(self, models):
+        self.models = []
+        weights = []
+        index = {}
+        for m in models:
+            key = fingerprint(m)
+            if key in index:
+                weights[index[key]] += 1
+            else:
+                index[key] = len(self.models)
+                self.models.append(m)
+                weights.append(1)
+        self.weights = np.array(weights, dtype=float)
+        self.alphabet = sorted(set(x for m in self.models for x in m.labels))
+
+        # one group per state count: the model indices, their stacked
+        # matrices and the label code of every state
+        self.groups = []
+        for states in sorted(set(len(m.labels) for m in self.models)):
+            members = [k for k, m in enumerate(self.models)
+                       if len(m.labels) == states]
+            e = np.array([self.models[k].e for k in members])
+            a = np.array([self.models[k].a for k in members])
+            codes = np.array([[self.alphabet.index(x) for x in
+                               self.models[k].labels] for k in members])
+            self.groups.append((np.array(members), e, a, codes))
+
+    def __len__(self):
+        return len(self.models)
+
+    def size(self):
+        """Number of models in the sample, counting repeats"""
+        return int(self.weights.sum())
+
+    def posteriors(self, e, a, seq):
+        """ensemblePosteriorSegments of one group, checkpointed if seq is
+        long"""
+        n = len(seq)
+        return ensemblePosteriorSegments(e, a, seq,
+            None if n >= CHECKPOINT_MIN_LENGTH else n)
+
+    def label_votes(self, seq):
+        """(models x positions) array of the label code each distinct model
+        gives every position"""
+        votes = np.empty((len(self.models), len(seq)),
+                         dtype=np.min_scalar_type(len(self.alphabet)))
+        for members, e, a, codes in self.groups:
+            for first, P in self.posteriors(e, a, seq):
+                best = np.argmax(P, axis=2).T
+                votes[members, first:first+len(P)] = \
+                    codes[np.arange(len(members))[:, None], best]
+        return votes
+
+    def label_posteriors(self, seq):
+        """(positions x labels) posterior probabilities of the labels,
+        averaged over the sample"""
+        total = np.zeros((len(seq), len(self.alphabet)))
+        for members, e, a, codes in self.groups:
+            for first, P in self.posteriors(e, a, seq):
+                P = P * self.weights[members][:, None]
+                part = total[first:first+len(P)].T
+                for j in range(codes.shape[1]):
+                    np.add.at(part, codes[:, j], P[:, :, j].T)
+        return total / self.weights.sum()
+
+    def predict(self, seq, method="vote"):
+        """The predicted labels of seq as a string"""
+        if method == "vote":
+            best = vote(self.label_votes(seq), self.weights,
+                        len(self.alphabet))
+        elif method == "posterior":
+            best = np.argmax(self.label_posteriors(seq), axis=1)
+        else:
+            raise ValueError("unknown method {}".format(method))
+        return "".join(self.alphabet[x] for x in best)
+
+def test_ensemble(path="test.fasta", count=20):
+    """Check vote predictions against consensus over get_path, with every
+    model of the sample repeated, and time both"""
+    import time
+    from .mcmc import load_models, load_records, consensus, get_path
+    models = load_models()
+    ids, seqs, states = load_records(path)
+    seqs = seqs[:count]
+    sample = models + models[::3]
+
+    start = time.time()
+    old = ["".join(consensus([get_path(m, s) for m in sample])) for s in seqs]
+    old_time = time.time() - start
+
+    start = time.time()
+    ensemble = Ensemble(sample)
+    new = [ensemble.predict(s) for s in seqs]
+    new_time = time.time() - start
+
+    mismatches = sum(a != b for a, b in zip(old, new))
+    print("{} models, {} distinct, {} sequences: consensus {:.2f}s, "
+          "ensemble {:.2f}s, speedup {:.1f}x, {} mismatches".format(
+          ensemble.size(), len(ensemble), len(seqs), old_time, new_time,
+          old_time / new_time, mismatches))
+    assert mismatches == 0
+
+    posterior = [ensemble.predict(s, "posterior") for s in seqs]
+    agree = np.mean([np.mean([x == y for x, y in zip(p, v)])
+                     for p, v in zip(posterior, new)])
+    print("posterior averaging agrees with the vote at {:.1%} of "
+          "positions".format(agree))
+
+if __name__ == "__main__":
+    test_ensemble()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+# Scoring of predicted secondary structure against a test set: Q3, the 3x3
+# confusion matrix, per-class precision and recall and the segment overlap
+# measure SOV (Zemla et al. 1999), all computed on the label codes of every
+# protein concatenated into one array. Every distinct model of a sample is
+# scored on its own and the sample as a whole by its vote. The predictions of
+# each model are kept in a cache directory, keyed by the model and the test
+# set, so evaluating a growing sample only decodes the models that are new.
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import numpy as np
+
+LABELS = "ABO"
+
+def encode_labels(s):
+    """Label codes (0, 1, 2 for A, B, O) of a string of labels"""
+    table = np.full(256, 255, dtype=np.uint8)
+    for k, x in enumerate(LABELS):
+        table[ord(x)] = k
+    codes = table[np.frombuffer(s.encode("ascii"), dtype=np.uint8)]
+    if (codes == 255).any():
+        raise ValueError("unknown label {!r}".format(
+                         s[int(np.argmax(codes == 255))]))
+    return codes
+
+def segments(codes, offsets):
+    """(starts, ends, labels) of the runs of equal codes, with a run broken
+    at every protein boundary in offsets; ends are exclusive"""
+    n = len(codes)
+    change = np.ones(n, dtype=bool)
+    change[1:] = codes[1:] != codes[:-1]
+    change[offsets[:-1][offsets[:-1] < n]] = True
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], n)
+    return (starts, ends, codes[starts])
+
+class Scores:
+    """Scores of predictions against the truth over a set of proteins
+
+    confusion[p][t][q] counts the residues of protein p with true label t
+    predicted as q; sov_sum and sov_norm hold the numerator and normalizer
+    of SOV per protein and class, so that every measure can be had for any
+    protein, class or the whole set.
+    """
+    def __init__(self, true, pred, offsets):
+        true = np.asarray(true, dtype=np.intp)
+        pred = np.asarray(pred, dtype=np.intp)
+        offsets = np.asarray(offsets, dtype=np.intp)
+        if len(true) != len(pred):
+            raise ValueError("{} true labels but {} predicted".format(
+                             len(true), len(pred)))
+        k = len(LABELS)
+        proteins = len(offsets) - 1
+        protein = np.repeat(np.arange(proteins), np.diff(offsets))
+        self.confusion = np.bincount((protein * k + true) * k + pred,
+            minlength=proteins * k * k).reshape(proteins, k, k)
+        self.sov_sum, self.sov_norm = self.segment_overlap(true, pred,
+                                                           offsets)
+
+    @staticmethod
+    def segment_overlap(true, pred, offsets):
+        k = len(LABELS)
+        ts, te, tc = segments(true, offsets)
+        ps, pe, pc = segments(pred, offsets)
+
+        # the predicted segments overlapping each true segment are a
+        # contiguous range of them, since both tile every protein
+        lo = np.searchsorted(pe, ts, side="right")
+        hi = np.searchsorted(ps, te, side="left")
+        count = hi - lo
+        i = np.repeat(np.arange(len(ts)), count)
+        j = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count,
+                                               count) + np.repeat(lo, count)
+        same = tc[i] == pc[j]
+        i = i[same]
+        j = j[same]
+
+        length = te - ts
+        minov = np.minimum(te[i], pe[j]) - np.maximum(ts[i], ps[j])
+        maxov = np.maximum(te[i], pe[j]) - np.minimum(ts[i], ps[j])
+        delta = np.minimum.reduce([maxov - minov, minov, length[i] // 2,
+                                   (pe[j] - ps[j]) // 2])
+        score = (minov + delta) / maxov * length[i]
+
+        # a true segment counts its length once per overlapping predicted
+        # segment of its class, or once if there is none
+        pairs = np.bincount(i, minlength=len(ts))
+        numerator = np.bincount(i, weights=score, minlength=len(ts))
+        norm = length * np.maximum(pairs, 1)
+
+        proteins = len(offsets) - 1
+        cell = (np.searchsorted(offsets, ts, side="right") - 1) * k + tc
+        size = proteins * k
+        return (np.bincount(cell, weights=numerator,
+                            minlength=size).reshape(proteins, k),
+                np.bincount(cell, weights=norm,
+                            minlength=size).reshape(proteins, k))
+
+    @staticmethod
+    def segment_overlap_loop(true, pred, offsets):
+        """segment_overlap by a direct loop over the segments of every
+        protein, to check it against"""
+        k = len(LABELS)
+        proteins = len(offsets) - 1
+        sov_sum = np.zeros((proteins, k))
+        sov_norm = np.zeros((proteins, k))
+        for p in range(proteins):
+            t = list(true[offsets[p]:offsets[p+1]])
+            q = list(pred[offsets[p]:offsets[p+1]])
+            runs = []
+            for labels in [t, q]:
+                runs.append([])
+                for x, label in enumerate(labels):
+                    if x == 0 or label != labels[x-1]:
+                        runs[-1].append([x, x + 1, label])
+                    else:
+                        runs[-1][-1][1] = x + 1
+            for s1, e1, c in runs[0]:
+                overlapping = [(s2, e2) for s2, e2, c2 in runs[1]
+                               if c2 == c and s2 < e1 and s1 < e2]
+                for s2, e2 in overlapping:
+                    minov = min(e1, e2) - max(s1, s2)
+                    maxov = max(e1, e2) - min(s1, s2)
+                    delta = min(maxov - minov, minov, (e1 - s1) // 2,
+                                (e2 - s2) // 2)
+                    sov_sum[p][c] += (minov + delta) / maxov * (e1 - s1)
+                sov_norm[p][c] += (e1 - s1) * max(len(overlapping), 1)
+        return (sov_sum, sov_norm)
+
+    def total(self):
+        """Confusion matrix summed over the proteins"""
+        return self.confusion.sum(axis=0)
+
+    def q3(self):
+        c = self.total()
+        return np.trace(c) / c.sum()
+
+    def protein_q3(self):
+        return np.trace(self.confusion, axis1=1, axis2=2) / \
+            self.confusion.sum(axis=(1, 2))
+
+    def precision(self):
+        c = self.total()
+        with np.errstate(invalid="ignore"):
+            return np.diag(c) / c.sum(axis=0)
+
+    def recall(self):
+        c = self.total()
+        with np.errstate(invalid="ignore"):
+            return np.diag(c) / c.sum(axis=1)
+
+    def sov(self):
+        return self.sov_sum.sum() / self.sov_norm.sum()
+
+    def class_sov(self):
+        with np.errstate(invalid="ignore"):
+            return self.sov_sum.sum(axis=0) / self.sov_norm.sum(axis=0)
+
+    def protein_sov(self):
+        return self.sov_sum.sum(axis=1) / self.sov_norm.sum(axis=1)
+
+class TestSet:
+    """The proteins of a test set with their true labels concatenated
+
+    Proteins without an annotation, or with residues the models can't
+    decode, are left out and listed in skipped.
+    """
+    def __init__(self, path):
+        from .data import load_records
+        from .viterbi import encode
+        ids, seqs, states = load_records(path)
+        self.ids = []
+        self.seqs = []
+        self.skipped = []
+        truth = []
+        for protein, seq, labels in zip(ids, seqs, states):
+            try:
+                if labels is None:
+                    raise ValueError("no annotation")
+                seq = encode(seq)
+                labels = encode_labels("".join(labels))
+                if len(labels) != len(seq):
+                    raise ValueError("length mismatch")
+            except (KeyError, ValueError):
+                self.skipped.append(protein)
+                continue
+            self.ids.append(protein)
+            self.seqs.append(seq)
+            truth.append(labels)
+        self.offsets = np.concatenate(([0], np.cumsum([len(s) for s in
+                                                       self.seqs])))
+        self.truth = np.concatenate(truth) if truth else \
+            np.zeros(0, dtype=np.uint8)
+        h = hashlib.sha1()
+        for seq, labels in zip(self.seqs, truth):
+            h.update(seq.tobytes() + b"\0" + labels.tobytes() + b"\n")
+        self.key = h.hexdigest()
+
+    def scores(self, pred):
+        return Scores(self.truth, pred, self.offsets)
+
+# the test set of each worker process, set up once by init_worker
+test_set = None
+
+def init_worker(seqs):
+    global test_set
+    test_set = seqs
+
+def predict_models(models):
+    """(models x residues) label codes of each model's posterior decoding of
+    the test set; the models must be distinct, so that Ensemble keeps them
+    all in order"""
+    from .ensemble import Ensemble
+    ensemble = Ensemble(models)
+    codes = np.array([LABELS.index(x) for x in ensemble.alphabet],
+                     dtype=np.uint8)
+    return np.concatenate([codes[ensemble.label_votes(seq)]
+                           for seq in test_set], axis=1)
+
+class PredictionCache:
+    """Predicted label codes of models on one test set, one .npy file per
+    model in directory/<test set key>/"""
+    def __init__(self, directory, test):
+        self.directory = None if directory is None else \
+            os.path.join(directory, test.key[:16])
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        if self.directory is None or not os.path.exists(self.path(key)):
+            return None
+        return np.load(self.path(key))
+
+    def put(self, key, pred):
+        if self.directory is None:
+            return
+        # written to a temporary file and renamed, so that an interrupted
+        # run never leaves a truncated prediction behind
+        tmp = self.path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, pred)
+        os.replace(tmp, self.path(key))
+
+def predict_sample(models, test, cache, processes=1):
+    """Predictions of every model on test, from the cache where possible;
+    returns (models x residues) label codes and how many were decoded"""
+    from .cache import fingerprint
+    keys = [fingerprint(m).hex() for m in models]
+    pred = np.empty((len(models), len(test.truth)), dtype=np.uint8)
+    missing = []
+    for k, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is not None and cached.shape == pred.shape[1:]:
+            pred[k] = cached
+        else:
+            missing.append(k)
+
+    # models with the same number of states are decoded together, which is
+    # where Ensemble saves its time
+    missing.sort(key=lambda k: len(models[k].labels))
+    chunks = [c for c in np.array_split(missing, max(1, min(len(missing),
+                                        2 * processes))) if len(c)]
+    if processes > 1 and len(chunks) > 1:
+        with multiprocessing.Pool(processes, init_worker,
+                                  (test.seqs,)) as pool:
+            results = pool.map(predict_models,
+                               [[models[k] for k in c] for c in chunks])
+    else:
+        init_worker(test.seqs)
+        results = [predict_models([models[k] for k in c]) for c in chunks]
+    for chunk, result in zip(chunks, results):
+        for k, row in zip(chunk, result):
+            pred[k] = row
+            cache.put(keys[k], row)
+    return (pred, len(missing))
+
+def test_scores(proteins=200, seed=1):
+    """Compare segment_overlap with segment_overlap_loop on random labels
+    with runs of random lengths, some proteins a single residue long"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 80, proteins)
+    lengths[::17] = 1
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    def runs():
+        codes = rng.integers(0, len(LABELS), offsets[-1])
+        change = rng.random(offsets[-1]) < 0.2
+        return codes[np.maximum.accumulate(np.where(change, np.arange(
+            offsets[-1]), 0))]
+
+    true = runs()
+    for pred in [runs(), true, (true + 1) % len(LABELS)]:
+        fast = Scores.segment_overlap(true, pred, offsets)
+        slow = Scores.segment_overlap_loop(true, pred, offsets)
+        assert np.allclose(fast[0], slow[0]) and np.array_equal(fast[1],
+                                                                slow[1])
+    print("SOV: {} proteins, vectorized and loop agree".format(proteins))
+
+def format_scores(scores):
+    lines = ["Q3 {:.4f}, SOV {:.4f}".format(scores.q3(), scores.sov()),
+             "true\\pred\t" + "\t".join(LABELS) + "\tprecision\trecall\tSOV"]
+    for t, label in enumerate(LABELS):
+        lines.append("{}\t\t{}\t{:.4f}\t\t{:.4f}\t{:.4f}".format(label,
+                     "\t".join(str(n) for n in scores.total()[t]),
+                     scores.precision()[t], scores.recall()[t],
+                     scores.class_sov()[t]))
+    return "\n".join(lines)
+
+def main(argv=None):
+    import time
+    parser = argparse.ArgumentParser(description="Score every model of a "
+                                     "sample, and the sample's vote, on a "
+                                     "test set")
+    parser.add_argument("-m", "--models", default="models.pkl",
+                        help="sampled models from mcmc.py, or an archive of "
+                        "them made by archive.py")
+    parser.add_argument("--paper", metavar="DIR",
+                        help="score the BMC paper model in DIR instead")
+    parser.add_argument("--test", default="test.fasta",
+                        help="FASTA of sequence/secstr pairs, or a store "
+                        "built by store.py")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--cache", default=".predictions", metavar="DIR",
+                        help="where to keep the predictions of each model")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="decode every model again and keep nothing")
+    parser.add_argument("--per-protein", metavar="TSV",
+                        help="write the Q3 and SOV of the vote for each "
+                        "protein here")
+    parser.add_argument("--self-check", action="store_true",
+                        help="check the vectorized SOV against a direct "
+                        "loop over the segments, and exit")
+    args = parser.parse_args(argv)
+    if args.self_check:
+        test_scores()
+        return 0
+
+    start = time.time()
+    test = TestSet(args.test)
+    for protein in test.skipped:
+        sys.stderr.write("Skipping {}: no annotation or unknown "
+                         "residues\n".format(protein))
+    from .predict import Predictor
+    ensemble = Predictor(args.models, args.paper).ensemble
+    cache = PredictionCache(None if args.no_cache else args.cache, test)
+    pred, decoded = predict_sample(ensemble.models, test, cache,
+                                   args.processes)
+    decode_time = time.time() - start
+
+    print("model\tsamples\tstates\tQ3\tSOV")
+    q3 = []
+    for k, m in enumerate(ensemble.models):
+        scores = test.scores(pred[k])
+        q3.append(scores.q3())
+        print("{}\t{}\t{}\t{:.4f}\t{:.4f}".format(k, int(ensemble.weights[k]),
+              len(m.labels), scores.q3(), scores.sov()))
+    print("{} samples, {} distinct models, {} decoded, {} proteins, {} "
+          "residues in {:.1f}s".format(ensemble.size(), len(ensemble),
+          decoded, len(test.ids), len(test.truth), decode_time))
+    print("Q3 of the models: mean {:.4f}, min {:.4f}, max {:.4f}".format(
+          np.mean(q3), np.min(q3), np.max(q3)))
+
+    from .ensemble import vote
+    consensus = test.scores(vote(pred, ensemble.weights, len(LABELS)))
+    print("Vote of the sample:")
+    print(format_scores(consensus))
+
+    if args.per_protein:
+        with open(args.per_protein, "w") as f:
+            f.write("protein\tlength\tQ3\tSOV\n")
+            for protein, n, q, s in zip(test.ids, np.diff(test.offsets),
+                                        consensus.protein_q3(),
+                                        consensus.protein_sov()):
+                f.write("{}\t{}\t{:.4f}\t{:.4f}\n".format(protein, n, q, s))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
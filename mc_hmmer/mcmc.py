@@ -0,0 +1,923 @@
+#!/usr/bin/env python3
+
+import random
+import math
+import time
+import numpy as np
+from .moves import mcmc_move, is_strongly_connected, MoveMixture
+from .data import *
+from .viterbi import *
+from .parallel import ParallelLikelihood
+from .cluster import RemoteLikelihood
+from .cache import fingerprint, LikelihoodCache
+from .diagnostics import (effective_sample_size, OnlineDiagnostics,
+                         format_report)
+from .ensemble import Ensemble
+from .checkpoint import (save_checkpoint, load_checkpoint, is_sample_file,
+                        read_samples, SampleWriter)
+from .metrics import Metrics, Profiler, parse_window
+from .baumwelch import baum_welch, structure_codes, print_stats
+from . import archive
+import argparse
+import importlib
+import operator
+import pickle
+import csv
+import sys
+
+FLOAT = np.dtype(float)
+
+def frozen(x):
+    """x as a read-only float array; read-only arrays are shared, not copied"""
+    if (isinstance(x, np.ndarray) and x.dtype == float and
+        not x.flags.writeable):
+        # an unpickled array has its own copy of the dtype, which would make
+        # it pickle differently from the original; a view swaps in numpy's
+        return x if x.dtype is FLOAT else x.view(FLOAT)
+    x = np.array(x, dtype=float)
+    x.flags.writeable = False
+    return x
+
+class Model:
+    """A class representing an HMM.
+
+    e is the matrix of emission probabilities
+    a is the matrix of transition probabilities
+    labels is a list of the labels for the nodes (ie. alpha, beta, coil, none)
+
+    a and e are read-only arrays, so a model made from another one by a move
+    shares whichever of them the move didn't change. Derived data (log
+    matrices, edge list, strong connectivity, predecessor lists) is computed
+    on first use and kept; replace() carries over the parts that are still valid.
+    """
+    __slots__ = ["a", "e", "labels", "_log_a", "_log_e", "_edges",
+                 "_connected", "_topology"]
+
+    def __init__(self, a, e, labels):
+        self.a = frozen(a)
+        self.e = frozen(e)
+        self.labels = tuple(labels)
+        self._log_a = None
+        self._log_e = None
+        self._edges = None
+        self._connected = None
+        self._topology = None
+
+    def replace(self, a=None, e=None, labels=None, same_edges=False,
+                connected=None):
+        """A new model with some of a, e and labels replaced
+
+        same_edges says a new a has the same zero pattern as the old one, and
+        connected gives the connectivity of the new model if it is known.
+        """
+        m = Model.__new__(Model)
+        m.a = self.a if a is None else frozen(a)
+        m.e = self.e if e is None else frozen(e)
+        m.labels = self.labels if labels is None else tuple(labels)
+        m._log_a = self._log_a if a is None else None
+        m._log_e = self._log_e if e is None else None
+        keep = a is None or same_edges
+        m._edges = self._edges if keep else None
+        m._connected = self._connected if keep else connected
+        m._topology = self._topology if a is None else None
+        return m
+
+    @property
+    def log_a(self):
+        if self._log_a is None:
+            self._log_a = frozen_log(self.a)
+        return self._log_a
+
+    @property
+    def log_e(self):
+        if self._log_e is None:
+            self._log_e = frozen_log(self.e)
+        return self._log_e
+
+    @property
+    def edges(self):
+        """(i, j) for every nonzero a[i][j], in row order"""
+        if self._edges is None:
+            self._edges = [tuple(x) for x in np.argwhere(self.a != 0).tolist()]
+        return self._edges
+
+    @property
+    def topology(self):
+        """Predecessor lists of a, for the sparse kernels in viterbi.py"""
+        if self._topology is None:
+            self._topology = Topology(self.a)
+        return self._topology
+
+    @property
+    def connected(self):
+        """Whether the transitions between states are strongly connected"""
+        if self._connected is None:
+            self._connected = is_strongly_connected(self.a[1:])
+        return self._connected
+
+    def __getstate__(self):
+        return {"a": self.a, "e": self.e, "labels": list(self.labels)}
+
+    def __setstate__(self, state):
+        # pickles of the old list-based Model hold the same keys in __dict__
+        self.__init__(state["a"], state["e"], state["labels"])
+
+def frozen_log(x):
+    """Elementwise log of x as a read-only array, with log(0) = -inf"""
+    with np.errstate(divide="ignore"):
+        x = np.log(x)
+    x.flags.writeable = False
+    return x
+
+def consensus(seqs):
+    """Return the plurality consensus of a list of sequences"""
+    cons = []
+    for i in range(len(seqs[0])):
+        counts = {}
+        for s in seqs:
+            try:
+                counts[s[i]] += 1
+            except KeyError:
+                counts[s[i]] = 1
+        cons.append(sorted(counts.items(), key=lambda x: -x[1])[0][0])
+    return cons
+
+def log_likelihood(m, seqs):
+    """Total log likelihood of m over a list of sequences, PackedSequences,
+    ParallelLikelihood or RemoteLikelihood"""
+    if isinstance(seqs, (ParallelLikelihood, RemoteLikelihood)):
+        return seqs.log_likelihood(m)
+    if not isinstance(seqs, PackedSequences):
+        seqs = PackedSequences(seqs)
+    return batchForward(m.e, m.a, seqs)[1]
+
+def sequence_log_likelihoods(m, seqs):
+    """Per-sequence log likelihoods of m over PackedSequences,
+    ParallelLikelihood or RemoteLikelihood"""
+    if isinstance(seqs, (ParallelLikelihood, RemoteLikelihood)):
+        return seqs.sequence_log_likelihoods(m)
+    return batchForward(m.e, m.a, seqs)[0]
+
+def metropolis(log_ratio):
+    """Accept with probability min(1, exp(log_ratio))"""
+    return log_ratio >= 0 or random.random() < math.exp(log_ratio)
+
+def metropolis_step(m, log_likelihood_m, seqs, cache, max_states, beta=1.0):
+    """One Metropolis-Hastings step from m, with the likelihood raised to the
+    power beta; returns the move name, the new current model, its log
+    likelihood and whether the proposal was accepted"""
+    move, m2 = mcmc_move(m)
+    if m2 is m:
+        cache.identical += 1
+        return (move, m, log_likelihood_m, True)
+    if len(m2.labels) > max_states:
+        return (move, m, log_likelihood_m, False)
+    log_likelihood_m2 = cached_log_likelihood(m2, seqs, cache)
+    if metropolis(beta * (log_likelihood_m2 - log_likelihood_m)):
+        return (move, m2, log_likelihood_m2, True)
+    return (move, m, log_likelihood_m, False)
+
+def initial_model(seqs, states):
+    """The 3-state starting model, with emissions counted from the data"""
+    e = harvest_e(seqs, states)
+    a = [[1.0/3, 1.0/3, 1.0/3],
+         [0.9, 0, 0.1],
+         [0, 0.89, 0.11],
+         [0.1, 0.11, 0.79]]
+    labels = ["A", "B", "O"]
+    return Model(a, e, labels)
+
+def cached_log_likelihood(m, seqs, cache):
+    """log_likelihood, looked up in a LikelihoodCache first"""
+    key = fingerprint(m)
+    loglik = cache.get(key)
+    if loglik is None:
+        loglik = log_likelihood(m, seqs)
+        cache.put(key, loglik)
+    return loglik
+
+def log_likelihoods(models, seqs):
+    """Total log likelihoods of several models, scored together on a
+    ParallelLikelihood or RemoteLikelihood"""
+    if isinstance(seqs, (ParallelLikelihood, RemoteLikelihood)):
+        return seqs.log_likelihoods(models)
+    return [log_likelihood(m, seqs) for m in models]
+
+def cached_log_likelihoods(models, seqs, cache, max_states):
+    """log_likelihoods of the models not in a LikelihoodCache, each distinct
+    model scored once; models with more than max_states states get -inf.
+    Returns the log likelihoods and how many models were scored."""
+    keys = [fingerprint(m) if len(m.labels) <= max_states else None
+            for m in models]
+    known = {}
+    missing = {}
+    for m, key in zip(models, keys):
+        if key is None or key in known or key in missing:
+            continue
+        loglik = cache.get(key)
+        if loglik is None:
+            missing[key] = m
+        else:
+            known[key] = loglik
+    if missing:
+        for key, loglik in zip(missing, log_likelihoods(
+                list(missing.values()), seqs)):
+            cache.put(key, loglik)
+            known[key] = loglik
+    return ([-math.inf if key is None else known[key] for key in keys],
+            len(missing))
+
+def log_sum_exp(x):
+    top = max(x)
+    if top == -math.inf:
+        return top
+    return top + math.log(math.fsum(math.exp(v - top) for v in x))
+
+def split_sequences(seqs, chunks):
+    """Pack seqs, longest first, into chunks groups holding 1/2, 1/4, ... of
+    the residues, with the last group taking the rest
+
+    A proposal can normally only be ruled out near the end of the training
+    set, so the groups get smaller to check the bound more often there.
+    Returns the groups and their per-residue counts.
+    """
+    order = sorted(range(len(seqs)), key=lambda i: -len(seqs[i]))
+    total = sum(len(s) for s in seqs)
+    groups = [[]]
+    size = 0
+    for i in order:
+        if (size >= total * (1 - 0.5 ** len(groups)) and
+            len(groups) < chunks):
+            groups.append([])
+        groups[-1].append(seqs[i])
+        size += len(seqs[i])
+    packed = [PackedSequences(g) for g in groups]
+    counts = [np.bincount(np.concatenate([encode(s) for s in g]),
+                          minlength=20) for g in groups]
+    return (packed, counts)
+
+def bounded_log_likelihood(m, chunks, threshold):
+    """Log likelihood of m over (PackedSequences, residue counts) chunks,
+    scored in order and abandoned once it provably falls below threshold
+
+    A forward step can shrink the total probability by at most
+    max_k sum_j a[k][j] e[c][j] for residue c, which bounds the log
+    likelihood of every chunk not scored yet. Returns the total, or None
+    if it was abandoned, and the number of sequences that were not scored.
+    """
+    packed, counts = chunks
+    a = np.asarray(m.a, dtype=float)
+    e = np.asarray(m.e, dtype=float)
+    with np.errstate(divide="ignore"):
+        step = np.log(np.dot(a, e.T).max(axis=0))
+    bounds = [float(np.dot(c, step)) for c in counts]
+
+    loglik = 0
+    remaining = sum(len(p) for p in packed)
+    for k in range(len(packed)):
+        loglik += batchForward(m.e, m.a, packed[k])[1]
+        remaining -= len(packed[k])
+        if remaining > 0 and loglik + sum(bounds[k+1:]) < threshold:
+            return (None, remaining)
+    return (loglik, remaining)
+
+def early_abort_log_likelihood(m, chunks, threshold, cache, max_states):
+    """Score a proposal for early-abort acceptance
+
+    Returns its log likelihood (None if it can't beat threshold), the number
+    of sequences that were not scored, and the cache outcome.
+    """
+    if len(m.labels) > max_states:
+        return (None, sum(len(p) for p in chunks[0]), "NA")
+    key = fingerprint(m)
+    loglik = cache.get(key)
+    if loglik is not None:
+        return (loglik, 0, "hit")
+    loglik, skipped = bounded_log_likelihood(m, chunks, threshold)
+    if loglik is not None:
+        cache.put(key, loglik)
+    return (loglik, skipped, "miss")
+
+class DelayedAcceptance:
+    """Two-stage delayed-acceptance screen for proposals
+
+    Stage one accepts m2 with the Metropolis probability of the likelihood
+    on a subsample of the training sequences, scaled up to the whole set.
+    Only survivors are scored on everything, and stage two accepts them with
+    probability min(1, full ratio / stage one ratio), so the chain still
+    targets the full-data posterior (Christen and Fox, 2005). The subsample
+    is either fixed or rotates through disjoint blocks with the iteration
+    number, a schedule that doesn't depend on the chain; both models are always compared on the
+    same block, and the current model's per-sequence log likelihoods are
+    kept from its full evaluation, so only m2 is scored in stage one.
+    """
+    def __init__(self, seqs, train, m, size, rotate=True):
+        indices = list(range(len(seqs)))
+        random.shuffle(indices)
+        size = min(size, len(seqs))
+        n_blocks = len(seqs) // size if rotate else 1
+        self.blocks = []
+        for k in range(n_blocks):
+            block = indices[k*size:(k+1)*size]
+            self.blocks.append((block, PackedSequences([seqs[i] for i in block])))
+        self.n_seqs = len(seqs)
+        self.train = train
+
+        self.proposed = 0
+        self.stage_one = 0
+        self.stage_two = 0
+        self.screen_time = 0
+        self.full_time = 0
+        self.full_evals = 0
+        self.current = self.full_log_likelihoods(m)
+
+    def full_log_likelihoods(self, m):
+        start = time.time()
+        loglik = sequence_log_likelihoods(m, self.train)
+        self.full_time += time.time() - start
+        self.full_evals += 1
+        return loglik
+
+    def accept(self, m2, max_states, iteration):
+        """Run both stages on m2, screening it on the block for iteration;
+        returns whether it was accepted, its full log likelihood (None if it
+        didn't reach stage two) and the last stage it reached"""
+        block, packed = self.blocks[iteration % len(self.blocks)]
+        self.proposed += 1
+        if len(m2.labels) > max_states:
+            return (False, None, 1)
+
+        # stage one: the likelihood ratio on the subsample
+        start = time.time()
+        scale = float(self.n_seqs) / len(block)
+        screen = scale * (batchForward(m2.e, m2.a, packed)[1] -
+                          self.current[block].sum())
+        self.screen_time += time.time() - start
+        if not metropolis(screen):
+            return (False, None, 1)
+        self.stage_one += 1
+
+        # stage two: correct by the full ratio
+        full = self.full_log_likelihoods(m2)
+        log_likelihood_m2 = float(full.sum())
+        if not metropolis(log_likelihood_m2 - float(self.current.sum()) - screen):
+            return (False, log_likelihood_m2, 2)
+        self.stage_two += 1
+        self.current = full
+        return (True, log_likelihood_m2, 2)
+
+    def __getstate__(self):
+        # checkpoints keep the blocks' indices, and attach() rebuilds the
+        # packed sequences from the training data on resume
+        state = dict(self.__dict__)
+        del state["train"]
+        state["blocks"] = [block for block, packed in self.blocks]
+        return state
+
+    def attach(self, seqs, train):
+        """Reconnect a DelayedAcceptance loaded from a checkpoint to the
+        training data"""
+        self.train = train
+        self.blocks = [(block, PackedSequences([seqs[i] for i in block]))
+                       for block in self.blocks]
+
+    def summary(self, elapsed, ess):
+        """Acceptance rates of both stages and the time saved by screening"""
+        full = self.full_time / self.full_evals if self.full_evals else 0
+        saved = (self.proposed - self.stage_one) * full - self.screen_time
+        return ("stage one acceptance {:.3f}, stage two acceptance {:.3f}; "
+                "{:.1f}s elapsed, {:.1f}s saved by screening, ESS {:.1f}, "
+                "{:.3f}s saved per effective sample".format(
+                self.stage_one / max(self.proposed, 1),
+                self.stage_two / max(self.stage_one, 1),
+                elapsed, saved, ess, saved / ess if ess else 0))
+
+class MultipleTry:
+    """Multiple-try Metropolis (Liu, Liang and Wong, 2000)
+
+    A step draws k proposals y_1..y_k from the current model x and scores
+    them together, in one round trip to the worker pool, then picks one of
+    them, y, with probability proportional to its likelihood. It then draws
+    k-1 reference models from y and scores those together too, and with x
+    as the k-th reference accepts y with probability
+    min(1, sum_j L(y_j) / sum_j L(x_j)). With the moves treated as
+    symmetric, as in the plain chain, this leaves the same posterior
+    invariant. A step costs up to 2k-1 likelihoods in two batches instead of
+    one likelihood, so it pays off when the pool has cores to spare; the
+    statistics compare the mixing per step with the cost of a step.
+    """
+    def __init__(self, tries):
+        self.tries = tries
+        self.steps = 0
+        self.accepted = 0
+        self.scored = 0
+        self.seconds = 0.0
+        self.moves = []
+        self.chosen = None
+
+    def select(self, m, log_likelihood_m, proposal, seqs, cache, max_states):
+        """Draw and score the proposals and their references; returns the
+        chosen proposal's move name, model, log likelihood (None if every
+        proposal was impossible), the log acceptance ratio and how many
+        likelihoods were scored"""
+        start = time.perf_counter()
+        draws = [proposal.propose(m) for k in range(self.tries)]
+        self.moves = [move for move, y in draws]
+        logliks, scored = cached_log_likelihoods([y for move, y in draws],
+                                                 seqs, cache, max_states)
+        total = log_sum_exp(logliks)
+        if total == -math.inf:
+            self.chosen = None
+            self.record(scored, start)
+            return (self.moves[0], m, None, -math.inf, scored)
+
+        # choose y in proportion to the likelihoods
+        r = random.random() * math.fsum(math.exp(v - total) for v in logliks)
+        for k, v in enumerate(logliks):
+            r -= math.exp(v - total)
+            if r < 0:
+                break
+        while logliks[k] == -math.inf:
+            k -= 1
+        self.chosen = k
+        move, y = draws[k]
+
+        # the references are drawn from y, with x itself the last of them
+        references = [proposal.propose(y)[1] for j in range(self.tries - 1)]
+        reference_logliks, more = cached_log_likelihoods(references, seqs,
+                                                         cache, max_states)
+        scored += more
+        self.record(scored, start)
+        log_ratio = total - log_sum_exp(reference_logliks + [log_likelihood_m])
+        return (move, y, logliks[k], log_ratio, scored)
+
+    def record(self, scored, start):
+        self.steps += 1
+        self.scored += scored
+        self.seconds += time.perf_counter() - start
+
+    def record_moves(self, proposal, accepted, moved, seconds, jump):
+        """Charge the step to the MoveMixture: every try is a proposal, and
+        only the chosen one can have moved the chain"""
+        self.accepted += bool(accepted)
+        for k, move in enumerate(self.moves):
+            chosen = k == self.chosen
+            proposal.record(move, moved and chosen, seconds / self.tries,
+                            jump if chosen else 0.0)
+
+    def summary(self, ess, elapsed):
+        """Cost per step against mixing, for comparing values of k"""
+        steps = max(self.steps, 1)
+        return ("multiple try, k={}: acceptance {:.3f}, {:.2f} likelihoods "
+                "and {:.1f} ms per step; ESS {:.1f}, {:.4f} per step, {:.4f} "
+                "per second, {:.5f} per likelihood".format(self.tries,
+                self.accepted / steps, self.scored / steps,
+                1000 * self.seconds / steps, ess, ess / steps,
+                ess / max(elapsed, 1e-9), ess / max(self.scored, 1)))
+
+class ModelUnpickler(pickle.Unpickler):
+    """Unpickler that finds Model and DelayedAcceptance here even if the
+    pickle was written by running this file as a script, where they were in
+    __main__, and the classes of the other modules of this package in it
+    even if the pickle was written when they were top-level modules"""
+    def find_class(self, module, name):
+        if name in ["Model", "DelayedAcceptance", "MultipleTry"]:
+            return globals()[name]
+        if "." not in module and module != "__main__":
+            try:
+                module = importlib.import_module("." + module,
+                                                 __package__).__name__
+            except ImportError:
+                pass
+        return pickle.Unpickler.find_class(self, module, name)
+
+def load_models(path="models.pkl"):
+    """Load the list of sampled models written by main(), either models.pkl,
+    the sample file of a run (which may still be going) or an archive made
+    by archive.py"""
+    if is_sample_file(path):
+        return [m for iteration, m in read_samples(path)]
+    if archive.is_archive(path):
+        # the models share the archive's memory map, which stays open as
+        # long as they do; repeated samples are the same object, as in a
+        # pickle
+        models = archive.ModelArchive(path)
+        distinct = [models.model(i) for i in range(models.count)]
+        distinct = [Model(m.a, m.e, m.labels) for m in distinct]
+        return [distinct[i] for i in models.samples]
+    with open(path, "rb") as f:
+        return ModelUnpickler(f).load()
+
+def get_path(m, seq):
+    path = run_viterbi(m.e, m.a, seq, True, m.log_e, m.log_a, m.topology)
+    return [m.labels[x-1] for x in path]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sample HMM topologies for "
+                                     "secondary structure prediction by MCMC")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the run saved in the checkpoint")
+    parser.add_argument("--seed", type=int,
+                        help="seed the random number generator, so that a "
+                        "run can be repeated")
+    parser.add_argument("--checkpoint", default="mcmc.ckpt",
+                        help="where to save the state of the chain")
+    parser.add_argument("--checkpoint-every", type=int, default=500,
+                        help="iterations between checkpoints")
+    parser.add_argument("--samples", default="samples.bin",
+                        help="file the sampled models are appended to")
+    parser.add_argument("--metrics", metavar="JSONL",
+                        help="write the metrics of every iteration here")
+    parser.add_argument("--prometheus", metavar="PROM",
+                        help="keep a Prometheus text-format snapshot here")
+    parser.add_argument("--profile", metavar="FIRST:LAST", type=parse_window,
+                        help="run cProfile over iterations FIRST to LAST-1")
+    parser.add_argument("--profile-output", default="mcmc.prof",
+                        help="where to save the profile")
+    parser.add_argument("--train", default="train.fasta",
+                        help="training proteins (a FASTA of sequence/secstr "
+                        "pairs, or a store built by store.py)")
+    parser.add_argument("--test", default="test.fasta",
+                        help="proteins to score the sample on at the end")
+    parser.add_argument("-o", "--output", default="models.pkl",
+                        help="where to write the sampled models")
+    group = parser.add_argument_group("run parameters")
+    group.add_argument("-n", "--iterations", type=int, default=10000,
+                       help="how many iterations to do in total")
+    group.add_argument("--sample-every", type=int, default=100,
+                       help="how often to sample models")
+    group.add_argument("--burnin", type=int, default=1000,
+                       help="don't start sampling until after this many "
+                       "iterations")
+    group.add_argument("--max-states", type=int, default=10,
+                       help="models with more states are always rejected")
+    group.add_argument("-p", "--processes", type=int, default=1,
+                       help="processes to evaluate the likelihood on (1 to "
+                       "run serially)")
+    group.add_argument("--workers", nargs="+", metavar="HOST:PORT",
+                       help="evaluate the likelihood on these workers (see "
+                       "cluster.py worker) instead of local processes")
+    group.add_argument("--worker-timeout", type=float, default=30.0,
+                       help="seconds to wait for a worker before giving its "
+                       "shards to the others")
+    group.add_argument("--cache-size", type=int, default=10000,
+                       help="how many model likelihoods to remember")
+    group.add_argument("--acceptance", default="standard",
+                       choices=["standard", "early_abort", "delayed"],
+                       help="standard scores every proposal in full; "
+                       "early_abort draws the acceptance threshold first and "
+                       "stops scoring a proposal once it can't reach it; "
+                       "delayed screens each proposal on a subsample first")
+    group.add_argument("--abort-chunks", type=int, default=8,
+                       help="pieces early_abort splits the training set into")
+    group.add_argument("--delayed-subsample", type=int, default=20,
+                       help="training sequences delayed screens on")
+    group.add_argument("--fixed-subsample", action="store_true",
+                       help="screen on the same subsample every time instead "
+                       "of rotating through disjoint ones")
+    group.add_argument("--em-steps", type=int, default=0,
+                       help="Baum-Welch steps to refine each newly accepted "
+                       "model with; the chain is then no longer exact MCMC, "
+                       "but its models fit their topologies better")
+    group.add_argument("--em-labeled", action="store_true",
+                       help="constrain Baum-Welch to the secstr labels")
+    group.add_argument("--adaptive", action="store_true",
+                       help="tune the move weights and the transition step "
+                       "size during burn-in, then freeze them")
+    group.add_argument("--adapt-every", type=int, default=50,
+                       help="proposals between updates of the move weights")
+    group.add_argument("-k", "--tries", type=int, default=1,
+                       help="multiple-try Metropolis: score this many "
+                       "proposals per step together, and choose among them "
+                       "(with standard acceptance only)")
+    group = parser.add_argument_group("convergence")
+    group.add_argument("--check-every", type=int, default=100,
+                       help="iterations between convergence checks of the "
+                       "log likelihood and state count traces")
+    group.add_argument("--target-ess", type=float,
+                       help="stop once both traces have this effective "
+                       "sample size after burn-in, R-hat at most "
+                       "--target-rhat and pass Geweke's test")
+    group.add_argument("--target-rhat", type=float, default=1.01,
+                       help="split R-hat needed to stop at --target-ess")
+    group.add_argument("--time-budget", type=float, metavar="SECONDS",
+                       help="stop after this long, whether converged or not")
+    group.add_argument("--auto-burnin", action="store_true",
+                       help="keep only the samples after the burn-in found by "
+                       "the last convergence check (use with a low --burnin)")
+    args = parser.parse_args(argv)
+    if args.tries < 1:
+        parser.error("--tries must be at least 1")
+    if args.tries > 1 and args.acceptance != "standard":
+        parser.error("--tries needs --acceptance standard")
+    if args.workers and args.acceptance == "early_abort":
+        parser.error("--acceptance early_abort can't use --workers")
+    if (args.processes > 1 and args.acceptance == "early_abort" and
+            args.em_steps == 0):
+        # early_abort scores its chunks serially, so the pool would only
+        # ever score the starting model
+        parser.error("--acceptance early_abort can only use --processes "
+                     "for --em-steps")
+    if args.workers and args.processes > 1:
+        parser.error("--processes can't be combined with --workers")
+
+    n_iter = args.iterations
+    sample_every = args.sample_every
+    burnin = args.burnin
+    processes = args.processes
+    cache_size = args.cache_size
+    max_states = args.max_states
+    acceptance = args.acceptance
+    abort_chunks = args.abort_chunks
+    delayed_subsample = args.delayed_subsample
+    delayed_rotate = not args.fixed_subsample
+    em_steps = args.em_steps
+    em_labeled = args.em_labeled
+
+    # a run can only be resumed with the same settings, except that n_iter
+    # may be raised to extend it
+    settings = {"sample_every": sample_every, "burnin": burnin,
+                "max_states": max_states, "acceptance": acceptance,
+                "abort_chunks": abort_chunks,
+                "delayed_subsample": delayed_subsample,
+                "delayed_rotate": delayed_rotate, "em_steps": em_steps,
+                "em_labeled": em_labeled, "adaptive": args.adaptive,
+                "adapt_every": args.adapt_every, "tries": args.tries,
+                "seed": args.seed}
+    if args.resume:
+        print("Resuming from", args.checkpoint)
+        state = load_checkpoint(args.checkpoint)
+        if state["settings"] != settings:
+            sys.exit("{} was written with different settings: {}".format(
+                     args.checkpoint, state["settings"]))
+    elif args.seed is not None:
+        random.seed(args.seed)
+
+    # load the data
+    print("Loading training data")
+    data, states = load_train_data(args.train)
+    structures = structure_codes(states) if em_labeled else None
+    if args.workers:
+        train = RemoteLikelihood(data, args.workers, args.worker_timeout)
+    elif processes > 1:
+        train = ParallelLikelihood(data, processes, structures)
+    else:
+        train = PackedSequences(data)
+    if acceptance == "early_abort":
+        train_chunks = split_sequences(data, abort_chunks)
+    skipped = 0
+
+    if args.resume:
+        m = state["model"]
+        log_likelihood_m = state["loglik"]
+        cache = state["cache"]
+        skipped = state["skipped"]
+        if acceptance == "delayed":
+            delayed = state["delayed"]
+            delayed.attach(data, train)
+        trace = state["trace"]
+        proposal = state["proposal"]
+        diagnostics = state["diagnostics"]
+        multiple_try = state["multiple_try"]
+        first = state["iteration"]
+        random.setstate(state["random"])
+        samples = SampleWriter(args.samples, state["samples_size"])
+    else:
+        # initialize the model from the assignment, with emission
+        # probabilities from the amino acid frequencies
+        print("Measuring amino acid frequencies")
+        m = initial_model(data, states)
+
+        cache = LikelihoodCache(cache_size)
+        log_likelihood_m = cached_log_likelihood(m, train, cache)
+        if acceptance == "delayed":
+            delayed = DelayedAcceptance(data, train, m, delayed_subsample,
+                                        delayed_rotate)
+        trace = []
+        proposal = MoveMixture(args.adaptive, args.adapt_every)
+        diagnostics = OnlineDiagnostics(["loglik", "states"])
+        multiple_try = MultipleTry(args.tries) if args.tries > 1 else None
+        first = 0
+        samples = SampleWriter(args.samples)
+
+    def checkpoint(iteration):
+        # the samples go to disk first, so the checkpoint never refers to
+        # samples that were lost
+        save_checkpoint(args.checkpoint, {
+            "settings": settings, "iteration": iteration, "model": m,
+            "loglik": log_likelihood_m, "random": random.getstate(),
+            "trace": trace, "proposal": proposal,
+            "diagnostics": diagnostics, "multiple_try": multiple_try,
+            "cache": cache,
+            "skipped": skipped,
+            "delayed": delayed if acceptance == "delayed" else None,
+            "samples_size": samples.sync()})
+
+    # to log the results
+    header = ["loglik", "move", "lik.ratio", "accept", "cache", "skipped",
+              "stage"]
+    writer = csv.DictWriter(sys.stderr, fieldnames=header, delimiter="\t")
+    if not args.resume:
+        writer.writeheader()
+
+    metrics = Metrics(args.metrics, args.prometheus, resume=args.resume)
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile[0], args.profile[1],
+                            args.profile_output)
+
+    # run MCMC
+    start = time.time()
+    done = max(n_iter, first)
+    for i in range(first, n_iter):
+        if profiler is not None:
+            profiler.iteration(i)
+        metrics.start()
+
+        print("------------------------------")
+        print("Iteration", i, "-", len(m.labels), "states")
+
+        row = dict.fromkeys(header)
+        row["skipped"] = 0
+
+        # generate a new model; an adaptive proposal is only tuned during
+        # burn-in
+        if i == burnin:
+            proposal.freeze()
+        step_start = time.perf_counter()
+        if multiple_try is None:
+            row["move"], m2 = proposal.propose(m)
+
+        if acceptance == "early_abort":
+            # draw u up front, so that scoring can stop as soon as m2 is known
+            # to fall short of log_likelihood_m + log(u)
+            u = random.random()
+            threshold = log_likelihood_m + (math.log(u) if u > 0 else -math.inf)
+        metrics.lap("proposal")
+
+        # find its log likelihood, unless the move gave back the same model;
+        # multiple-try steps draw and score all their proposals at once
+        if multiple_try is not None:
+            row["move"], m2, log_likelihood_m2, log_ratio, scored = \
+                multiple_try.select(m, log_likelihood_m, proposal, train,
+                                    cache, max_states)
+            row["cache"] = "scored {}".format(scored)
+            print("Multiple try: {} proposals, {} scored, chose {}".format(
+                  args.tries, scored, row["move"]))
+        elif m2 is m:
+            cache.identical += 1
+            row["cache"] = "same"
+            log_likelihood_m2 = log_likelihood_m
+        elif acceptance == "early_abort":
+            log_likelihood_m2, row["skipped"], row["cache"] = \
+                early_abort_log_likelihood(m2, train_chunks, threshold, cache,
+                                           max_states)
+            skipped += row["skipped"]
+        elif acceptance == "delayed":
+            accept, log_likelihood_m2, row["stage"] = delayed.accept(
+                m2, max_states, i)
+        else:
+            hits = cache.hits
+            log_likelihood_m2 = cached_log_likelihood(m2, train, cache)
+            row["cache"] = "hit" if cache.hits > hits else "miss"
+        metrics.lap("likelihood")
+
+        # accept the new model with probability equal to the likelihood ratio
+        if log_likelihood_m2 is None:
+            ratio = "NA"
+            accept = False
+        else:
+            ratio = math.exp(log_likelihood_m2 - log_likelihood_m)
+            if acceptance == "delayed":
+                if m2 is m:
+                    accept = True
+            elif multiple_try is not None:
+                accept = metropolis(log_ratio)
+            elif acceptance == "early_abort":
+                accept = (len(m2.labels) <= max_states and
+                          log_likelihood_m2 > threshold)
+            else:
+                accept = (len(m2.labels) <= max_states and
+                          (log_likelihood_m2 > log_likelihood_m or
+                           random.random() < ratio))
+        print("Likelyhood ratio:", ratio)
+        row["lik.ratio"] = ratio
+        row["accept"] = "FALSE"
+        moved = accept and m2 is not m
+        jump = (log_likelihood_m2 - log_likelihood_m) ** 2 if moved else 0.0
+        if multiple_try is not None:
+            multiple_try.record_moves(proposal, accept, moved,
+                                      time.perf_counter() - step_start, jump)
+        else:
+            proposal.record(row["move"], moved,
+                            time.perf_counter() - step_start, jump)
+        if accept:
+            m = m2
+            log_likelihood_m = log_likelihood_m2
+            print("Switch to new model")
+            row["accept"] = "TRUE"
+        metrics.lap("acceptance")
+
+        if accept and moved and em_steps > 0:
+            m, history = baum_welch(m, data, structures, em_steps,
+                pool=train if processes > 1 else None, report=print_stats)
+            if acceptance == "delayed":
+                delayed.current = delayed.full_log_likelihoods(m)
+                log_likelihood_m = float(delayed.current.sum())
+            else:
+                log_likelihood_m = cached_log_likelihood(m, train, cache)
+            metrics.lap("em")
+
+        row["loglik"] = log_likelihood_m
+        writer.writerow(row)
+        trace.append(log_likelihood_m)
+        diagnostics.add(log_likelihood_m, len(m.labels))
+
+        # keep some subset of the models
+        if i % sample_every == 0 and i > burnin:
+            print("Sampled iteration", i)
+            samples.append(i, m)
+
+        if (i + 1) % args.checkpoint_every == 0:
+            checkpoint(i + 1)
+        metrics.record(i, row["move"], accept, log_likelihood_m,
+                       len(m.labels), cache)
+
+        # stop early once the chain has converged or the time is up
+        if (i + 1) % args.check_every == 0:
+            report = diagnostics.check()
+            print("Convergence:", format_report(report))
+            if args.target_ess is not None and diagnostics.converged(
+                    report, args.target_ess, args.target_rhat):
+                print("Reached the target ESS and R-hat after {} iterations"
+                      .format(i + 1))
+                done = i + 1
+                break
+        if (args.time_budget is not None and
+                time.time() - start > args.time_budget):
+            print("Time budget used up after {} iterations".format(i + 1))
+            done = i + 1
+            break
+
+    if profiler is not None:
+        profiler.stop()
+    metrics.close()
+    checkpoint(done)
+    samples.close()
+    report = diagnostics.check()
+    print("Convergence:", format_report(report))
+    print("Convergence checks took {:.3f} s of {:.1f} s".format(
+          diagnostics.seconds, time.time() - start))
+    if args.auto_burnin and report is not None:
+        sampled = read_samples(args.samples)
+        sampled_models = [m for iteration, m in sampled
+                          if iteration >= report["burnin"]]
+        print("Kept {} of {} samples after the burn-in at iteration {}".format(
+              len(sampled_models), len(sampled), report["burnin"]))
+    else:
+        sampled_models = load_models(args.samples)
+
+    if args.workers:
+        print("Likelihood workers:")
+        print(train.summary())
+    if args.workers or processes > 1:
+        train.close()
+
+    print("Likelihood cache:", cache.summary())
+    if acceptance == "early_abort":
+        print("Early abort skipped {} of {} sequence evaluations".format(
+            skipped, len(trace) * len(data)))
+    if acceptance == "delayed":
+        print("Delayed acceptance:", delayed.summary(time.time() - start,
+            effective_sample_size(trace[burnin:])))
+    print(proposal.summary(effective_sample_size(trace[burnin:]),
+                           proposal.seconds.sum()))
+    if multiple_try is not None:
+        print(multiple_try.summary(effective_sample_size(trace[burnin:]),
+                                   time.time() - start))
+
+    with open(args.output, "wb") as f:
+        pickle.dump(sampled_models, f)
+    if not sampled_models:
+        print("No models were sampled after burn-in, so the test set isn't "
+              "scored")
+        return 0
+
+    data, true_states = load_test_data(args.test)
+
+    results = [0, 0] # number of correct/incorrect bases
+    ensemble = Ensemble(sampled_models)
+    for i in range(len(data)):
+        states = ensemble.predict(data[i])
+        for j in range(len(true_states[i])):
+            if states[j] == true_states[i][j]:
+                results[0] += 1
+            else:
+                results[1] += 1
+
+    print ("{} correct bases, {} incorrect bases".format(*results))
+
+    return 0
+
+if __name__ == "__main__":
+    main()
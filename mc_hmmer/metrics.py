@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# Per-iteration metrics for the MCMC loop: wall time per phase (including
+# Baum-Welch refinement, if any), rolling acceptance rate per move type,
+# model size, likelihood cache use and peak memory. Every iteration is
+# appended to a JSONL file, and a snapshot in the Prometheus text format is
+# rewritten every so often for a node exporter's textfile collector to pick
+# up.
+
+import collections
+import json
+import os
+import sys
+import time
+
+PHASES = ["proposal", "likelihood", "acceptance", "em"]
+
+def peak_memory():
+    """Peak resident memory of this process in bytes"""
+    # resource is Unix-only, so it is imported here rather than for every
+    # user of this module
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class Metrics:
+    """Collects the metrics of each iteration
+
+    Call start() at the top of an iteration, lap(phase) at the end of each
+    phase and record() once the iteration is done. jsonl and prometheus are
+    paths (None to skip either), and the snapshot is rewritten every
+    snapshot_every iterations. Acceptance rates are over the last window
+    proposals of each move. With neither path every call returns at once.
+    """
+    def __init__(self, jsonl=None, prometheus=None, snapshot_every=100,
+                 window=100, resume=False):
+        self.jsonl = open(jsonl, "a" if resume else "w") if jsonl else None
+        self.prometheus = prometheus
+        self.snapshot_every = snapshot_every
+        self.window = window
+        self.iterations = 0
+        self.phase_totals = dict.fromkeys(PHASES, 0.0)
+        self.proposed = collections.Counter()
+        self.accepted = collections.Counter()
+        self.recent = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self.last = None
+        self.times = {}
+        self.state = {}
+        self.enabled = self.jsonl is not None or bool(prometheus)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.times = {}
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """Charge the time since the last lap (or start) to phase"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def acceptance_rate(self, move):
+        recent = self.recent[move]
+        return sum(recent) / float(len(recent)) if recent else None
+
+    def record(self, iteration, move, accepted, loglik, states, cache=None):
+        """Finish an iteration; cache is the LikelihoodCache, if any"""
+        if not self.enabled:
+            return
+        self.iterations += 1
+        for phase, seconds in self.times.items():
+            self.phase_totals[phase] = self.phase_totals.get(phase, 0.0) + \
+                seconds
+        self.proposed[move] += 1
+        self.accepted[move] += bool(accepted)
+        self.recent[move].append(bool(accepted))
+
+        self.state = {"iteration": iteration, "move": move,
+                      "accepted": bool(accepted), "loglik": loglik,
+                      "states": states,
+                      "seconds": {phase: self.times.get(phase, 0.0)
+                                  for phase in self.phase_totals},
+                      "acceptance": {m: self.acceptance_rate(m)
+                                     for m in sorted(self.recent)},
+                      "peak_memory": peak_memory()}
+        if cache is not None:
+            self.state["cache"] = {"hits": cache.hits, "misses": cache.misses,
+                                   "identical": cache.identical,
+                                   "size": len(cache)}
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(self.state) + "\n")
+        if self.prometheus and self.iterations % self.snapshot_every == 0:
+            self.write_prometheus()
+
+    def prometheus_text(self):
+        """The current metrics in the Prometheus text exposition format"""
+        lines = []
+        def metric(name, kind, description, samples):
+            lines.append("# HELP mchmm_{} {}".format(name, description))
+            lines.append("# TYPE mchmm_{} {}".format(name, kind))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+                lines.append("mchmm_{}{} {}".format(name,
+                             "{" + label + "}" if label else "", value))
+
+        metric("iterations_total", "counter", "MCMC iterations run",
+               [((), self.iterations)])
+        metric("phase_seconds_total", "counter",
+               "Wall time spent in each phase of an iteration",
+               [((("phase", p),), s) for p, s in
+                sorted(self.phase_totals.items())])
+        metric("proposals_total", "counter", "Proposals of each move",
+               [((("move", m),), n) for m, n in sorted(self.proposed.items())])
+        metric("accepted_total", "counter", "Accepted proposals of each move",
+               [((("move", m),), n) for m, n in sorted(self.accepted.items())])
+        metric("acceptance_rate", "gauge", "Acceptance rate of each move over "
+               "its last {} proposals".format(self.window),
+               [((("move", m),), self.acceptance_rate(m))
+                for m in sorted(self.recent)])
+        if self.state:
+            metric("states", "gauge", "States in the current model",
+                   [((), self.state["states"])])
+            metric("loglik", "gauge", "Log likelihood of the current model",
+                   [((), self.state["loglik"])])
+            for key in ["hits", "misses", "identical"]:
+                if "cache" in self.state:
+                    metric("cache_{}_total".format(key), "counter",
+                           "Likelihood cache {}".format(key),
+                           [((), self.state["cache"][key])])
+        metric("peak_memory_bytes", "gauge", "Peak resident memory",
+               [((), peak_memory())])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        # written to a temporary file and renamed, so that the collector
+        # never reads half a snapshot
+        tmp = self.prometheus + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, self.prometheus)
+
+    def close(self):
+        if self.prometheus:
+            self.write_prometheus()
+        if self.jsonl is not None:
+            self.jsonl.close()
+
+class Profiler:
+    """cProfile over iterations first <= i < last, saved to path when the
+    window ends; outside the window it costs one comparison per iteration"""
+    def __init__(self, first, last, path):
+        import cProfile
+        self.first = first
+        self.last = last
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def iteration(self, i):
+        """Call at the top of every iteration"""
+        if self.first <= i < self.last:
+            if not self.running:
+                self.profile.enable()
+                self.running = True
+        elif self.running:
+            self.stop()
+
+    def stop(self):
+        if self.running:
+            self.profile.disable()
+            self.running = False
+            self.profile.dump_stats(self.path)
+            print("Wrote profile of iterations {} to {} to {}".format(
+                  self.first, self.last - 1, self.path))
+
+def parse_window(text):
+    """"first:last" as the pair of ints (first, last)"""
+    first, last = text.split(":")
+    return (int(first), int(last))
+
+if __name__ == "__main__":
+    # summarize a metrics file: mean seconds per phase and the final
+    # acceptance rates
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m mc_hmmer.metrics metrics.jsonl")
+    totals = collections.Counter()
+    n = 0
+    last = None
+    with open(sys.argv[1]) as f:
+        for line in f:
+            last = json.loads(line)
+            totals.update(last["seconds"])
+            n += 1
+    for phase, seconds in sorted(totals.items()):
+        print("{}\t{:.6f}s per iteration".format(phase, seconds / n))
+    if last is not None:
+        for move, rate in sorted(last["acceptance"].items()):
+            print("{}\t{}".format(move, rate))
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+import random
+import math
+import sys
+import numpy as np
+
+def check_model(m):
+    """Make sure a model is coherent"""
+    assert(all([math.fsum(row) - 1 < 1e-10 for row in m.a]))
+    for j in range(len(m.e[0])):
+        assert(math.fsum([m.e[i][j] for i in range(len(m.e))]) - 1 < 1e-10)
+    assert(len(m.a) == len(m.labels)+1)
+    assert(all([len(x) == len(m.labels) for x in m.a]))
+    assert(len(m.e) == 20)
+    assert(all([len(x) == len(m.labels) for x in m.e]))
+
+def divsum(v):
+    """Divide a vector by its sum"""
+    sum = math.fsum(v)
+    return [x/sum for x in v]
+
+def is_strongly_connected(a):
+    """Check if an adjacency matrix represents a strongly connected digraph"""
+    adjacency = np.asarray(a) != 0
+    n = len(adjacency)
+
+    # grow the set of nodes reachable from node 0, first along the edges and
+    # then along the reversed edges
+    for adj in (adjacency, adjacency.T):
+        found = np.zeros(n, dtype=bool)
+        found[0] = True
+        frontier = found
+        while frontier.any():
+            frontier = adj[frontier].any(axis=0) & ~found
+            found = found | frontier
+        if not found.all():
+            return False
+    return True
+
+def split(m):
+    """Split one node in m into two nodes, preserving edges"""
+
+    nnodes = len(m.labels)
+
+    # choose a node to split
+    node = random.randint(0, nnodes-1)
+
+    # split edges into the new node
+    a = np.empty((nnodes+2, nnodes+1))
+    a[0] = 1.0/(nnodes+1)
+    a[1:nnodes+1, :nnodes] = m.a[1:]
+    a[1:nnodes+1, node] /= 2
+    a[1:nnodes+1, nnodes] = a[1:nnodes+1, node]
+
+    # add edges out of the new node
+    a[nnodes+1] = a[node+1]
+
+    # give the new node the same emission probabilities
+    e = np.empty((len(m.e), nnodes+1))
+    e[:, :nnodes] = m.e
+    e[:, nnodes] = m.e[:, node]
+
+    # make sure everything worked ok
+    #check_model(m)
+
+    return m.replace(a=a, e=e, labels=m.labels + (m.labels[node],))
+
+def join(m):
+    """Join two nodes in m into one"""
+
+    # if there are no nodes to join, just propose the same model
+    if len(m.labels) == 3:
+        return m
+    
+    nnodes = len(m.labels)
+
+    # choose nodes to join
+    node1_choices = [i for i in range(nnodes) if m.labels.count(m.labels[i]) > 1]
+    node1 = random.choice(node1_choices)
+    node2_choices = [i for i in range(nnodes) if m.labels[i] == m.labels[node1] and i != node1]
+    node2 = random.choice(node2_choices)
+    if (node1 > node2):
+        node1, node2 = node2, node1
+
+    # combine edges going into and out of each node
+    a = np.array(m.a[1:])
+    a[:, node1] += a[:, node2]
+    others = [i for i in range(nnodes) if i not in [node1, node2]]
+    a[node1, others] = (a[node2, others] + a[node1, others])/2
+    a[node1, node1] = (a[node1, node1] + a[node2, node1])/2
+    a = np.delete(np.delete(a, node2, axis=0), node2, axis=1)
+    a = np.vstack([np.full(nnodes-1, 1.0/(nnodes-1)), a])
+
+    # average emission probabilities
+    e = np.array(m.e)
+    e[:, node1] = (e[:, node1] + e[:, node2])/2
+    e = np.delete(e, node2, axis=1)
+
+    # remove the extra label
+    labels = list(m.labels)
+    labels.pop(node2)
+
+    # make sure everything worked ok
+    #check_model(m)
+
+    return m.replace(a=a, e=e, labels=labels)
+
+def set_transition(m, i, j, p):
+    """Copy of m.a with a[i][j] set to p and row i renormalized, or None if
+    row i would be all zeros"""
+    row = np.array(m.a[i])
+    row[j] = p
+    rowsum = math.fsum(row)
+    if rowsum == 0:
+        return None
+    a = np.array(m.a)
+    a[i] = row / rowsum
+    return a
+
+def add_edge(m):
+    """Add an adjacency in m"""
+
+    # find non-existant edges
+    nnodes = len(m.labels)
+    choices = [tuple(x) for x in np.argwhere(m.a[:nnodes] == 0).tolist()]
+
+    # if there are no non-existant edges, propose the same model
+    if (len(choices) == 0):
+        return m
+
+    # choose the edge to add, and its transition probability
+    new_i, new_j = random.choice(choices)
+    p = random.random()
+
+    # update the transition matrix; adding an edge can't disconnect the graph
+    a = set_transition(m, new_i, new_j, p)
+
+    # make sure it worked
+    #check_model(m)
+
+    return m.replace(a=a, connected=True if m._connected else None)
+
+def delete_edge(m):
+    """Remove an adjacency in m"""
+
+    # find all the edges
+    choices = [(i-1, j) for i, j in m.edges if i > 0]
+
+    # choose an edge to remove
+    del_i, del_j = random.choice(choices)
+
+    # update the transition matrix
+    a = set_transition(m, del_i+1, del_j, 0)
+    if a is None: # we deleted the only edge out of a state
+        return (m)
+    m2 = m.replace(a=a)
+
+    # if the model isn't strongly connected anymore, re-propose the old model
+    if not m2.connected:
+        return (m)
+
+    # make sure it went ok
+    #check_model(m2)
+
+    return m2
+
+def edit_transition(m):
+    """Alter a transition probability in m"""
+
+    # find all the edges
+    nnodes = len(m.labels)
+    choices = [(i, j) for i, j in m.edges if i < nnodes]
+
+    # choose an edge to edit and its new probability
+    i, j = random.choice(choices)
+    p = random.random()
+
+    # update the transition matrix, which keeps the same edges
+    a = set_transition(m, i, j, p)
+
+    # make sure it went ok
+    #check_model(m2)
+
+    return m.replace(a=a, same_edges=p != 0)
+
+def perturb_transition(m, sigma):
+    """Alter a transition probability in m by a normal step of scale sigma
+    around its current value, reflected back into [0, 1] so that the step
+    is symmetric"""
+
+    # find all the edges
+    nnodes = len(m.labels)
+    choices = [(i, j) for i, j in m.edges if i < nnodes]
+
+    # choose an edge to edit and move its probability
+    i, j = random.choice(choices)
+    p = (m.a[i][j] + random.gauss(0, sigma)) % 2
+    if p > 1:
+        p = 2 - p
+
+    # update the transition matrix, which keeps the same edges
+    a = set_transition(m, i, j, p)
+
+    return m.replace(a=a, same_edges=p != 0)
+
+MOVES = [join, split, add_edge, delete_edge, edit_transition]
+MOVE_NAMES = ["number.of.state.decrease", "number.of.state.increase",
+              "add.edge", "remove.edge", "transition.prob.change"]
+
+# moves that undo each other, which must be proposed equally often for the
+# chain to keep its target without a Hastings correction
+MOVE_PAIRS = [(0, 1), (2, 3), (4,)]
+
+def mcmc_move(m):
+    """Perform a random MCMC move on m, and return a new model"""
+    r = random.random()
+    for i, move in enumerate(MOVES, start=1):
+        if r < i/len(MOVES):
+            return MOVE_NAMES[i-1], move(m)
+
+class MoveMixture:
+    """Chooses the moves of a chain and keeps statistics on each of them
+
+    The fixed mixture is mcmc_move. The adaptive one tunes itself during
+    burn-in: every adapt_every proposals each pair of inverse moves in
+    MOVE_PAIRS gets a weight in proportion to how often its moves moved the
+    chain per second spent on them (never below floor, so every move stays
+    possible), shared equally between the two, and edit_transition's fresh
+    uniform draw is replaced by a reflected normal step around the current
+    probability, its scale sigma tuned by Robbins-Monro
+    towards an acceptance rate of target. freeze() ends the tuning, after
+    which the proposal is fixed and the chain a plain Metropolis chain
+    again; it also restarts the statistics, so that the report covers the
+    frozen chain alone. Since the weights depend on measured times, two
+    adaptive runs from the same seed can differ, though a run resumed from
+    a checkpoint continues exactly.
+    """
+    def __init__(self, adaptive=False, adapt_every=50, floor=0.05,
+                 target=0.44, sigma=0.1):
+        self.adaptive = adaptive
+        self.adapt_every = adapt_every
+        self.floor = floor
+        self.target = target
+        self.sigma = sigma
+        self.weights = np.full(len(MOVES), 1.0 / len(MOVES))
+        self.frozen = not adaptive
+        self.tuned = 0
+        self.reset()
+
+    def reset(self):
+        self.proposed = np.zeros(len(MOVES), dtype=int)
+        self.moved = np.zeros(len(MOVES), dtype=int)
+        self.seconds = np.zeros(len(MOVES))
+        self.jumps = np.zeros(len(MOVES))
+
+    def propose(self, m):
+        """(move name, proposed model)"""
+        if not self.adaptive:
+            return mcmc_move(m)
+        r = random.random()
+        k = min(int(np.searchsorted(np.cumsum(self.weights), r,
+                                    side="right")), len(MOVES) - 1)
+        if MOVES[k] is edit_transition:
+            return MOVE_NAMES[k], perturb_transition(m, self.sigma)
+        return MOVE_NAMES[k], MOVES[k](m)
+
+    def record(self, move, moved, seconds, jump=0.0):
+        """Note the outcome of a proposal: whether the chain moved to a new
+        model, the seconds it took to propose and score it, and the squared
+        change in log likelihood"""
+        k = MOVE_NAMES.index(move)
+        self.proposed[k] += 1
+        self.moved[k] += bool(moved)
+        self.seconds[k] += seconds
+        self.jumps[k] += jump
+        if self.frozen:
+            return
+        if MOVES[k] is edit_transition:
+            self.tuned += 1
+            self.sigma *= math.exp((bool(moved) - self.target) /
+                                   math.sqrt(self.tuned))
+        if self.proposed.sum() % self.adapt_every == 0:
+            self.adapt()
+
+    def adapt(self):
+        # smoothed rates of each pair of inverse moves, and the mean cost of
+        # the moves tried so far for pairs that haven't been
+        proposed = np.array([self.proposed[list(p)].sum() for p in MOVE_PAIRS])
+        moved = np.array([self.moved[list(p)].sum() for p in MOVE_PAIRS])
+        seconds = np.array([self.seconds[list(p)].sum() for p in MOVE_PAIRS])
+        rate = (moved + 1.0) / (proposed + 2.0)
+        tried = proposed > 0
+        cost = np.full(len(MOVE_PAIRS), seconds[tried].sum() /
+                       proposed[tried].sum() if tried.any() else 1.0)
+        cost[tried] = seconds[tried] / proposed[tried]
+        score = rate / np.maximum(cost, 1e-9)
+        share = score / score.sum()
+        for k, pair in enumerate(MOVE_PAIRS):
+            self.weights[list(pair)] = self.floor + \
+                (1 - len(MOVES) * self.floor) * share[k] / len(pair)
+
+    def freeze(self):
+        self.frozen = True
+        self.reset()
+
+    def summary(self, ess, seconds):
+        """Per-move statistics of the frozen chain; ess is the effective
+        sample size of its log likelihood trace and seconds its run time,
+        and each move is credited with the share of ess that its squared
+        jumps make up"""
+        lines = ["move\tweight\tproposed\tmoved\tms/proposal\tESS/s"]
+        share = self.jumps / self.jumps.sum() if self.jumps.sum() > 0 else \
+            np.zeros(len(MOVES))
+        for k, name in enumerate(MOVE_NAMES):
+            lines.append("{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\t{:.4f}".format(
+                name, self.weights[k], self.proposed[k],
+                self.moved[k] / max(self.proposed[k], 1),
+                1000 * self.seconds[k] / max(self.proposed[k], 1),
+                ess * share[k] / self.seconds[k] if self.seconds[k] else 0))
+        lines.append("{} mixture: ESS {:.1f} in {:.1f}s, {:.4f} per second"
+                     .format("adaptive" if self.adaptive else "fixed", ess,
+                             seconds, ess / seconds if seconds else 0) +
+                     (", sigma {:.3f}".format(self.sigma)
+                      if self.adaptive else ""))
+        return "\n".join(lines)
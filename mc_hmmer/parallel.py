@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import heapq
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from .viterbi import encode, PackedSequences, batchForward
+
+def shard_by_length(lengths, n_shards):
+    """Split sequence indices into n_shards groups with balanced total length
+
+    Sequences are assigned longest first to the currently lightest shard, so
+    the result only depends on the lengths and the long proteins are spread
+    out instead of piling up on one worker.
+    """
+    shards = [[] for i in range(n_shards)]
+    heap = [(0, k) for k in range(n_shards)]
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    for i in order:
+        load, k = heapq.heappop(heap)
+        shards[k].append(i)
+        heapq.heappush(heap, (load + lengths[i], k))
+    return [sorted(shard) for shard in shards]
+
+# structure code of a sequence without a secstr annotation
+NO_STRUCTURE = 255
+
+def likelihood_worker(conn, shm_name, size, offsets, lengths):
+    """Worker loop: pack this shard once, then score each model (or list of
+    models) it is sent, or compute its expected counts for baumwelch"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    codes = None
+    structure = None
+    try:
+        codes = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        structure = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf,
+                               offset=size)
+        raw = [codes[o:o+n] for o, n in zip(offsets, lengths)]
+        seqs = PackedSequences(raw)
+        structures = [None if n == 0 or structure[o] == NO_STRUCTURE
+                      else structure[o:o+n] for o, n in zip(offsets, lengths)]
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            if message[0] == "counts":
+                from .baumwelch import expected_counts
+                kind, e, a, labels, labeled = message
+                conn.send(expected_counts(e, a, labels, raw,
+                                          structures if labeled else None))
+            elif message[0] == "logliks":
+                conn.send(np.array([batchForward(e, a, seqs)[0]
+                                    for e, a in message[1]]))
+            else:
+                kind, e, a = message
+                conn.send(batchForward(e, a, seqs)[0])
+    finally:
+        del codes, structure
+        shm.close()
+        conn.close()
+
+class ParallelLikelihood:
+    """Log likelihoods over a fixed set of sequences on a pool of processes
+
+    The encoded sequences live in one shared memory block. Each worker packs
+    its length-balanced shard of them once at startup; after that only the
+    model matrices are sent per evaluation and the per-sequence log
+    probabilities come back, to be summed in a fixed order. The block also
+    holds the label codes in structures (see baumwelch.structure_codes), if
+    given, for the labeled Baum-Welch E-step.
+    """
+    def __init__(self, seqs, processes=None, structures=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        codes = [encode(s) for s in seqs]
+        lengths = [len(c) for c in codes]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).tolist()
+
+        self.count = len(codes)
+        self.residues = offsets[-1]
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=max(2 * self.residues, 1))
+        flat = np.ndarray((2 * self.residues,), dtype=np.uint8,
+                          buffer=self.shm.buf)
+        for c, o in zip(codes, offsets):
+            flat[o:o+len(c)] = c
+        flat[self.residues:] = NO_STRUCTURE
+        if structures is not None:
+            for s, o in zip(structures, offsets):
+                if s is not None:
+                    flat[self.residues+o:self.residues+o+len(s)] = s
+        del flat
+
+        self.shards = [s for s in shard_by_length(lengths, processes) if s]
+        self.conns = []
+        self.workers = []
+        for shard in self.shards:
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=likelihood_worker, daemon=True,
+                args=(child, self.shm.name, self.residues,
+                      [offsets[i] for i in shard], [lengths[i] for i in shard]))
+            worker.start()
+            child.close()
+            self.conns.append(parent)
+            self.workers.append(worker)
+
+    def __len__(self):
+        return self.count
+
+    def sequence_log_likelihoods(self, m):
+        """Per-sequence log likelihoods of m, in input order"""
+        message = ("loglik", np.asarray(m.e, dtype=float),
+                   np.asarray(m.a, dtype=float))
+        for conn in self.conns:
+            conn.send(message)
+        logprob = np.zeros(self.count)
+        for shard, conn in zip(self.shards, self.conns):
+            logprob[shard] = conn.recv()
+        return logprob
+
+    def log_likelihood(self, m):
+        """Total log likelihood of m"""
+        return float(self.sequence_log_likelihoods(m).sum())
+
+    def log_likelihoods(self, models):
+        """Total log likelihoods of several models, in one round trip to
+        the workers; each total is the same as log_likelihood's"""
+        message = ("logliks", [(np.asarray(m.e, dtype=float),
+                                np.asarray(m.a, dtype=float)) for m in models])
+        for conn in self.conns:
+            conn.send(message)
+        logprob = np.zeros((len(models), self.count))
+        for shard, conn in zip(self.shards, self.conns):
+            logprob[:, shard] = conn.recv()
+        return [float(row.sum()) for row in logprob]
+
+    def expected_counts(self, m, labeled=False):
+        """Baum-Welch expected counts of m over every sequence (a
+        baumwelch.Counts), summed over the shards in a fixed order"""
+        from .baumwelch import Counts
+        message = ("counts", np.asarray(m.e, dtype=float),
+                   np.asarray(m.a, dtype=float), list(m.labels), labeled)
+        for conn in self.conns:
+            conn.send(message)
+        counts = Counts(len(m.labels))
+        for conn in self.conns:
+            counts += conn.recv()
+        return counts
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join()
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+        self.workers = []
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def test_parallel(processes=4, copies=20):
+    """Compare ParallelLikelihood against the serial path on train.fasta"""
+    import time
+    from . import data
+    from .mcmc import Model
+    seqs, states = data.load_train_data()
+    e = data.harvest_e(seqs, states)
+    a = [[1.0/3, 1.0/3, 1.0/3],
+         [0.9, 0, 0.1],
+         [0, 0.89, 0.11],
+         [0.1, 0.11, 0.79]]
+    m = Model(a, e, ["A", "B", "O"])
+
+    # repeat the training set so there is enough work to split
+    seqs = seqs * copies
+    packed = PackedSequences(seqs)
+    start = time.time()
+    serial = batchForward(e, a, packed)[1]
+    serial_time = time.time() - start
+
+    with ParallelLikelihood(seqs, processes) as pool:
+        totals = [pool.log_likelihood(m)]
+        start = time.time()
+        for i in range(10):
+            totals.append(pool.log_likelihood(m))
+        parallel_time = (time.time() - start) / 10
+
+    assert len(set(totals)) == 1
+    assert abs(totals[0] - serial) <= 1e-9 * abs(serial)
+    print("{} sequences, {} processes: serial {:.4f}s, parallel {:.4f}s, "
+          "|difference| {:.2e}".format(len(seqs), processes, serial_time,
+          parallel_time, abs(totals[0] - serial)))
+
+if __name__ == "__main__":
+    test_parallel()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# Predict secondary structure for every protein in a FASTA file (sequence
+# only or sequence/secstr pairs), using either a sampled ensemble from
+# mcmc.py or the model from the BMC paper. Proteins are decoded on a pool of
+# worker processes and written in input order, one "id<TAB>prediction" line
+# each; at most --window proteins are in flight at once, so memory does not
+# grow with the size of the input.
+
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+class Predictor:
+    """Decodes one sequence into a string of A, B and O"""
+    def __init__(self, models=None, paper=None, method="vote"):
+        from . import archive
+        from .ensemble import Ensemble
+        if paper is not None:
+            from . import mcmc
+            e, a, labels = mcmc.load_paper_model(paper)
+            self.ensemble = Ensemble([mcmc.Model(a, e, labels)])
+        elif archive.is_archive(models):
+            # an archive doesn't need mcmc.py and everything it imports
+            self.ensemble = Ensemble(archive.load_models(models))
+        else:
+            from . import mcmc
+            self.ensemble = Ensemble(mcmc.load_models(models))
+        self.method = method
+
+    def predict(self, seq):
+        return self.ensemble.predict(seq, self.method)
+
+# the predictor of each worker process, set up once by init_worker
+predictor = None
+
+def init_worker(models, paper, method):
+    global predictor
+    predictor = Predictor(models, paper, method)
+
+def predict_record(record):
+    """(id, prediction) for a (id, sequence) pair; the prediction is None if
+    the sequence can't be decoded"""
+    protein, seq = record
+    try:
+        return (protein, predictor.predict(seq))
+    except (KeyError, ValueError):
+        return (protein, None)
+
+def completed(path):
+    """IDs already written to an output file, dropping a partial last line"""
+    ids = []
+    if not os.path.exists(path):
+        return ids
+    with open(path, "rb+") as f:
+        good = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            ids.append(line.split(b"\t", 1)[0].decode("utf-8"))
+            good += len(line)
+        f.truncate(good)
+    return ids
+
+def predict_stream(records, out, predictor_args, processes, window, log_every):
+    """Decode (id, sequence) pairs on a pool, writing them to out in order
+    with at most window of them in flight; returns how many were written
+    and how many failed"""
+    written = 0
+    failed = 0
+    start = time.time()
+    pool = multiprocessing.Pool(processes, init_worker, predictor_args)
+    try:
+        pending = collections.deque()
+        records = iter(records)
+        while True:
+            # keep the window full, then wait for the oldest protein
+            for record in records:
+                pending.append(pool.apply_async(predict_record, (record,)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            protein, prediction = pending.popleft().get()
+            if prediction is None:
+                failed += 1
+                sys.stderr.write("Skipping {}: unknown residues\n".format(
+                                 protein))
+                prediction = ""
+            out.write("{}\t{}\n".format(protein, prediction))
+            out.flush()
+            written += 1
+            if log_every and written % log_every == 0:
+                sys.stderr.write("{} proteins, {:.1f} per second\n".format(
+                                 written, written / (time.time() - start)))
+    finally:
+        pool.terminate()
+        pool.join()
+    return (written, failed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict secondary "
+                                     "structure for the proteins in a FASTA file")
+    parser.add_argument("fasta", help="FASTA of sequences, or a store built "
+                        "by store.py")
+    parser.add_argument("-o", "--output", default="-",
+                        help="where to write predictions (default stdout)")
+    parser.add_argument("-m", "--models", default="models.pkl",
+                        help="sampled models from mcmc.py, or an archive of "
+                        "them made by archive.py")
+    parser.add_argument("--paper", metavar="DIR",
+                        help="use the BMC paper model in DIR instead")
+    parser.add_argument("--combine", choices=["vote", "posterior"],
+                        default="vote", help="how to combine the models: "
+                        "majority vote of their paths, or the most probable "
+                        "label under their averaged posteriors")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--window", type=int, default=0,
+                        help="proteins in flight (default 4 per process)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip proteins already in the output file")
+    parser.add_argument("--log-every", type=int, default=1000,
+                        help="report progress every this many proteins")
+    args = parser.parse_args(argv)
+
+    from . import data
+    if data.open_store(args.fasta) is not None:
+        ids, seqs, states = data.load_records(args.fasta)
+        records = zip(ids, seqs)
+    else:
+        records = ((protein, seq) for protein, seq, secstr in
+                   data.read_fasta(args.fasta))
+
+    if args.resume:
+        if args.output == "-":
+            parser.error("--resume needs an output file")
+        done = completed(args.output)
+        records = iter(records)
+        for protein in done:
+            skipped = next(records, (None,))[0]
+            if skipped != protein:
+                parser.error("{} does not match the input at {}".format(
+                             args.output, protein))
+        sys.stderr.write("Resuming after {} proteins\n".format(len(done)))
+
+    if args.output == "-":
+        out = sys.stdout
+    else:
+        out = open(args.output, "a" if args.resume else "w")
+
+    start = time.time()
+    try:
+        written, failed = predict_stream(records, out,
+            (args.models, args.paper, args.combine), args.processes,
+            args.window or 4 * args.processes, args.log_every)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.time() - start
+    sys.stderr.write("Predicted {} proteins ({} skipped) in {:.1f}s, "
+                     "{:.2f} per second\n".format(written, failed, elapsed,
+                     written / elapsed if elapsed > 0 else 0))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+# A long-lived prediction server. The ensemble is loaded once, requests are
+# accepted concurrently over HTTP (on a TCP port or a Unix socket) and
+# queued, and a batcher hands them to the decoder in micro-batches of up to
+# --batch-size requests, waiting at most --max-wait milliseconds for a batch
+# to fill. Batches are decoded in a thread of this process, or on a pool of
+# --workers processes so that several batches run at once.
+#
+# POST /predict  {"sequence": "MKV...", "id": "...", "posteriors": false}
+#   returns {"id": ..., "labels": "OOAAB...", and if posteriors was true
+#   "alphabet": ["A", "B", "O"] and "posteriors": one row per residue}
+# GET /stats     request counts, latency percentiles, throughput and batch
+#   sizes since the server started
+#
+# client.py is the matching client and load test.
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import signal
+import sys
+import time
+import numpy as np
+
+from .predict import Predictor
+
+MAX_BODY = 1 << 24
+
+# the predictor of this process (or of each worker process)
+predictor = None
+
+def init_worker(models, paper, method):
+    global predictor
+    predictor = Predictor(models, paper, method)
+
+def decode_batch(jobs):
+    """Results of a list of (sequence, posteriors) jobs: the labels and, if
+    asked for, the posterior probability of each label at each residue, or
+    an error message for a sequence that can't be decoded"""
+    results = []
+    for seq, posteriors in jobs:
+        try:
+            result = {"labels": predictor.predict(seq)}
+            if posteriors:
+                P = predictor.ensemble.label_posteriors(seq)
+                result["alphabet"] = predictor.ensemble.alphabet
+                result["posteriors"] = np.round(P, 6).tolist()
+        except (KeyError, ValueError) as error:
+            result = {"error": "cannot decode residue {}".format(error)}
+        results.append(result)
+    return results
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+class Stats:
+    """Counters and recent latencies of the requests served"""
+    def __init__(self, window=10000):
+        self.start = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.residues = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.waits = collections.deque(maxlen=window)
+
+    def batch(self, size):
+        self.batches += 1
+        self.batched += size
+
+    def request(self, residues, latency, wait, error=False):
+        self.requests += 1
+        self.errors += error
+        self.residues += residues
+        self.latencies.append(latency)
+        self.waits.append(wait)
+
+    def summary(self, queued=0):
+        uptime = time.time() - self.start
+        latencies = list(self.latencies)
+        waits = list(self.waits)
+        return {"uptime": uptime, "requests": self.requests,
+                "errors": self.errors, "residues": self.residues,
+                "queued": queued,
+                "requests_per_second": self.requests / uptime,
+                "residues_per_second": self.residues / uptime,
+                "batches": self.batches,
+                "mean_batch_size": (self.batched / self.batches
+                                    if self.batches else None),
+                "latency_ms": {"p50": percentile(latencies, 50),
+                               "p95": percentile(latencies, 95),
+                               "p99": percentile(latencies, 99),
+                               "max": max(latencies) if latencies else None},
+                "queue_wait_ms": {"p50": percentile(waits, 50),
+                                  "p95": percentile(waits, 95)}}
+
+class Batcher:
+    """Collects queued requests into batches and decodes them
+
+    A batch is started by the first request to arrive and closed once it
+    has batch_size requests or max_wait seconds have passed; at most
+    concurrency batches are being decoded at once.
+    """
+    def __init__(self, executor, batch_size, max_wait, concurrency, stats):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.stats = stats
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+
+    async def submit(self, seq, posteriors):
+        """Queue one sequence and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((seq, posteriors, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            task = asyncio.ensure_future(self.decode(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def decode(self, batch):
+        try:
+            started = time.perf_counter()
+            self.stats.batch(len(batch))
+            jobs = [(seq, posteriors) for seq, posteriors, future, t in batch]
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, decode_batch, jobs)
+            except Exception as error:
+                for seq, posteriors, future, t in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            for (seq, posteriors, future, arrived), result in zip(batch,
+                                                                  results):
+                if not future.done():
+                    future.set_result((result, started - arrived))
+        finally:
+            self.slots.release()
+
+class BadRequest(Exception):
+    pass
+
+async def read_request(reader):
+    """(method, path, headers, body) of the next HTTP request on reader, or
+    None once the client has closed the connection"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, version = line.decode("latin-1").split()
+    except ValueError:
+        raise BadRequest("malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest("malformed Content-Length")
+    if length > MAX_BODY:
+        raise BadRequest("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return (method, path, headers, body)
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 422: "Unprocessable Entity",
+           500: "Internal Server Error"}
+
+def write_response(writer, status, content, keep_alive=True):
+    body = json.dumps(content).encode("utf-8")
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                 "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                 status, REASONS[status], len(body),
+                 "keep-alive" if keep_alive else "close").encode("latin-1"))
+    writer.write(body)
+
+class Server:
+    """Answers /predict and /stats requests over HTTP/1.1 with keep-alive"""
+    def __init__(self, batcher, stats):
+        self.batcher = batcher
+        self.stats = stats
+
+    async def predict(self, body):
+        start = time.perf_counter()
+        try:
+            request = json.loads(body)
+            seq = request["sequence"]
+            if not isinstance(seq, str):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return (400, {"error": "expected a JSON object with a "
+                                   "\"sequence\" string"})
+        result, wait = await self.batcher.submit(
+            seq.strip().upper(), bool(request.get("posteriors", False)))
+        if "id" in request:
+            result = dict(result, id=request["id"])
+        error = "error" in result
+        self.stats.request(len(seq), 1000 * (time.perf_counter() - start),
+                           1000 * wait, error)
+        return (422 if error else 200, result)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as error:
+                    write_response(writer, 400, {"error": str(error)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if path == "/predict":
+                    if method != "POST":
+                        status, content = (405, {"error": "use POST"})
+                    else:
+                        status, content = await self.predict(body)
+                elif path == "/stats":
+                    status, content = (200, self.stats.summary(
+                        self.batcher.queue.qsize()))
+                else:
+                    status, content = (404, {"error": "no such path"})
+                write_response(writer, status, content, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as error:
+            write_response(writer, 500, {"error": str(error)}, False)
+        finally:
+            writer.close()
+
+async def serve(args):
+    predictor_args = (args.models, args.paper, args.combine)
+    if args.workers:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            args.workers, initializer=init_worker, initargs=predictor_args)
+        # load the models in every worker before taking requests
+        list(executor.map(decode_batch, [[]] * args.workers))
+    else:
+        init_worker(*predictor_args)
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    stats = Stats()
+    batcher = Batcher(executor, args.batch_size, args.max_wait / 1000.0,
+                      max(args.workers, 1), stats)
+    server = Server(batcher, stats)
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        listener = await asyncio.start_unix_server(server.handle, args.unix)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle, args.host,
+                                              args.port)
+        where = "http://{}:{}".format(args.host, args.port)
+    sys.stderr.write("Serving on {} with batches of up to {}, decoded {}\n"
+                     .format(where, args.batch_size,
+                             "on {} processes".format(args.workers)
+                             if args.workers else "in a thread"))
+    batching = asyncio.ensure_future(batcher.run())
+    # stop cleanly on SIGTERM as on ^C, removing the socket file
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        batching.cancel()
+        executor.shutdown(cancel_futures=True)
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve secondary structure "
+                                     "predictions over HTTP")
+    parser.add_argument("-m", "--models", default="models.pkl",
+                        help="sampled models from mcmc.py, or an archive of "
+                        "them made by archive.py")
+    parser.add_argument("--paper", metavar="DIR",
+                        help="serve the BMC paper model in DIR instead")
+    parser.add_argument("--combine", choices=["vote", "posterior"],
+                        default="vote", help="how to combine the models")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8642)
+    parser.add_argument("--unix", metavar="PATH",
+                        help="listen on a Unix socket instead of a port")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="most requests decoded in one batch")
+    parser.add_argument("--max-wait", type=float, default=5.0,
+                        help="milliseconds to wait for a batch to fill")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="decoder processes (default: one thread of "
+                        "the server process)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
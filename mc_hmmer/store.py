@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Binary store of encoded proteins, built once from a FASTA file of
+# sequence/secstr pairs and memory-mapped by the loaders in data.py.
+#
+# usage: python -m mc_hmmer.store in.fasta [out.store]
+#
+# Layout, all little-endian: a HEADER_SIZE-byte header (magic, version,
+# number of proteins n, number of residues, bytes of protein IDs), then
+# int64 offsets[n+1] into the residue arrays, int64 id_offsets[n+1] into the
+# IDs, uint8 residue codes (viterbi.chars), uint8 structure codes (A, B, O =
+# 0, 1, 2, NO_STRUCTURE where the FASTA had no secstr) and the UTF-8 IDs.
+
+import os
+import struct
+import sys
+import numpy as np
+
+MAGIC = b"MCHMMSEQ"
+VERSION = 1
+HEADER = struct.Struct("<8sIQQQ")
+HEADER_SIZE = 64
+NO_STRUCTURE = 255
+LABELS = np.frombuffer(b"ABO", dtype=np.uint8)
+
+def is_store(path):
+    """Whether path is a sequence store"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+def store_path(fasta):
+    """Where the store for a FASTA file goes by default"""
+    return os.path.splitext(fasta)[0] + ".store"
+
+def build_store(fasta, path=None):
+    """Encode every protein in a FASTA file into a store at path"""
+    from .data import read_fasta, simplify_struct, struct2int
+    from .viterbi import encode
+    if path is None:
+        path = store_path(fasta)
+
+    ids = []
+    residues = []
+    structure = []
+    for protein, seq, states in read_fasta(fasta):
+        try:
+            codes = encode(seq)
+        except KeyError as err:
+            raise ValueError("{}: unknown residue {}".format(protein, err))
+        if states is None:
+            states = np.full(len(codes), NO_STRUCTURE, dtype=np.uint8)
+        else:
+            states = np.array(struct2int(simplify_struct(states)),
+                              dtype=np.uint8)
+        if len(states) != len(codes):
+            raise ValueError("{}: {} residues but {} structure states".format(
+                             protein, len(codes), len(states)))
+        ids.append(protein.encode("utf-8"))
+        residues.append(codes)
+        structure.append(states)
+
+    offsets = np.zeros(len(ids) + 1, dtype="<i8")
+    np.cumsum([len(r) for r in residues], out=offsets[1:])
+    id_offsets = np.zeros(len(ids) + 1, dtype="<i8")
+    np.cumsum([len(x) for x in ids], out=id_offsets[1:])
+
+    # write to a temporary file first so readers never see half a store
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        header = HEADER.pack(MAGIC, VERSION, len(ids), int(offsets[-1]),
+                             int(id_offsets[-1]))
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(offsets.tobytes())
+        f.write(id_offsets.tobytes())
+        for r in residues:
+            f.write(r.tobytes())
+        for s in structure:
+            f.write(s.tobytes())
+        f.write(b"".join(ids))
+    os.replace(tmp, path)
+    return path
+
+class SequenceStore:
+    """A memory-mapped store; residues() and structure() are zero-copy
+    slices that the kernels in viterbi.py take directly"""
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, n, n_residues, id_bytes = HEADER.unpack(
+            bytes(self.buffer[:HEADER.size]))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} sequence store".format(
+                             path, VERSION))
+        pos = HEADER_SIZE
+        self.offsets = self.buffer[pos:pos + 8*(n+1)].view("<i8")
+        pos += 8*(n+1)
+        self.id_offsets = self.buffer[pos:pos + 8*(n+1)].view("<i8")
+        pos += 8*(n+1)
+        self.codes = self.buffer[pos:pos + n_residues]
+        pos += n_residues
+        self.states = self.buffer[pos:pos + n_residues]
+        pos += n_residues
+        self.id_bytes = self.buffer[pos:pos + id_bytes]
+        self.count = n
+
+    def __len__(self):
+        return self.count
+
+    def residues(self, i):
+        """Residue codes of protein i"""
+        return self.codes[self.offsets[i]:self.offsets[i+1]]
+
+    def structure(self, i):
+        """Structure codes of protein i (NO_STRUCTURE if it had none)"""
+        return self.states[self.offsets[i]:self.offsets[i+1]]
+
+    def labels(self, i):
+        """Structure of protein i as a string of A, B and O, or None"""
+        s = self.structure(i)
+        if len(s) and s[0] == NO_STRUCTURE:
+            return None
+        return LABELS[s].tobytes().decode("ascii")
+
+    def id(self, i):
+        return bytes(self.id_bytes[self.id_offsets[i]:self.id_offsets[i+1]]
+                     ).decode("utf-8")
+
+    def records(self):
+        """(ids, seqs, states) in the form data.load_records returns them"""
+        ids = [self.id(i) for i in range(self.count)]
+        seqs = [self.residues(i) for i in range(self.count)]
+        states = [self.labels(i) for i in range(self.count)]
+        return (ids, seqs, states)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("usage: python -m mc_hmmer.store in.fasta [out.store]")
+    path = build_store(*sys.argv[1:])
+    store = SequenceStore(path)
+    print("Wrote {} proteins, {} residues to {}".format(len(store),
+          len(store.codes), path))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Parallel tempering: several copies of the sampler from mcmc.py, each with
+# the likelihood raised to a power beta <= 1, run in their own processes and
+# periodically swap models. Only the cold chain (beta = 1) is sampled.
+
+import math
+import multiprocessing
+import pickle
+import random
+import sys
+
+def ladder(n_chains, max_temperature):
+    """Inverse temperatures spaced geometrically from 1 to 1/max_temperature"""
+    if n_chains == 1:
+        return [1.0]
+    step = max_temperature ** (1.0 / (n_chains - 1))
+    return [step ** -k for k in range(n_chains)]
+
+def replica_worker(conn, seqs, beta, seed, cache_size, max_states):
+    """Run segments of the chain at inverse temperature beta on request
+
+    Each request carries the model to continue from (it may have been swapped
+    in from a neighbouring replica), the global iteration it starts at and how
+    many steps to take. The reply is the final model and its log likelihood,
+    the acceptance counts and, on the cold chain, the sampled models.
+    """
+    from .mcmc import PackedSequences, LikelihoodCache, metropolis_step
+    random.seed(seed)
+    train = PackedSequences(seqs)
+    cache = LikelihoodCache(cache_size)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        m, log_likelihood_m, first, n_steps, sample_every, burnin = message
+        accepted = 0
+        samples = []
+        for i in range(first, first + n_steps):
+            move, m, log_likelihood_m, accept = metropolis_step(
+                m, log_likelihood_m, train, cache, max_states, beta)
+            accepted += accept
+            if beta == 1.0 and i % sample_every == 0 and i > burnin:
+                samples.append(m)
+        conn.send((m, log_likelihood_m, accepted, n_steps, samples))
+    conn.close()
+
+class Replicas:
+    """A pool of tempered chains, one process each"""
+    def __init__(self, seqs, betas, seed, cache_size=10000, max_states=10):
+        self.betas = betas
+        self.conns = []
+        self.workers = []
+        for k, beta in enumerate(betas):
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=replica_worker, daemon=True,
+                args=(child, seqs, beta, "{}-{}".format(seed, k), cache_size,
+                      max_states))
+            worker.start()
+            child.close()
+            self.conns.append(parent)
+            self.workers.append(worker)
+
+    def run(self, models, logliks, first, n_steps, sample_every, burnin):
+        """Advance every chain by n_steps from the given states"""
+        for conn, m, loglik in zip(self.conns, models, logliks):
+            conn.send((m, loglik, first, n_steps, sample_every, burnin))
+        return [conn.recv() for conn in self.conns]
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+
+def swap(betas, models, logliks, pairs, rng):
+    """Try to exchange models between the given pairs of adjacent chains;
+    returns which swaps were accepted"""
+    accepted = []
+    for k in pairs:
+        log_ratio = (betas[k] - betas[k+1]) * (logliks[k+1] - logliks[k])
+        if log_ratio >= 0 or rng.random() < math.exp(log_ratio):
+            models[k], models[k+1] = models[k+1], models[k]
+            logliks[k], logliks[k+1] = logliks[k+1], logliks[k]
+            accepted.append(k)
+    return accepted
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Sample HMM topologies with "
+                                     "parallel tempering")
+    parser.add_argument("--train", default="train.fasta",
+                        help="training proteins (a FASTA of sequence/secstr "
+                        "pairs, or a store built by store.py)")
+    parser.add_argument("-o", "--output", default="models.pkl",
+                        help="where to write the sampled models")
+    parser.add_argument("-n", "--iterations", type=int, default=10000,
+                        help="how many iterations to do in total")
+    parser.add_argument("--sample-every", type=int, default=100,
+                        help="how often to sample models")
+    parser.add_argument("--burnin", type=int, default=1000,
+                        help="don't start sampling until after this many "
+                        "iterations")
+    parser.add_argument("--max-states", type=int, default=10,
+                        help="models with more states are always rejected")
+    parser.add_argument("--chains", type=int, default=4,
+                        help="number of tempered chains")
+    parser.add_argument("--max-temperature", type=float, default=50.0,
+                        help="temperature of the hottest chain")
+    parser.add_argument("--swap-every", type=int, default=10,
+                        help="iterations each chain runs between swap "
+                        "attempts")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="seed for the swaps; chain k is seeded with "
+                        "\"seed-k\"")
+    args = parser.parse_args(argv)
+
+    n_iter = args.iterations
+    sample_every = args.sample_every
+    burnin = args.burnin
+    n_chains = args.chains
+    max_temperature = args.max_temperature
+    swap_every = args.swap_every
+    seed = args.seed
+    max_states = args.max_states
+
+    from .mcmc import load_train_data, initial_model, log_likelihood
+
+    print("Loading training data")
+    data, states = load_train_data(args.train)
+    m = initial_model(data, states)
+    log_likelihood_m = log_likelihood(m, data)
+
+    betas = ladder(n_chains, max_temperature)
+    models = [m] * n_chains
+    logliks = [log_likelihood_m] * n_chains
+    accepted = [0] * n_chains
+    proposed = [0] * n_chains
+    swaps_tried = [0] * (n_chains - 1)
+    swaps_accepted = [0] * (n_chains - 1)
+    rng = random.Random(seed)
+
+    writer = sys.stderr
+    writer.write("\t".join(["iteration", "chain", "beta", "loglik", "states"])
+                 + "\n")
+
+    sampled_models = []
+    replicas = Replicas(data, betas, seed, max_states=max_states)
+    try:
+        for segment, first in enumerate(range(0, n_iter, swap_every)):
+            n_steps = min(swap_every, n_iter - first)
+            results = replicas.run(models, logliks, first, n_steps,
+                                   sample_every, burnin)
+            for k, (m, loglik, acc, n, samples) in enumerate(results):
+                models[k] = m
+                logliks[k] = loglik
+                accepted[k] += acc
+                proposed[k] += n
+                sampled_models.extend(samples)
+                writer.write("{}\t{}\t{}\t{}\t{}\n".format(first + n_steps - 1,
+                             k, betas[k], loglik, len(m.labels)))
+
+            # alternate between even and odd pairs of neighbours
+            pairs = list(range(segment % 2, n_chains - 1, 2))
+            for k in pairs:
+                swaps_tried[k] += 1
+            for k in swap(betas, models, logliks, pairs, rng):
+                swaps_accepted[k] += 1
+            print("Iteration", first + n_steps - 1, "- cold chain",
+                  len(models[0].labels), "states, loglik", logliks[0])
+    finally:
+        replicas.close()
+
+    for k in range(n_chains):
+        print("Chain {} (beta {:.4f}): acceptance {:.3f}".format(k, betas[k],
+              accepted[k] / float(max(proposed[k], 1))))
+    for k in range(n_chains - 1):
+        print("Swaps {} <-> {}: {:.3f} of {}".format(k, k+1,
+              swaps_accepted[k] / float(max(swaps_tried[k], 1)),
+              swaps_tried[k]))
+
+    with open(args.output, "wb") as f:
+        pickle.dump(sampled_models, f)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
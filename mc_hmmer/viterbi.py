@@ -0,0 +1,725 @@
+#!/usr/bin/env python3
+import math
+import time
+import numpy as np
+
+# because python3 doesn't like xrange
+try:
+    xrange
+except NameError:
+    xrange = range
+    
+def run_viterbi(e, t, s, return_path, logE=None, logT=None, topology=None) :
+    #the path is the posterior one, so there is no Viterbi pass; logE and
+    #logT are still accepted for callers that pass them
+    if topology is None :
+        topology = Topology(t)
+    if return_path and len(s) >= CHECKPOINT_MIN_LENGTH :
+        return posteriorPathCheckpointed(e, t, s, topology)
+    out = forwardAlgorithm(e, t, s, topology)
+    B = backwardAlgorithm(e, t, s, out[1], topology)
+    
+    return posteriorPath(e, t, s, out[0], B, out[1], return_path)
+    
+#the sparse kernels only pay off once there are enough states for the
+#per-edge bookkeeping to beat a dense product, and Viterbi (whose dense step
+#is an argmax over the whole matrix) gains at much higher densities than
+#forward/backward; see benchmark.sweep_density
+SPARSE_MIN_STATES = 64
+SPARSE_MAX_DENSITY = 0.05
+SPARSE_VITERBI_MAX_DENSITY = 0.25
+
+class Topology :
+    #CSR-style predecessor lists of a transition matrix: the edges k -> j with
+    #t[k][j] != 0 (k = 0 is the begin state), sorted by j and then by k, so
+    #the predecessors of state j are src[start[j]:start[j+1]]; sparse and
+    #sparseViterbi say whether forward/backward and Viterbi should use them
+    #rather than the dense matrices (both default to SPARSE_* above)
+    def __init__(self, t, sparse=None) :
+        T = np.asarray(t, dtype=float)
+        self.states = T.shape[1]
+        self.dst, self.src = np.nonzero(T.T)
+        self.weight = T[self.src, self.dst]
+        self.start = np.searchsorted(self.dst, np.arange(self.states+1))
+        self.density = len(self.src) / float(T.size)
+        if sparse is None :
+            self.sparse = (self.states >= SPARSE_MIN_STATES and
+                           self.density <= SPARSE_MAX_DENSITY)
+            self.sparseViterbi = (self.states >= SPARSE_MIN_STATES and
+                                  self.density <= SPARSE_VITERBI_MAX_DENSITY)
+        else :
+            self.sparse = self.sparseViterbi = sparse
+
+        #the edges between states, with states numbered from 0
+        inner = self.src > 0
+        self.innerSrc = self.src[inner] - 1
+        self.innerDst = self.dst[inner]
+        self.innerWeight = self.weight[inner]
+
+    def stepWeights(self, e) :
+        #the sparse counterpart of stepMatrices: W[c][x] = t[k][j] * e[c][j]
+        #for each edge x = k -> j between states
+        E = np.asarray(e, dtype=float)
+        return self.innerWeight[None, :] * E[:, self.innerDst]
+
+def viterbiDecoding(e, t, s, logE=None, logT=None, topology=None) :
+    #the log matrices can be passed in precomputed (see mcmc.Model),
+    #otherwise they are taken once here rather than inside the fill loop
+    if logE is None or logT is None :
+        with np.errstate(divide="ignore") :
+            logE = np.log(np.asarray(e, dtype=float))
+            logT = np.log(np.asarray(t, dtype=float))
+    if topology is None :
+        topology = Topology(t)
+
+    #Step 0: Initialize
+    c = encode(s).tolist()
+    n = len(c)
+    states = logE.shape[1]
+
+    #only the last row of scores is kept, alternating between two buffers;
+    #the traceback just needs the predecessors, stored in the smallest type
+    #that holds a state
+    rows = np.full((2, states+1), -np.inf)
+    v = rows[0]
+    v[0] = 0
+    predecessor = np.zeros((n+1, states+1),
+                           dtype=np.min_scalar_type(states+1))
+    columns = np.arange(states)
+    
+    #Step 1: Fill matrix, taking the first best predecessor k for each j
+    if topology.sparseViterbi :
+        #only look at existing edges; states without any keep -inf
+        src, dst = topology.src, topology.dst
+        reached = topology.start[1:] > topology.start[:-1]
+        first = topology.start[:-1][reached]
+        targets = columns[reached] + 1
+        counts = np.diff(topology.start)[reached]
+        logW = list(logT[src, dst][None, :] + logE[:, dst])
+        for i in xrange(1, n+1) :
+            scores = v[src] + logW[c[i-1]]
+            best = np.maximum.reduceat(scores, first)
+            ties = np.where(scores == np.repeat(best, counts), src, states+1)
+            v = rows[i % 2]
+            v.fill(-np.inf)
+            v[targets] = best
+            predecessor[i][targets] = np.minimum.reduceat(ties, first)
+    else :
+        for i in xrange(1, n+1) :
+            scores = v[:, None] + logT
+            pred = scores.argmax(axis=0)
+            v = rows[i % 2]
+            v[0] = -np.inf
+            v[1:] = logE[c[i-1]] + scores[pred, columns]
+            predecessor[i][1:] = pred
+    
+    lastState = -1
+    if n > 0 and v[1:].max() > -np.inf :
+        lastState = int(v[1:].argmax()) + 1
+            
+    concat = []
+    i = n
+    while lastState != -1 and lastState != 0 :
+        concat.append(lastState)
+        lastState = int(predecessor[i][lastState])
+        i = i - 1 
+    return(concat)    
+    
+#the vectorized kernels only renormalize their running row every
+#RESCALE_EVERY positions; each step can only shrink the total probability,
+#so this just has to be often enough to stay clear of underflow
+RESCALE_EVERY = 16
+
+#sequences at least this long are decoded with checkpointed forward-backward
+#(posteriorPathCheckpointed, ensemblePosteriorSegments), which keeps
+#O(sqrt(n)) rows instead of O(n) for about one more forward pass of work
+CHECKPOINT_MIN_LENGTH = 10000
+
+def encode(s) :
+    #integer-encode a sequence with chars; encoded arrays pass through
+    if isinstance(s, np.ndarray) :
+        return s
+    codes = codeTable[np.frombuffer(s.encode("ascii"), dtype=np.uint8)]
+    if (codes == 255).any() :
+        raise KeyError(s[int(np.argmax(codes == 255))])
+    return codes
+
+def stepMatrices(e, t) :
+    #fold the emissions into the transitions, one matrix per residue:
+    #start[c][j] = t[0][j] * e[c][j] and M[c][k][j] = t[k+1][j] * e[c][j]
+    E = np.asarray(e, dtype=float)
+    T = np.asarray(t, dtype=float)
+    return T[0] * E, T[1:][None, :, :] * E[:, None, :]
+
+def forwardStep(e, t, topology) :
+    #one forward step as step(v, c, out): out[j] = sum_k v[k] M[c][k][j]
+    if topology.sparse :
+        W = list(topology.stepWeights(e))
+        src, dst, states = topology.innerSrc, topology.innerDst, topology.states
+        def step(v, c, out) :
+            out[:] = np.bincount(dst, weights=v[src] * W[c], minlength=states)
+    else :
+        M = list(stepMatrices(e, t)[1])
+        def step(v, c, out) :
+            np.dot(v, M[c], out=out)
+    return step
+
+def backwardStep(e, t, topology) :
+    #one backward step as step(v, c, out): out[k] = sum_j M[c][k][j] v[j]
+    if topology.sparse :
+        W = list(topology.stepWeights(e))
+        src, dst, states = topology.innerSrc, topology.innerDst, topology.states
+        def step(v, c, out) :
+            out[:] = np.bincount(src, weights=v[dst] * W[c], minlength=states)
+    else :
+        M = list(stepMatrices(e, t)[1])
+        def step(v, c, out) :
+            np.dot(M[c], v, out=out)
+    return step
+
+def forwardAlgorithm(e, t, s, topology=None) :
+    #Step 0: Initialize
+    if topology is None :
+        topology = Topology(t)
+    c = encode(s).tolist()
+    n = len(c)
+    states = topology.states
+    step = forwardStep(e, t, topology)
+
+    #Step 1: Fill matrix with unnormalized rows, rescaling the running row
+    G = np.empty((n+1, states))
+    G[0] = 0
+    G[1] = np.asarray(t[0], dtype=float) * np.asarray(e[c[0]], dtype=float)
+    v = G[1]
+    for i in xrange(2, n+1) :
+        if (i-1) % RESCALE_EVERY == 0 :
+            v = v / v.sum()
+        step(v, c[i-1], G[i])
+        v = G[i]
+
+    #Step 2: Recover the per-position scaling factors and normalized rows
+    S = G[1:].sum(axis=1)
+    prev = np.ones(n)
+    prev[1:] = S[:-1]
+    prev[::RESCALE_EVERY] = 1
+    scale = np.ones(n+1)
+    scale[1:] = S / prev
+
+    F = np.zeros((n+1, states+1))
+    F[0][0] = 1
+    F[1:, 1:] = G[1:] / S[:, None]
+
+    logprob = float(np.log(scale[1:]).sum())
+    return [F, scale, logprob]
+
+def backwardAlgorithm(e, t, s, scale, topology=None) :
+    #Step 0: Initialize
+    if topology is None :
+        topology = Topology(t)
+    c = encode(s).tolist()
+    n = len(c)
+    states = topology.states
+    step = backwardStep(e, t, topology)
+    scale = np.asarray(scale, dtype=float)
+
+    #Step 1: Fill matrix with unscaled rows, rescaling the running row
+    R = np.empty((n+1, states))
+    R[n] = 1
+    logRescale = np.zeros(n+1)
+    v = R[n]
+    for i in xrange(n-1, 0, -1) :
+        if (i+1) % RESCALE_EVERY == 0 :
+            total = v.sum()
+            logRescale[i+1] = math.log(total)
+            v = v / total
+        step(v, c[i], R[i])
+        v = R[i]
+
+    #Step 2: Apply the accumulated scaling factors, B[i] = R[i] * exp(logc[i])
+    #where logc[i] = logc[i+1] + logRescale[i+1] - log(scale[i])
+    steps = logRescale[2:] - np.log(scale[1:n])
+    logc = np.cumsum(steps[::-1])[::-1]
+
+    B = np.zeros((n+1, states+1))
+    B[n][1:] = 1
+    B[1:n, 1:] = R[1:n] * np.exp(logc)[:, None]
+    return B
+
+def posteriorPathCheckpointed(e, t, s, topology=None, segment=None) :
+    #posteriorPath(..., True) of forwardAlgorithm and backwardAlgorithm with
+    #the same arithmetic, and so the same path, but only every segment-th
+    #forward row is kept (segment defaults to sqrt(n)); the backward sweep
+    #recomputes the forward rows of one segment at a time and decodes it
+    if topology is None :
+        topology = Topology(t)
+    c = encode(s).tolist()
+    n = len(c)
+    states = topology.states
+    forward = forwardStep(e, t, topology)
+    backward = backwardStep(e, t, topology)
+    if segment is None :
+        segment = max(1, int(math.ceil(math.sqrt(n))))
+    starts = list(xrange(1, n+1, segment))
+
+    def rows(first, row, count) :
+        #forward rows first..first+count-1 from row first, as forwardAlgorithm
+        G = np.empty((count, states))
+        G[0] = row
+        v = G[0]
+        for i in xrange(first+1, first+count) :
+            if (i-1) % RESCALE_EVERY == 0 :
+                v = v / v.sum()
+            forward(v, c[i-1], G[i-first])
+            v = G[i-first]
+        return G
+
+    #Step 1: Forward sweep, keeping the row before each segment (whose sum
+    #the segment's first scaling factor needs)
+    keep = set(max(a-1, 1) for a in starts)
+    checkpoints = {}
+    row = np.asarray(t[0], dtype=float) * np.asarray(e[c[0]], dtype=float)
+    for i in xrange(1, n+1) :
+        if i in keep :
+            checkpoints[i] = row
+        if i < n :
+            v = row / row.sum() if i % RESCALE_EVERY == 0 else row
+            row = np.empty(states)
+            forward(v, c[i], row)
+
+    #Step 2: Backward sweep a segment at a time, from the end
+    path = [0] * n
+    v = np.ones(states)
+    logc = 0.0
+    for a in reversed(starts) :
+        b = min(a + segment, n+1)
+        first = max(a-1, 1)
+        G = rows(first, checkpoints[first], b - first)
+        S = G.sum(axis=1)
+        prev = np.ones(len(S))
+        prev[1:] = S[:-1]
+        prev[(np.arange(first, b) - 1) % RESCALE_EVERY == 0] = 1
+        scale = (S / prev)[a-first:]
+        F = G[a-first:] / S[a-first:, None]
+
+        R = np.empty((b-a, states))
+        logRescale = np.zeros(b-a)
+        for i in xrange(b-1, a-1, -1) :
+            if i == n :
+                R[i-a] = 1
+                continue
+            if (i+1) % RESCALE_EVERY == 0 :
+                total = v.sum()
+                logRescale[i-a] = math.log(total)
+                v = v / total
+            backward(v, c[i], R[i-a])
+            v = R[i-a]
+
+        #B[i] = R[i] * exp(logc[i]) with logc accumulated from the end, as
+        #the cumulative sum in backwardAlgorithm
+        last = min(b, n) - a
+        steps = logRescale[:last] - np.log(scale[:last])
+        logcs = np.zeros(last)
+        for i in xrange(last-1, -1, -1) :
+            logc = logc + steps[i]
+            logcs[i] = logc
+        factor = np.ones(b-a)
+        factor[:last] = np.exp(logcs)
+        B = R * factor[:, None]
+
+        path[a-1:b-1] = (np.argmax(F * B, axis=1) + 1).tolist()
+    return path
+
+class PackedSequences :
+    #sequences integer-encoded and packed into length buckets for batchForward;
+    #each bucket is a (positions x sequences) code array with its sequences in
+    #decreasing order of length, so the ones still running at position i are
+    #always the first active[i] columns, and index maps the columns back to
+    #the input order
+    def __init__(self, seqs, bucketSize=1024) :
+        codes = [encode(s) for s in seqs]
+        lengths = np.array([len(c) for c in codes], dtype=int)
+        order = np.argsort(-lengths, kind="stable")
+
+        self.count = len(codes)
+        self.residues = int(lengths.sum())
+        self.buckets = []
+        for first in xrange(0, self.count, bucketSize) :
+            index = order[first:first+bucketSize]
+            n = lengths[index]
+            packed = np.zeros((n[0], len(index)), dtype=np.uint8)
+            for col, k in enumerate(index) :
+                packed[:n[col], col] = codes[k]
+            active = np.searchsorted(-n, -np.arange(n[0]), side="left")
+            self.buckets.append((index, packed, active.tolist()))
+
+    def __len__(self) :
+        return self.count
+
+def batchForward(e, t, packed) :
+    #forward algorithm over every sequence of a PackedSequences at once, one
+    #position per step; returns the per-sequence log probabilities (in input
+    #order) and their total
+    E = np.asarray(e, dtype=float)
+    T = np.asarray(t, dtype=float)
+    T1 = T[1:]
+    logprob = np.zeros(packed.count)
+
+    for index, codes, active in packed.buckets :
+        n = len(codes)
+        if n == 0 :
+            continue
+        logscale = np.zeros(len(index))
+
+        f = T[0] * E[codes[0, :active[0]]]
+        for i in xrange(1, n) :
+            a = active[i]
+            if a < len(f) :
+                #the sequences past column a ended at position i
+                logscale[a:len(f)] += np.log(f[a:].sum(axis=1))
+                f = f[:a]
+            if i % RESCALE_EVERY == 0 :
+                total = f.sum(axis=1)
+                logscale[:a] += np.log(total)
+                f = f / total[:, None]
+            f = np.dot(f, T1) * E[codes[i, :a]]
+        logscale[:len(f)] += np.log(f.sum(axis=1))
+
+        logprob[index] = logscale
+    return (logprob, float(logprob.sum()))
+
+def ensemblePosteriors(e, t, s) :
+    #posterior state probabilities of one sequence under K models with the
+    #same number of states, all decoded in one pass; e is (K x 20 x states),
+    #t is (K x states+1 x states) and the result is (positions x K x states)
+    #with every row summing to 1
+    n = len(s)
+    P = np.empty((n, len(t), len(t[0][0])))
+    for first, segment in ensemblePosteriorSegments(e, t, s, n) :
+        P[first:first+len(segment)] = segment
+    return P
+
+def ensemblePosteriorSegments(e, t, s, segment=None) :
+    #ensemblePosteriors a segment of positions at a time, yielding the first
+    #position and the posteriors of each segment from the end of the
+    #sequence back; only the first forward row of each segment (and all of
+    #the last one) is kept on the way forward, and the rest are recomputed
+    #on the way back, so there are O(sqrt(n)) rows for the default segment
+    #of sqrt(n)
+    E = np.asarray(e, dtype=float)
+    T = np.asarray(t, dtype=float)
+    c = encode(s).tolist()
+    n = len(c)
+    K, states = T.shape[0], T.shape[2]
+    if n == 0 :
+        return
+    if segment is None :
+        segment = max(1, int(math.ceil(math.sqrt(n))))
+    starts = list(xrange(0, n, segment))
+
+    #M[c][k] = t[k][1:] * e[k][c], a stack of K step matrices per residue
+    M = list(T[None, :, 1:, :] * np.transpose(E, (1, 0, 2))[:, :, None, :])
+
+    #forward and backward rows are only rescaled every RESCALE_EVERY
+    #positions, as the posteriors don't need the scaling factors
+    def rows(first, count, G=None, keep=None) :
+        if G is None :
+            G = np.empty((count, K, states))
+            G[0] = keep[first]
+        v = G[0]
+        for i in xrange(first+1, first+count) :
+            if i % RESCALE_EVERY == 0 :
+                v = v / v.sum(axis=1)[:, None]
+            G[i-first] = np.matmul(v[:, None, :], M[c[i]])[:, 0]
+            v = G[i-first]
+            if keep is not None and i in keep :
+                keep[i] = G[i-first].copy()
+        return G
+
+    keep = dict.fromkeys(starts)
+    last = starts[-1]
+    if last == 0 :
+        G = np.empty((n, K, states))
+        G[0] = T[:, 0] * E[:, c[0]]
+        rows(0, n, G)
+    else :
+        #sweep keeping only the segment starts, then fill in the last
+        #segment from its start
+        v = T[:, 0] * E[:, c[0]]
+        keep[0] = v
+        for i in xrange(1, last+1) :
+            if i % RESCALE_EVERY == 0 :
+                v = v / v.sum(axis=1)[:, None]
+            v = np.matmul(v[:, None, :], M[c[i]])[:, 0]
+            if i in keep :
+                keep[i] = v
+        G = rows(last, n - last, keep=keep)
+
+    v = np.ones((K, states))
+    for first in reversed(starts) :
+        count = min(segment, n - first)
+        if first != last :
+            G = rows(first, count, keep=keep)
+        R = np.empty((count, K, states))
+        for i in xrange(first+count-1, first-1, -1) :
+            if i == n-1 :
+                R[i-first] = 1
+                continue
+            if (n-1-i) % RESCALE_EVERY == 0 :
+                v = v / v.sum(axis=1)[:, None]
+            R[i-first] = np.matmul(M[c[i+1]], v[:, :, None])[:, :, 0]
+            v = R[i-first]
+        P = G * R
+        P /= P.sum(axis=2)[:, :, None]
+        yield (first, P)
+
+class cell:
+    #class to store matrix cell information for traceback
+    value = -float("inf")
+    predecessor = -1
+    
+def viterbiDecodingLoop(e, t, s) :
+    #reference implementation of viterbiDecoding, kept for testEngines
+    #Step 0: Initialize
+    n = len(s)
+    states = len(e[1])
+
+    V = [[cell() for x in xrange(states+1)] for x in xrange(n+1)] 
+    V[0][0].value = 0
+    
+    #Step 1: Fill matrix
+    for i in xrange(1, n+1) :
+        for j in xrange(1, states+1) :
+            index = chars[s[i-1:i]]
+            ej = math.log(e[index][j-1])
+            maxk = -float("inf")
+            pred = 0
+            for k in xrange(states+1) :
+                Vk = V[i-1][k].value
+                akj = -float("inf")
+                if t[k][j-1] != 0:
+                    akj = math.log(t[k][j-1])
+                else:
+                    continue
+                    
+                if maxk < Vk + akj :
+                    maxk = Vk + akj
+                    pred = k
+                    
+            V[i][j].value = ej + maxk
+            V[i][j].predecessor = pred
+    
+    score = -float("inf")
+    lastState = -1
+    for j in xrange(1,states+1) :
+        if V[n][j].value > score :
+            score = V[n][j].value
+            lastState = j
+            
+    concat = []
+    while lastState != -1 and lastState != 0 :
+        concat.append(lastState)
+        lastState = V[i][lastState].predecessor
+        i = i - 1 
+    return(concat)    
+    
+def forwardAlgorithmLoop(e, t, s) :
+    #reference implementation of forwardAlgorithm, kept for testEngines
+    #Step 0: Initialize
+    n = len(s)
+    states = len(e[1])
+ 
+    F = [[0 for x in xrange(states+1)] for x in xrange(n+1)] 
+    F[0][0] = 1
+    scale = [1 for x in xrange(n+1)]
+    sum_logscale = 0
+
+    #Step 1: Fill matrix
+    for i in xrange(1, n+1) :
+        sum = 0
+        for j in xrange(1, states+1) :
+            index = chars[s[i-1:i]]
+            ej = e[index][j-1]
+            
+            sum_fkakl = 0
+            for k in xrange(states+1) :
+                sum_fkakl += F[i-1][k] * t[k][j-1]
+                
+            F[i][j] = ej * sum_fkakl
+            sum += F[i][j]
+        
+        scale[i] = sum
+        sum_logscale += math.log(sum)
+
+        for l in xrange(states+1) :
+            F[i][l] = F[i][l]/sum
+   
+    logprob = 0;
+    for j in xrange(1, states+1) :
+        logprob += F[n][j]
+        
+    logprob = -(math.log(logprob) - sum_logscale)
+
+    return [F, scale, logprob]
+    
+def backwardAlgorithmLoop(e, t, s, scale) :
+    #reference implementation of backwardAlgorithm, kept for testEngines
+    #Step 0: Initialize
+    n = len(s)
+    states = len(e[1])
+
+    B = [[0 for x in xrange(states+1)] for x in xrange(n+1)] 
+    
+    for j in xrange(1, states+1) :
+        B[n][j] = 1;
+        
+    #Step 1: Fill matrix
+    for i in xrange(n-1, 0, -1) :
+        for j in xrange(1, states+1) :
+            index = chars[s[i:i+1]]
+            sumk = 0
+            for k in xrange(1, states+1) :
+                sumk += B[i+1][k] * t[j][k-1] * e[index][k-1]
+            
+            B[i][j] = sumk / scale[i]
+            
+    return B
+    
+def posteriorPath(e, t, s, F, B, scale, return_path) :
+    if return_path :
+        #first most probable state at each position, as in a strict > scan
+        P = np.asarray(F)[1:, 1:] * np.asarray(B)[1:, 1:]
+        return (np.argmax(P, axis=1) + 1).tolist()
+    
+    #todo: return something?
+    return 0
+
+ #ACDEFGHIKLMNPQRSTVWYX
+chars = {"A":0, "C":1, "D":2, "E":3, "F":4, "G":5, "H":6, "I":7, "K":8, 
+"L":9, "M":10, "N":11, "P":12, "Q":13, "R":14, "S":15, "T":16, 
+"V":17, "W":18,"Y":19}
+
+codeTable = np.full(256, 255, dtype=np.uint8)
+for c, index in chars.items() :
+    codeTable[ord(c)] = index
+
+def setupTest() :
+
+    e = [
+    [0.106134,0.059686,0.062796],
+    [0.013200,0.019820,0.015719],
+    [0.049837,0.043423,0.072972],
+    [0.091491,0.050432,0.058141],
+    [0.041080,0.052439,0.032509],
+    [0.034454,0.067148,0.108530],
+    [0.021396,0.023232,0.024904],
+    [0.060069,0.085248,0.037289],
+    [0.068427,0.050830,0.060637],
+    [0.121081,0.093883,0.068519],
+    [0.026845,0.020555,0.022728],
+    [0.032872,0.032855,0.057896],
+    [0.023658,0.027213,0.076311],
+    [0.048216,0.029758,0.034650],
+    [0.059596,0.045907,0.046746],
+    [0.049883,0.055435,0.075226],
+    [0.041552,0.064133,0.059066],
+    [0.062080,0.117532,0.048200],
+    [0.014381,0.015942,0.010063],
+    [0.033735,0.044513,0.027079]]
+    
+    t = [[1.0/3.0, 1.0/3.0, 1.0/3.0],
+    [0.9, 0.0, 0.1],
+    [0.0, 0.89, 0.11],
+    [0.1, 0.11, 0.79]]
+    
+    s = "MKSIGVVRKVDELGRIVMPIELRRALDIAIKDSIEFFVDGDKIILKKYKPHGVCLMTGEITSENKEYGNGKITLSPEGAQLLLEEIQAALKE"
+    run_viterbi(e,t,s, True)
+    return (e, t, s)
+
+def compareEngines(e, t, seqs) :
+    #check the vectorized kernels against the loop kernels, and time both
+    maxDiff = 0
+    loopTime = 0
+    vecTime = 0
+    for s in seqs :
+        start = time.time()
+        F1, scale1, logprob1 = forwardAlgorithmLoop(e, t, s)
+        B1 = backwardAlgorithmLoop(e, t, s, scale1)
+        loopTime += time.time() - start
+
+        start = time.time()
+        F2, scale2, logprob2 = forwardAlgorithm(e, t, s)
+        B2 = backwardAlgorithm(e, t, s, scale2)
+        vecTime += time.time() - start
+
+        assert abs(logprob1 - logprob2) <= 1e-9 * abs(logprob1)
+        assert np.allclose(F1, F2, rtol=1e-9, atol=0)
+        assert np.allclose(scale1, scale2, rtol=1e-9, atol=0)
+        assert np.allclose(B1, B2, rtol=1e-9, atol=0)
+        assert (posteriorPath(e, t, s, F1, B1, scale1, True) ==
+                posteriorPath(e, t, s, F2, B2, scale2, True))
+        assert viterbiDecodingLoop(e, t, s) == viterbiDecoding(e, t, s)
+
+        sparse = Topology(t, sparse=True)
+        F3, scale3, logprob3 = forwardAlgorithm(e, t, s, sparse)
+        B3 = backwardAlgorithm(e, t, s, scale3, sparse)
+        assert abs(logprob1 - logprob3) <= 1e-9 * abs(logprob1)
+        assert np.allclose(F1, F3, rtol=1e-9, atol=0)
+        assert np.allclose(B1, B3, rtol=1e-9, atol=0)
+        assert (viterbiDecoding(e, t, s, topology=sparse) ==
+                viterbiDecoding(e, t, s))
+        maxDiff = max(maxDiff, abs(logprob1 - logprob2))
+    return (maxDiff, loopTime, vecTime)
+
+def compareBatch(e, t, seqs) :
+    #check batchForward against per-sequence forwardAlgorithm, and time both
+    start = time.time()
+    single = [forwardAlgorithm(e, t, s)[2] for s in seqs]
+    singleTime = time.time() - start
+
+    packed = PackedSequences(seqs)
+    start = time.time()
+    batch, total = batchForward(e, t, packed)
+    batchTime = time.time() - start
+
+    assert np.allclose(single, batch, rtol=1e-9, atol=0)
+    assert abs(total - math.fsum(single)) <= 1e-9 * abs(total)
+    return (float(np.abs(batch - single).max()), singleTime, batchTime)
+
+def compareCheckpointed(e, t, seqs) :
+    #check that posteriorPathCheckpointed decodes exactly as posteriorPath,
+    #for a few segment lengths; returns how many paths were compared
+    compared = 0
+    for s in seqs :
+        F, scale, logprob = forwardAlgorithm(e, t, s)
+        B = backwardAlgorithm(e, t, s, scale)
+        path = posteriorPath(e, t, s, F, B, scale, True)
+        for segment in [None, 1, 7, len(s)] :
+            assert posteriorPathCheckpointed(e, t, s, segment=segment) == path
+            compared += 1
+    return compared
+
+def testEngines() :
+    #equivalence test and speedup of the vectorized forward/backward kernels,
+    #on the 3-state model from setupTest and the 36-state model from bmc.py
+    from . import data
+    seqs = data.load_train_data()[0]
+    e, t, s = setupTest()
+    e36, t36, labels = data.load_paper_model()
+
+    for name, e, t, seqs in [("3-state", e, t, [s] + seqs),
+                             ("36-state", e36, t36, seqs[:20])] :
+        maxDiff, loopTime, vecTime = compareEngines(e, t, seqs)
+        print("{}: {} sequences, max |dlogprob| {:.2e}, loop {:.3f}s, "
+              "vectorized {:.3f}s, speedup {:.1f}x".format(name, len(seqs),
+              maxDiff, loopTime, vecTime, loopTime/vecTime))
+
+        maxDiff, singleTime, batchTime = compareBatch(e, t, seqs)
+        print("{}: batched, max |dlogprob| {:.2e}, per-sequence {:.4f}s, "
+              "batched {:.4f}s, speedup {:.1f}x".format(name, maxDiff,
+              singleTime, batchTime, singleTime/batchTime))
+
+        compared = compareCheckpointed(e, t, seqs[:20])
+        print("{}: checkpointed, {} paths identical".format(name, compared))
+
+if __name__ == "__main__":
+    testEngines()